@@ -1,86 +1,68 @@
 #!/usr/bin/env python3
-from time import time
-try:
-    from ev3dev2.motor import LargeMotor, MediumMotor, OUTPUT_A, OUTPUT_B, OUTPUT_C
-    from ev3dev2.sensor import INPUT_1, INPUT_2, INPUT_3
-    from ev3dev2.sensor.lego import TouchSensor, ColorSensor
-    from ev3dev2.sound import Sound
-    from ev3dev2.led import Leds
-except Exception:
-    class MockMotor():
-        def __init__(self, *args, **kwargs):
-            pass
-        def on(self, speed, brake=False, block=False):
-            pass
-            #print("[MOTOR] on:")
-
-        def stop(self):
-            pass
-            #print("[MOTOR] stop")
-
-        def on_for_degrees(self, speed, degrees):
-            pass
-            #print("[MOTOR] on_for_degrees:")
-
-    class MockColorSensor():
-        def __init__(self, *args, **kwargs):
-            pass
-        @property
-        def rgb(self):
-            # Simulate RGB values that randomly match BLACK, WHITE, GREEN, etc.
-            return [
-                (30, 30, 30),  # BLACK
-                (120, 120, 120),  # WHITE
-                (40, 110, 30),  # GREEN
-                (130, 50, 50),  # RED
-                (200, 200, 200)  # BRIGHT WHITE
-            ][int(time() * 1000) % 5]
-
-    class MockTouchSensor():
-        checked = 0
-        def __init__(self, *args, **kwargs):
-            pass
-        @property
-        def is_pressed(self):
-            if self.checked  >= 2:
-                return False
-            self.checked += 1
-            return True
-
-    class MockSound():
-        def __init__(self, *args, **kwargs):
-            pass
-        def play_tone(self, freq, duration):
-            pass
-            #print("[SOUND] Playing tone: Hz fors")
-
-    class MockLeds():
-        def __init__(self, *args, **kwargs):
-            pass
-        def set_color(self, side, color):
-            pass
-            #print("[LED] ")
-
-    # Replace hardware classes with mocks
-    TouchSensor = MockTouchSensor
-    ColorSensor = MockColorSensor
-    LargeMotor = MediumMotor = MockMotor
-    Sound = MockSound
-    Leds = MockLeds
-
-    # Constants to avoid hardware errors
-    INPUT_1 = INPUT_2 = INPUT_3 = None
-    OUTPUT_A = OUTPUT_B = OUTPUT_C = None
+from robot.devices import ON_BRICK, Script, time, sleep
 
 import logging
-from time import sleep
+from robot.colors import TABLE_V1, TABLE_V2
+from robot.calibration import COLORS
+from robot.fleet import POLL as FLEET_POLL, FleetClient
+from robot.fsm import ANY, StateMachine, when
+from robot.governor import SpeedGovernor
+from robot.laps import LapProfile
+from robot.logpipe import LogPipeline
+from robot.loopstats import LoopStats
+from robot.pid import LineFollowerPID
+from robot.routing import JUNCTION, Navigator, TrackGraph
+from robot.runtime import Runtime
+from robot.steering import Steering
+from robot.tuning import load_tuning
 
 # === CONFIGURATION ===
 SOURCE_COLOR = 'GREEN'
 TARGET_COLOR = 'RED'
 BASE_SPEED = 10
+CORRECTION_DEGREES = 13  # wheel degrees the wheel on the line's side backs up in a correction
 LIFT_UP_SPEED = 10
 LIFT_DEGREES = 120
+USE_SAMPLER = False  # read sensors on a background thread (robot/sampler.py)
+SAMPLER_RATE_HZ = 100
+FAST_SYSFS = False  # raw sysfs driver for color sensors and motors (robot/sysfs.py)
+ASYNC_LOGGING = False  # queue log records and print() lines, write them on a background thread (robot/logpipe.py)
+TELEMETRY_FILE = None  # e.g. 'telemetry.bin': binary record of every loop iteration (robot/telemetry.py)
+CALIBRATION_FILE = 'calibration.json'  # color tables from calibration mode, used when present (robot/calibration.py)
+CALIBRATION_HOLD = 2.0  # seconds to hold the button at "ready" to start calibration mode
+TUNING_FILE = None  # e.g. 'tuning.json': settings found by bench/tune.py, applied when main() starts (robot/tuning.py)
+PROFILE = None  # 'cprofile' or 'sample': where the loop's time goes; ROBOT_PROFILE or --profile MODE[:SECONDS] at launch (robot/profiling.py)
+PROFILE_FILE = 'profile'  # written as profile.prof (cprofile) or profile.folded (sample) when profiling stops
+PROFILE_SECONDS = 60.0  # seconds profiled once the robot is started, 0 for until the script stops
+PROFILE_INTERVAL = 0.005  # seconds between stacks taken in sample mode
+FILTER_WINDOW = 3  # last readings per sensor a marker color is voted over, 1 turns filtering off (robot/filter.py)
+FILTER_VOTE = 'majority'  # or 'median': the median rgb of the window must classify as the marker
+LINE_HYSTERESIS = 1  # consecutive readings needed to switch between BLACK and WHITE
+FLEET_COORDINATOR = None  # e.g. 'localhost:7070': reserve stations with the fleet coordinator (robot/fleet.py)
+ROBOT_NAME = None  # name reported to the coordinator, the host name when None
+TRACK_FILE = None  # e.g. 'track.json': stations and junctions to route JOBS over (robot/routing.py)
+JOBS = ((SOURCE_COLOR, TARGET_COLOR),)  # (pickup, drop) colors or layout node names, in order and repeated
+BRANCH_TURN = 45  # degrees to turn onto a left or right branch at a junction
+MARKER_GAP = 100  # wheel degrees; readings of one marker closer together than this count once
+COALESCE_WRITES = True  # skip motor and LED commands that repeat what the hardware is doing (robot/drive.py)
+NON_BLOCKING_STEERING = False  # keep sampling during corrections (robot/steering.py)
+ASYNC_RUNTIME = False  # sensing, control, button, LEDs and log writing as asyncio tasks, station moves awaited (robot/runtime.py)
+SENSE_PERIOD = 0.01  # seconds between steps of each task with ASYNC_RUNTIME
+CONTROL_PERIOD = 0.02
+BUTTON_PERIOD = 0.01
+LED_PERIOD = 0.1
+LOG_PERIOD = 0.5
+FOLLOW_MODE = 'bangbang'  # or 'pid': continuous PID on light intensity (robot/pid.py)
+STRAIGHT_SPEED = 8
+ADAPTIVE_SPEED = True  # speed up on straights, back to STRAIGHT_SPEED at a correction or marker (robot/governor.py)
+BOOST_RATIO = 1.5
+BOOST_RAMP_TIME = 1.0
+LAP_PROFILE_FILE = None  # e.g. 'laps.json': learn where corrections come lap over lap and speed up elsewhere (robot/laps.py)
+LEARNED_SPEED_RATIO = 1.5  # top learned straight speed, times the straight speed
+PID_KP = 30.0
+PID_KI = 0.0
+PID_KD = 1.0
+MAX_SPEED = 20
 
 
 # === STATE MACHINE DEFINITIONS ===
@@ -92,242 +74,550 @@ STATE_TO_TARGET = 3
 STATE_DELIVERING = 4
 STATE_DELIVERED = 5
 
+# States the transport table runs in, with their names for the log.
+TRANSPORT_STATES = {
+    STATE_TO_SOURCE: 'TO_SOURCE',
+    STATE_PICKING_UP: 'PICKING_UP',
+    STATE_TO_TARGET: 'TO_TARGET',
+    STATE_DELIVERING: 'DELIVERING',
+}
+
+# Colors the PID follower steers on; anything else is a marker for the state machine.
+LINE_COLORS = ('WHITE', 'BLACK')
+MARKER_COLORS = ('GREEN', 'RED', JUNCTION)
+
 # === LOGGING SETUP ===
 LOG_FILE = 'robot.log'
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(message)s')
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+log_pipeline = None
+if ASYNC_LOGGING:
+    # With ASYNC_RUNTIME a task of the runtime writes the log instead of a thread.
+    log_pipeline = LogPipeline(LOG_FILE, LOG_FORMAT).install(logging.INFO, capture_stdout=True,
+                                                             thread=not ASYNC_RUNTIME)
+else:
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
+loop_stats = LoopStats('run_transport_cycle')
 
 # logger.basicConfig(level=logging.DEBUG)
 
 # === DEVICE INITIALIZATION ===
+# devices, button, the sensors and motors, sampler, recorder, profiler, the
+# color tables and filters are globals that script sets (robot/devices.py).
+script = Script(globals(), ('color_sensor_l', 'color_sensor_r', 'left_wheel', 'right_wheel', 'lift'))
+steering = None
+
 def init_devices():
-    """Initialize all motors, sensors, sound, and LEDs as global variables."""
-    global touch_sensor, color_sensor_l, color_sensor_r, left_wheel, right_wheel, lift, sound, leds
-    touch_sensor = TouchSensor(INPUT_1)
-    color_sensor_r = ColorSensor(INPUT_2)
-    color_sensor_l = ColorSensor(INPUT_3)
-    left_wheel = LargeMotor(OUTPUT_A)
-    right_wheel = LargeMotor(OUTPUT_B)
-    lift = MediumMotor(OUTPUT_C)
-    sound = Sound()
-    leds = Leds()
+    """Start watching the touch sensor and load the rest in the background."""
+    script.init_devices(button_thread=not ASYNC_RUNTIME)
+
+def attach_devices():
+    """Wait for the background set-up and make the motors and color sensors global variables."""
+    global steering
+    script.attach_devices()
+    steering = Steering(left_wheel, right_wheel, blocking=not (NON_BLOCKING_STEERING or ASYNC_RUNTIME), clock=time)
+
+init_filters, reset_filters, get_readings = script.init_filters, script.reset_filters, script.get_readings
+stop_all_motors, wait_for_button_press = script.stop_all_motors, script.wait_for_button_press
+
+# === FLEET COORDINATION ===
+fleet = None
+
+def join_fleet():
+    """Register with the coordinator at FLEET_COORDINATOR (robot/fleet.py)."""
+    global fleet
+    fleet = FleetClient(FLEET_COORDINATOR, ROBOT_NAME, clock=time)
+    fleet.register()
+
+def leave_fleet():
+    if fleet is not None:
+        fleet.close()
+        fleet.log_summary()
+
+def report_state(state):
+    if fleet is not None:
+        fleet.report('IDLE' if state == STATE_IDLE else TRANSPORT_STATES[state])
+
+def reserve_station(color):
+    """Moves: wait, stopped, until no other robot is at the station of ``color``; False if the button was pressed first."""
+    if fleet is None or fleet.reserve(color):
+        return True
+    set_led_status('pause')
+    try:
+        return (yield from fleet.waiting(color, cancelled=lambda: button.stop_requested, poll=FLEET_POLL))
+    finally:
+        set_led_status('working')
+
+def release_station(color):
+    if fleet is not None:
+        fleet.release(color)
+
+# === LEARNED SPEED PROFILE ===
+lap_profile = None
+
+def init_lap_profile():
+    """Speeds by distance since the last marker (robot/laps.py), carried on from LAP_PROFILE_FILE."""
+    global lap_profile
+    lap_profile = LapProfile(STRAIGHT_SPEED, min(MAX_SPEED, STRAIGHT_SPEED * LEARNED_SPEED_RATIO), markers=MARKER_COLORS)
+    lap_profile.load(LAP_PROFILE_FILE)
+
+def save_lap_profile():
+    if lap_profile is not None:
+        lap_profile.save(LAP_PROFILE_FILE)
+        lap_profile.log_summary()
+
+def straight_speed():
+    """The learned speed for this point of the lap if there is one, else the governor's."""
+    speed = None if lap_profile is None else lap_profile.speed
+    return governor.speed if speed is None else speed
+
+# === ROUTING ===
+navigator = None
+
+def init_navigator():
+    """Load the layout in TRACK_FILE and plan the first of JOBS (robot/routing.py)."""
+    global navigator
+    navigator = Navigator(TrackGraph.load(TRACK_FILE), JOBS, gap=MARKER_GAP)
+    navigator.start_job()
+
+def odometer():
+    """Wheel degrees driven forward, averaged over both wheels."""
+    return (left_wheel.position + right_wheel.position) / 2
+
+def station_color(fixed):
+    """Color of the station being served: the routed job's, else the ``fixed`` one."""
+    return fixed if navigator is None else navigator.graph.nodes[navigator.node]
+
+def station_name(fixed):
+    """Name the fleet coordinator knows the station being served by."""
+    return fixed if navigator is None else navigator.node
+
+def take_branch(branch, reading):
+    """Moves: leave a junction pad onto ``branch`` and drive on; straight on is plain line following."""
+    if branch == 'right':
+        yield from turn(BRANCH_TURN)
+    elif branch == 'left':
+        yield from turn(-BRANCH_TURN)
+    drive_straight(reading)
+
+def release_stations():
+    if fleet is not None:
+        fleet.release_all()
 
 # === LED FEEDBACK ===
 def set_led_status(status):
-    """Set LED color and pattern based on status string. Uses more distinct colors and patterns for clarity."""
-    # Color map: (left_color, right_color)
-    color_map = {
-        'ready':    ('GREEN', 'GREEN'),         # Ready to start
-        'lost':     ('ORANGE', 'ORANGE'),       # Lost line
-        'error':    ('RED', 'RED'),             # Error state
-        'working':  ('GREEN', 'AMBER'),         # Following line/working
-        'pickup':   ('AMBER', 'AMBER'),          # Picking up object
-        'drop':     ('AMBER', 'AMBER'),          # Dropping object
-        'pause':    ('YELLOW', 'RED'),          # Paused
-        'stopped':  ('RED', 'BLACK'),           # Stopped by user
-        'default':  ('BLACK', 'BLACK'),         # All off
-    }
-    left, right = color_map.get(status, color_map['default'])
-    leds.set_color('LEFT', left)
-    leds.set_color('RIGHT', right)
+    """Set LED color and pattern based on status string (robot.devices.LED_STATUS)."""
+    global led_status
+    if runtime is not None and runtime.running:
+        # The LED task shows it.
+        led_status = status
+    else:
+        devices.set_led_status(status)
 
 # === COLOR DETECTION ===
+def check_tables():
+    """Warn when the layout has junction pads that neither color table can read as JUNCTION."""
+    if navigator is None or JUNCTION not in navigator.graph.colors():
+        return
+    if JUNCTION not in left_table.names and JUNCTION not in right_table.names:
+        logger.warning('The layout in %s has junctions but the color tables never read %s: '
+                       'the route cannot branch, calibrate the junction pads (hold the button at ready)',
+                       TRACK_FILE, JUNCTION)
+
+def calibrate_colors():
+    """Calibration mode (robot/calibration.py), with the junction pads when the layout has any."""
+    colors = COLORS
+    if navigator is not None and JUNCTION in navigator.graph.colors():
+        colors += (JUNCTION,)
+    script.calibrate_colors(colors)
+    check_tables()
+
 def get_color(sensor):
     """Return color string based on RGB values from a ColorSensor."""
-    r, g, b = sensor.rgb
-
-    # #print(r,g,b)
-    if b > 100:
-        return 'WHITE'
-    if r < 60 and g > 60 and b < 80:
-        return 'GREEN'
-    if r > 100 and g<60:
-        return 'RED'
-    if r < 100 and g<100 and b<100:
-        return 'BLACK'
-    return 'WHITE'
+    return devices.get_color(sensor, TABLE_V1)
 
 def get_color2(sensor):
     """Return color string based on RGB values from a ColorSensor."""
     try:
-        r, g, b = sensor.rgb
+        return devices.get_color(sensor, TABLE_V2)
     except Exception as e:
         logger.error('Sensor read error: ', e)
         set_led_status('error')
         return 'UNKNOWN'
-    if r > 100 and g > 100 and b > 100:
-        return 'WHITE'
-    # if r < 70 and g < 120 and b > 100:
-    #     return 'BLUE'
-    if r < 50 and g > 100 and b < 40:
-        return 'GREEN'
-    if r < 100 and g < 100 and b < 100:
-        return 'BLACK'
-    if r > 120 and g < 60 and b < 60:
-        return 'RED'
-    # if r > 120 and g > 100 and b < 60:
-    #     return 'YELLOW'
-    return 'WHITE'
 
 def go(left, right):
-    left_wheel.on(left)
-    right_wheel.on(right)
+    steering.cancel()
+    devices.go(left, right)
     # right_wheel.on_for_degrees(right, 25, block=False, brake=False)
     # left_wheel.on_for_degrees(left, 25, block=False, brake=False)
 
 # === ACTIONS ===
-def turn_to_pick_up(turn_right):
-    """Raise the lift to pick up an object."""
-    set_led_status('pickup')
-    #print("starting pickup")
-
-    if turn_right:
-        turn(90)
+# The moves at stations and junctions are written once, as generators: a
+# move is started with block=False and what to wait for is yielded, the
+# motors making it or seconds to pause. perform() runs them to the end in
+# the sequential loop; under the runtime it awaits them in a task, so
+# sensing and the button carry on meanwhile (robot/runtime.py).
+def perform(moves):
+    """Run ``moves``: blocking, or as the station task the control task waits for when the runtime runs."""
+    global station_task
+    if runtime is not None and runtime.running:
+        station_task = runtime.start(station(moves))
     else:
-        turn(-90)
+        run_moves(moves)
 
-    go(BASE_SPEED,BASE_SPEED)
-    sleep(1)
-    # go(0,0)
-    #print("starting going to box")
-    
+def run_moves(moves):
+    for wait in moves:
+        if isinstance(wait, tuple):
+            for motor in wait:
+                motor.wait_until_not_moving()
+        else:
+            sleep(wait)
 
-def drive_to_source(lift_direction):
-    # lcol, rcol = get_colors()
-    # #print("adjusting before box")2
+def turn(degrees):
+    degrees <<= 1
+    right_wheel.on_for_degrees(BASE_SPEED, degrees, block=False)
+    left_wheel.on_for_degrees(BASE_SPEED, -degrees, block=False)
+    yield left_wheel, right_wheel
+
+def forward(degrees):
+    right_wheel.on_for_degrees(BASE_SPEED, degrees, block=False)
+    left_wheel.on_for_degrees(BASE_SPEED, degrees, block=False)
+    yield left_wheel, right_wheel
+
+def move_lift(direction):
+    lift.on_for_degrees(LIFT_UP_SPEED, LIFT_DEGREES * direction, block=False)
+    yield (lift,)
+
+def halt():
+    """Moves: stop, and pause a sensing period so the other tasks have their turn before the next command."""
+    stop_all_motors()
+    yield SENSE_PERIOD
+
+def turn_to_pick_up(turn_right):
+    """Moves: turn onto the station's spur and drive in."""
+    set_led_status('pickup')
+    yield from turn(90 if turn_right else -90)
+    go(BASE_SPEED, BASE_SPEED)
+    yield 1
 
+def drive_to_source(lift_direction):
+    """Moves: raise (1) or lower (-1) the lift at the pad and turn back towards the line."""
     if lift_direction == -1:
-        lift.on_for_degrees(LIFT_UP_SPEED, LIFT_DEGREES * lift_direction)
-        turn(180)
-        right_wheel.on_for_degrees(BASE_SPEED, 100, block=False)
-        left_wheel.on_for_degrees(BASE_SPEED, 100, block=True)
+        yield from move_lift(lift_direction)
+        yield from turn(180)
+        yield from forward(100)
         return
+    yield from forward(100)
+    yield from move_lift(lift_direction)
+    yield from forward(-100)
+    yield from turn(180)
+
+def arrival(color, turn_right):
+    """Moves: wait for the station, then turn onto its spur."""
+    yield from halt()
+    if (yield from reserve_station(color)):
+        yield from turn_to_pick_up(turn_right)
+
+def pick_up():
+    global special_black
+    yield from halt()
+    yield from drive_to_source(lift_direction=1)
+    special_black = time()
+    release_station(station_name(SOURCE_COLOR))
 
-    right_wheel.on_for_degrees(BASE_SPEED, 100, block=False)
-    left_wheel.on_for_degrees(BASE_SPEED, 100, block=True)
-    #print("picking up box")
-    lift.on_for_degrees(LIFT_UP_SPEED, LIFT_DEGREES * lift_direction)
-    right_wheel.on_for_degrees(BASE_SPEED, -100, block=False)
-    left_wheel.on_for_degrees(BASE_SPEED, -100, block=True)
-    turn(180)
-    # pass
+def delivery():
+    yield from halt()
+    yield from drive_to_source(lift_direction=-1)
+    release_station(station_name(TARGET_COLOR))
 
 # === MOTOR SAFETY ===
-def stop_all_motors():
-    """Stop all drive and lift motors."""
-    logger.info('Stopping all motors')
-    left_wheel.on(0, brake=False, block=False)
-    right_wheel.on(0, brake=False, block=False)
-    left_wheel.stop()
-    right_wheel.stop()
-    lift.on(0, brake=False, block=False)
-    lift.stop()
-
 # === LINE FOLLOWING ===
-def get_colors() -> (str, str):
-    """Perform one step of proportional line following. Returns detected colors."""
-    lcol = get_color(color_sensor_l)
-    rcol = get_color(color_sensor_r)
-    return lcol, rcol
-
 # === BUTTON HANDLING ===
-def wait_for_button_press(prompt='Waiting for button press to start...'):
-    """Block until the touch sensor is pressed and released."""
-    #print(prompt)
-    logger.info('Awaiting button press: %s', prompt)
-    set_led_status('ready')
-    while not touch_sensor.is_pressed:
-        sleep(0.05)
-    while touch_sensor.is_pressed:
-        sleep(0.05)
-    logger.info('Button pressed')
-    set_led_status('working')
-
 
 
-def turn(degrees):
-    degrees <<= 1
-    right_wheel.on_for_degrees(BASE_SPEED, degrees, block=False)
-    left_wheel.on_for_degrees(BASE_SPEED, -degrees, block=True)
+follower = None
+special_black = False
 
+# === TRANSPORT TABLE ===
+# Actions and hooks take the reading (lrgb, rrgb, lcol, rcol) (robot/fsm.py).
+def follow_pid(reading):
+    lrgb, rrgb, lcol, rcol = reading
+    go(*follower.update(lrgb, rrgb, time()))
+
+def drive_straight(reading):
+    steering.clear()
+    speed = straight_speed()
+    go(speed, speed)
+
+def correct_right(reading):
+    steering.correct('right', BASE_SPEED, right_degrees=-CORRECTION_DEGREES)
+
+def correct_left(reading):
+    steering.correct('left', BASE_SPEED, left_degrees=-CORRECTION_DEGREES)
+
+def search_line(reading):
+    # both BLACK, turn in previous dirction
+    go(-BASE_SPEED, BASE_SPEED)
+    if lap_profile is not None:
+        lap_profile.trouble(odometer())
+
+def arrive_at_source(reading):
+    perform(arrival(station_name(SOURCE_COLOR), reading[3] == station_color(SOURCE_COLOR)))
+
+def pick_up_load(reading):
+    perform(pick_up())
+
+def arrive_at_target(reading):
+    perform(arrival(station_name(TARGET_COLOR), reading[3] == station_color(TARGET_COLOR)))
+
+def deliver_load(reading):
+    perform(delivery())
+
+def at_marker(reading):
+    """A marker on the way: stop if it is the job's station, take the route's branch or drive over it."""
+    lrgb, rrgb, lcol, rcol = reading
+    step = navigator.arrive(lcol if lcol in MARKER_COLORS else rcol, odometer())
+    if step is not None:
+        what, node, branch = step
+        if what == 'pickup':
+            return STATE_PICKING_UP
+        if what == 'drop':
+            return STATE_DELIVERING
+        if what == 'branch':
+            perform(take_branch(branch, reading))
+            return
+    drive_straight(reading)
+
+# Routed stations are left on their own color, whichever it is.
+LEAVING = {STATE_PICKING_UP: STATE_TO_TARGET, STATE_DELIVERING: STATE_TO_SOURCE}
+
+def at_station_pad(reading):
+    if station_color(None) in (reading[2], reading[3]):
+        return LEAVING[machine.state]
+    search_line(reading)
+
+def transport_rules():
+    """(state, left color, right color, action, next state) rules, the first match wins."""
+    if FOLLOW_MODE == 'pid':
+        rules = [when(ANY, LINE_COLORS, LINE_COLORS, follow_pid)]
+    else:
+        # !!!! reersed color sensors !!!
+        rules = [
+            when(ANY, 'WHITE', 'WHITE', drive_straight),
+            when(ANY, 'BLACK', 'WHITE', correct_right),
+            when(ANY, 'WHITE', 'BLACK', correct_left),
+        ]
+    # Left sensor on white: carry on, a marker under the right one alone is ignored.
+    rules.append(when(ANY, 'WHITE', ANY))
+    if navigator is not None:
+        moving = (STATE_TO_SOURCE, STATE_TO_TARGET)
+        stations = (STATE_PICKING_UP, STATE_DELIVERING)
+        return rules + [
+            when(moving, MARKER_COLORS, ANY, at_marker, then=stations),
+            when(moving, ANY, MARKER_COLORS, at_marker, then=stations),
+            when(stations, MARKER_COLORS, ANY, at_station_pad, then=moving),
+            when(stations, ANY, MARKER_COLORS, at_station_pad, then=moving),
+            when(ANY, ANY, ANY, search_line),
+        ]
+    return rules + [
+        when(STATE_TO_SOURCE, SOURCE_COLOR, ANY, then=STATE_PICKING_UP),
+        when(STATE_TO_SOURCE, ANY, SOURCE_COLOR, then=STATE_PICKING_UP),
+        when(STATE_PICKING_UP, SOURCE_COLOR, ANY, then=STATE_TO_TARGET),
+        when(STATE_PICKING_UP, ANY, SOURCE_COLOR, then=STATE_TO_TARGET),
+        when(STATE_TO_TARGET, TARGET_COLOR, ANY, then=STATE_DELIVERING),
+        when(STATE_TO_TARGET, ANY, TARGET_COLOR, then=STATE_DELIVERING),
+        when(STATE_DELIVERING, TARGET_COLOR, ANY, then=STATE_TO_SOURCE),
+        when(STATE_DELIVERING, ANY, TARGET_COLOR, then=STATE_TO_SOURCE),
+        when(ANY, ANY, ANY, search_line),
+    ]
+
+machine = None
+governor = None
+
+def init_machine():
+    """Compile the transport table (robot/fsm.py), logging what validation finds, and set up the speed governor and PID follower."""
+    global machine, governor, follower
+    follower = LineFollowerPID(BASE_SPEED, PID_KP, PID_KI, PID_KD, max_speed=MAX_SPEED)
+    if TRACK_FILE:
+        init_navigator()
+    ceiling = min(MAX_SPEED, STRAIGHT_SPEED * BOOST_RATIO) if ADAPTIVE_SPEED else STRAIGHT_SPEED
+    if LAP_PROFILE_FILE:
+        init_lap_profile()
+    governor = SpeedGovernor(STRAIGHT_SPEED, ceiling, BOOST_RAMP_TIME)
+    hooks = {
+        STATE_PICKING_UP: arrive_at_source,
+        STATE_TO_TARGET: pick_up_load,
+        STATE_DELIVERING: arrive_at_target,
+        STATE_TO_SOURCE: deliver_load,
+    }
+    machine = StateMachine('transport', TRANSPORT_STATES, transport_rules(), STATE_TO_SOURCE, on_enter=hooks)
+    machine.check()
 
-special_black = False
 # === MAIN TRANSPORT ROUTINE WITH STATE MACHINE ===
 def run_transport_cycle(state):
     """Run a single transport cycle using a state machine."""
-    last_state=1
-    prev_states = [None, None, None]
-    global special_black
+    loop_stats.start()
+    reset_filters()
+    follower.reset()
+    governor.reset()
+    if lap_profile is not None:
+        lap_profile.reset()
+    machine.reset(state)
+    report_state(state)
     while True:
-        lcol, rcol = get_colors()
-        
-        # if prev_states != [lcol, rcol, state]:
-        #     prev_states = [lcol, rcol, state]
-        #     print(lcol, rcol, state)
-        #     print(color_sensor_l.rgb,color_sensor_r.rgb)
-        if touch_sensor.is_pressed:
-            stop_all_motors()
-            logger.info('Button pressed, stopping')
-            sleep(0.5)
-            while(not touch_sensor.is_pressed):
-                pass
-            return STATE_IDLE
-        if 'WHITE' == rcol:
-            # !!!! reersed color sensors !!!
-            if lcol == 'WHITE':
-                go(8, 8)
-                continue
-            elif(lcol == 'BLACK'):
-                right_wheel.on_for_degrees(BASE_SPEED, -13, block=True)
-                continue
-        if 'WHITE' == lcol:
-            if(rcol == 'BLACK'):
-                left_wheel.on_for_degrees(BASE_SPEED, -13, block=True)
-                last_state = -1
-                continue
-                
-        elif state == STATE_TO_SOURCE and (lcol == SOURCE_COLOR or rcol == SOURCE_COLOR):
-            stop_all_motors()
-            turn_to_pick_up(rcol == SOURCE_COLOR)
-            state = STATE_PICKING_UP
-
-        elif state == STATE_PICKING_UP and (lcol == SOURCE_COLOR or rcol == SOURCE_COLOR):
-            stop_all_motors()
-            drive_to_source(lift_direction=1)
-            state = STATE_TO_TARGET
-            special_black = time()
-
-        elif state ==  STATE_TO_TARGET and lcol == TARGET_COLOR or rcol == TARGET_COLOR:
-            stop_all_motors()
-            turn_to_pick_up(rcol == TARGET_COLOR)
-            state = STATE_DELIVERING
-
-        elif state ==  STATE_DELIVERING and lcol == TARGET_COLOR or rcol == TARGET_COLOR:
-            stop_all_motors()
-            drive_to_source(lift_direction=-1)
-            state = STATE_TO_SOURCE
-
-        # both BLACK, turn in previous dirction
-        else:
-            last_state = -1
-            go(BASE_SPEED*last_state,-BASE_SPEED*last_state)
-
-    return state
+        loop_stats.tick()
+        if profiler is not None:
+            profiler.check()
+        reading = get_readings()
+        if recorder is not None:
+            lrgb, rrgb, lcol, rcol = reading
+            recorder.record(time(), lrgb, rrgb, lcol, rcol, machine.state, left_wheel, right_wheel, lift)
+        if button.stop_requested:
+            return stop_transport_cycle()
+        if ADAPTIVE_SPEED:
+            governor.update(reading[2], reading[3], time())
+        if lap_profile is not None:
+            lap_profile.update(reading[2], reading[3], odometer(), time())
+        next_state = machine.step(reading)
+        if next_state != state:
+            state = next_state
+            reset_filters()
+            report_state(state)
+
+def stop_transport_cycle():
+    """Stop after a button press and wait for the next one; returns STATE_IDLE."""
+    stop_all_motors()
+    release_stations()
+    report_state(STATE_IDLE)
+    loop_stats.log_summary()
+    steering.log_summary()
+    logger.info('Button pressed, stopping')
+    sleep(0.5)
+    button.wait_for_press()
+    return STATE_IDLE
+
+# === ASYNC RUNTIME ===
+# With ASYNC_RUNTIME a cycle runs as periodic tasks on an event loop
+# (robot/runtime.py) and the moves at stations and junctions are awaited
+# (perform), so the sensors, the button and the LEDs are served while the
+# robot turns or lifts.
+runtime = None
+latest = None
+led_status = None
+station_task = None
+
+def sense():
+    """Sensing task: read and classify both sensors."""
+    global latest
+    latest = get_readings()
+    if recorder is not None:
+        lrgb, rrgb, lcol, rcol = latest
+        recorder.record(time(), lrgb, rrgb, lcol, rcol, machine.state, left_wheel, right_wheel, lift)
+
+def control():
+    """Control task: step the state machine on the latest reading, unless a station's moves are in flight."""
+    if latest is None or (station_task is not None and not station_task.done()):
+        return
+    loop_stats.tick()
+    if profiler is not None:
+        profiler.check()
+    reading = latest
+    if ADAPTIVE_SPEED:
+        governor.update(reading[2], reading[3], time())
+    if lap_profile is not None:
+        lap_profile.update(reading[2], reading[3], odometer(), time())
+    state = machine.state
+    if machine.step(reading) != state:
+        reset_filters()
+        report_state(machine.state)
+
+def check_button():
+    """Button task: read the touch sensor unless it is fed, end the cycle at a press."""
+    if not button.fed:
+        button.poll()
+    if button.stop_requested:
+        runtime.stop()
+
+def update_leds():
+    """LED task: show the last status set."""
+    global led_status
+    if led_status is not None:
+        devices.set_led_status(led_status)
+        led_status = None
+
+async def station(moves):
+    """Await ``moves`` (see perform) on the runtime."""
+    try:
+        for wait in moves:
+            if isinstance(wait, tuple):
+                await runtime.motion(*wait)
+            else:
+                await runtime.sleep(wait)
+    finally:
+        moves.close()
+        # The readings taken while turning and lifting say nothing about the line.
+        reset_filters()
+
+def run_async_cycle(state):
+    """run_transport_cycle as tasks on the runtime; returns when the button stops it."""
+    global runtime, latest, station_task
+    loop_stats.start()
+    reset_filters()
+    follower.reset()
+    governor.reset()
+    if lap_profile is not None:
+        lap_profile.reset()
+    machine.reset(state)
+    report_state(state)
+    latest = station_task = None
+    runtime = Runtime(on_brick=ON_BRICK)
+    runtime.every('sense', SENSE_PERIOD, sense)
+    runtime.every('control', CONTROL_PERIOD, control)
+    runtime.every('button', BUTTON_PERIOD, check_button)
+    runtime.every('leds', LED_PERIOD, update_leds)
+    if log_pipeline is not None:
+        runtime.every('log', LOG_PERIOD, log_pipeline.flush)
+    try:
+        runtime.run()
+    finally:
+        update_leds()
+        runtime.log_summary()
+        runtime.close()
+        runtime = None
+    return stop_transport_cycle()
 
 # === MAIN ENTRY POINT ===
 def main():
     """Main program loop handling repeated transport cycles and safe shutdown."""
+    if TUNING_FILE:
+        load_tuning(TUNING_FILE, globals(), 'Transporter')
+    init_machine()
+    init_filters()
     init_devices()
     state = STATE_TO_SOURCE
     try:
-
+        # The motors and color sensors finish loading while waiting for the first press.
+        calibrating = wait_for_button_press()
+        attach_devices()
+        script.load_calibration()
+        check_tables()
+        while calibrating:
+            calibrate_colors()
+            calibrating = wait_for_button_press()
+        if USE_SAMPLER:
+            script.start_sampler()
+        if TELEMETRY_FILE:
+            script.start_recorder()
+        script.start_profiling()
+        if FLEET_COORDINATOR:
+            join_fleet()
         while True:
-            wait_for_button_press()
             while state != STATE_IDLE:
-                state = run_transport_cycle(state)
+                state = run_async_cycle(state) if ASYNC_RUNTIME else run_transport_cycle(state)
             # After button stop, go back to IDLE (wait for next press)
             state = STATE_TO_SOURCE
+            while wait_for_button_press():
+                calibrate_colors()
     except KeyboardInterrupt:
         stop_all_motors()
         #print('KeyboardInterrupt, motors stopped')
@@ -339,6 +629,23 @@ def main():
     finally:
         stop_all_motors()
         set_led_status('error')
+        script.stop_sampler()
+        script.stop_recorder()
+        script.stop_profiling()
+        leave_fleet()
+        button.log_stats()
+        devices.log_summary()
+        loop_stats.log_summary()
+        if left_filter is not None:
+            left_filter.log_summary('Left')
+            right_filter.log_summary('Right')
+        if steering is not None:
+            steering.log_summary()
+        if governor is not None:
+            governor.log_summary()
+        save_lap_profile()
+        if navigator is not None:
+            navigator.log_summary()
 
 if __name__ == '__main__':
     main()
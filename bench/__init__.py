@@ -0,0 +1 @@
+"""Offline benchmarks and checks, run from the repo root with ``python3 -m bench.<name>``."""
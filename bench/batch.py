@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""The NumPy batch simulator (robot/batch.py) checked against lineFollower in robot.sim, and timed.
+
+    python3 -m bench.batch [--robots 16384] [--duration S] [--tracks plain,oval,wide,tight]
+                           [--verify 8] [--verify-duration S] [--seed N] [--set NAME=VALUE,...]
+
+A population of ``--robots`` is spread over the tracks: each starts at a
+random point of its track's centreline, up to 5mm to the side and 0.1 rad
+off its heading, with sensor noise of 1-5 and brightness 0.9-1.1.
+
+- verify: ``--verify`` robots of the population are run one at a time
+  through lineFollower.run_transport_cycle in a World, and as a batch.
+  Without noise the batch senses for itself, so poses, readings and
+  timing must all come out the same. With noise the batch is given the
+  World's readings, which checks the decisions on noisy input. For each
+  robot the table gives the ticks compared, the first tick whose reading
+  (time, rgb, colors) differs and the first motor command that differs.
+  Both must be '-'. It also gives how far apart the robots ended. Lost
+  robots are not given up here, as the World does not give up;
+- throughput: robot-seconds simulated per wall second for the first
+  SCALAR_ROBOTS of the population run one at a time in a World with
+  bench.controllers' Probe, as run_one evaluates a controller, against
+  the whole population as one batch. Both measure progress and give up
+  robots lost for GIVE_UP seconds. The batch must be at least TARGET
+  times faster. After it, progress (laps per hour), line losses and
+  robots given up per track.
+
+The run exits non-zero if a robot differs or the batch misses TARGET.
+
+``--set`` overrides lineFollower's configuration globals for both.
+"""
+import logging
+import math
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from bench.controllers import REPO, TRACKS, Probe, option, parse_overrides
+from robot import sim
+from robot.batch import Batch
+
+# How many times the robot-seconds per second of the one-at-a-time loop the batch must reach.
+TARGET = 100
+# Robots timed one at a time: their speed varies with how long they follow the line.
+SCALAR_ROBOTS = 16
+
+
+def load(overrides):
+    module = sim.load_script(os.path.join(REPO, 'lineFollower.py'))
+    for setting, value in overrides:
+        setattr(module, setting, value)
+    return module
+
+
+def population(count, tracks, seed):
+    """(track of each robot, starts, noise, brightness) drawn for ``count`` robots."""
+    rng = np.random.default_rng(seed)
+    track_of = rng.integers(len(tracks), size=count)
+    starts = np.zeros((count, 3))
+    for i, t in enumerate(track_of):
+        x, y, heading = tracks[t].centreline_pose(rng.random())
+        side = rng.uniform(-5.0, 5.0)
+        starts[i] = (x - side * math.sin(heading), y + side * math.cos(heading), heading + rng.uniform(-0.1, 0.1))
+    return track_of, starts, rng.uniform(1.0, 5.0, count), rng.uniform(0.9, 1.1, count)
+
+
+def scalar_run(overrides, track, start, duration, noise, brightness, seed, probe=False):
+    """lineFollower's transport cycle in a World from ``start``: (world, [(time, lrgb, rrgb, lcol, rcol)]).
+    With ``probe``, bench.controllers' Probe measures the run and ends it if the robot is lost."""
+    world = sim.set_world(sim.World(track, seed=seed, duration=duration, presses=(), noise=noise,
+                                    brightness=brightness))
+    world.x, world.y, world.heading = start
+    world.commands = []
+    if probe:
+        world.listeners.append(Probe(world))
+    module = load(overrides)
+    module.init_machine()
+    module.init_filters()
+    module.init_devices()
+    module.attach_devices()
+    readings = []
+    get_readings = module.get_readings
+
+    def recorded():
+        reading = get_readings()
+        readings.append((world.now,) + reading)
+        return reading
+    module.get_readings = recorded
+    try:
+        module.run_transport_cycle(module.STATE_FOLLOWING)
+    except sim.SimulationEnd:
+        pass
+    return world, readings
+
+
+def first_difference(a, b):
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return None if len(a) == len(b) else min(len(a), len(b))
+
+
+def verify(overrides, names, tracks, robots, track_of, starts, noise, brightness, duration, seed):
+    print('verify: %d robots, %.0fs each' % (len(robots), duration))
+    print('%-6s %-6s %-6s %7s %16s %16s %12s' % ('robot', 'track', 'noise', 'ticks', 'reading differs',
+                                                  'command differs', 'pose apart'))
+    failures = 0
+    for noisy in (False, True):
+        for robot in robots:
+            track = tracks[track_of[robot]]
+            level = noise[robot] if noisy else 0.0
+            world, readings = scalar_run(overrides, track, starts[robot], duration, level, brightness[robot],
+                                         seed + robot)
+            replay = {0: [(r[1], r[2]) for r in readings]} if noisy else None
+            batch = Batch(load(overrides), [track], [0], [starts[robot]], duration, noise=level,
+                          brightness=brightness[robot], seed=seed, record=[0], replay=replay, give_up=None).run()
+            reading = first_difference(readings, batch.readings[0])
+            command = first_difference(world.commands, batch.commands[0])
+            apart = math.hypot(world.x - batch.x[0], world.y - batch.y[0])
+            failures += reading is not None or command is not None
+            print('%-6d %-6s %-6.1f %7d %16s %16s %10.3fmm' % (
+                robot, names[track_of[robot]], level, len(readings), '-' if reading is None else reading,
+                '-' if command is None else command, apart))
+    return failures
+
+
+def throughput(overrides, names, tracks, track_of, starts, noise, brightness, duration, seed):
+    """How many times faster the batch simulates than the one-at-a-time loop."""
+    robots = range(min(SCALAR_ROBOTS, len(track_of)))
+    simulated = 0.0
+    start = perf_counter()
+    for robot in robots:
+        world, _ = scalar_run(overrides, tracks[track_of[robot]], starts[robot], duration, noise[robot],
+                              brightness[robot], seed + robot, probe=True)
+        simulated += world.now
+    scalar = simulated / (perf_counter() - start)
+
+    start = perf_counter()
+    batch = Batch(load(overrides), tracks, track_of, starts, duration, noise=noise, brightness=brightness,
+                  seed=seed).run()
+    wall = perf_counter() - start
+    metrics = batch.metrics()
+    simulated = metrics['sim_time'].sum()
+    print('\nthroughput, %.0fs per robot' % duration)
+    print('%-26s %14s' % ('', 'robot-s per s'))
+    print('%-26s %14.0f  (%d robots)' % ('one at a time, with Probe', scalar, len(robots)))
+    print('%-26s %14.0f  (%.0fx, %d robots in %.1fs, %d steps)' % (
+        'batch', simulated / wall, simulated / wall / scalar, batch.count, wall, batch.steps))
+
+    print('\n%-7s %7s %8s %12s %8s' % ('track', 'robots', 'laps/h', 'losses/min', 'gave up'))
+    for t, name in enumerate(names):
+        mine = track_of == t
+        hours = metrics['sim_time'][mine] / 3600.0
+        print('%-7s %7d %8.1f %12.2f %7.0f%%' % (
+            name, mine.sum(), np.mean(metrics['lap_progress'][mine] / hours),
+            np.mean(metrics['line_loss_events'][mine] / hours / 60.0), 100.0 * metrics['gave_up'][mine].mean()))
+    return simulated / wall / scalar
+
+
+def main(argv):
+    count = int(option(argv, '--robots', '16384'))
+    duration = float(option(argv, '--duration', '60'))
+    names = option(argv, '--tracks', ','.join(sorted(TRACKS))).split(',')
+    checked = int(option(argv, '--verify', '8'))
+    verify_duration = float(option(argv, '--verify-duration', '30'))
+    seed = int(option(argv, '--seed', '0'))
+    overrides = parse_overrides(option(argv, '--set', ''))
+    # Keep the script's logging.basicConfig from writing robot.log.
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+    tracks = [TRACKS[name]() for name in names]
+    track_of, starts, noise, brightness = population(count, tracks, seed)
+
+    failures = verify(overrides, names, tracks, range(min(checked, count)), track_of, starts, noise, brightness,
+                      verify_duration, seed) if checked else 0
+    speedup = throughput(overrides, names, tracks, track_of, starts, noise, brightness, duration, seed)
+    if failures:
+        print('\n%d robots differ from the scalar code' % failures)
+    if speedup < TARGET:
+        print('\nFAILED: the batch is %.0fx the one-at-a-time loop (at least %dx)' % (speedup, TARGET))
+    return 1 if failures or speedup < TARGET else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
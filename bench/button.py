@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Button handling: polling loops against the ButtonWatcher.
+
+    python3 -m bench.button [--presses N] [--idle S]
+
+A stand-in touch sensor reads a value0 file the way ev3dev2 does (open,
+read, parse on every access) and a timer thread "presses" it by
+rewriting the file. Three things are measured, each the old way and with
+robot.button.ButtonWatcher:
+
+- idle CPU: CPU time per wall-clock second while waiting ``--idle``
+  seconds for a press, with the busy ``while not is_pressed: pass`` of
+  the stop path and with wait_for_press();
+- press latency: from the file being rewritten to the waiter returning,
+  for the 50 ms polling of wait_for_button_press() and for the watcher;
+- per-tick cost: reading ``is_pressed`` in the control loop against
+  checking ``stop_requested``.
+
+On the brick the sensor file read costs far more than here, so the
+numbers of the polling variants only get worse there.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from time import perf_counter, process_time, sleep
+
+from robot.button import ButtonWatcher
+
+
+class FileTouchSensor():
+    """TouchSensor stand-in reading ``value0`` on every access."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def is_pressed(self):
+        with open(self.path) as f:
+            return int(f.read()) == 1
+
+
+def write_value(path, value):
+    # In place and without truncating, so a concurrent read never sees an empty file.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+    os.pwrite(fd, value, 0)
+    os.close(fd)
+
+
+def press_after(path, delay, stamps):
+    """Rewrite ``path`` to 1 after ``delay`` seconds on a timer, recording when."""
+    def press():
+        write_value(path, b'1\n')
+        stamps.append(perf_counter())
+    timer = threading.Timer(delay, press)
+    timer.start()
+    return timer
+
+
+def release(path):
+    write_value(path, b'0\n')
+
+
+# === WAITS ===
+def busy_wait(sensor, watcher):
+    while not sensor.is_pressed:
+        pass
+
+
+def poll_wait(sensor, watcher):
+    while not sensor.is_pressed:
+        sleep(0.05)
+
+
+def watcher_wait(sensor, watcher):
+    watcher.wait_for_press()
+
+
+WAITS = (('busy loop', busy_wait), ('50 ms poll', poll_wait), ('watcher', watcher_wait))
+
+
+def idle_cpu(path, sensor, wait, seconds):
+    """CPU seconds used per second of waiting for a press that comes after ``seconds``."""
+    release(path)
+    watcher = ButtonWatcher(sensor).start()
+    sleep(0.05)
+    stamps = []
+    start_wall, start_cpu = perf_counter(), process_time()
+    press_after(path, seconds, stamps)
+    wait(sensor, watcher)
+    cpu, wall = process_time() - start_cpu, perf_counter() - start_wall
+    watcher.stop()
+    return cpu / wall
+
+
+def press_latencies(path, sensor, wait, presses):
+    """Seconds from each press to ``wait`` returning."""
+    latencies = []
+    rng = random.Random(1)
+    watcher = ButtonWatcher(sensor).start()
+    for _ in range(presses):
+        release(path)
+        sleep(0.03)
+        stamps = []
+        timer = press_after(path, rng.uniform(0.05, 0.15), stamps)
+        wait(sensor, watcher)
+        woke = perf_counter()
+        timer.join()
+        latencies.append(max(0.0, woke - stamps[0]))
+    watcher.stop()
+    return sorted(latencies)
+
+
+def tick_cost(sensor, watcher, calls=20000):
+    """Microseconds per stop check: sensor read against the watcher's flag."""
+    start = perf_counter()
+    for _ in range(calls):
+        sensor.is_pressed
+    read = (perf_counter() - start) / calls
+    start = perf_counter()
+    for _ in range(calls):
+        watcher.stop_requested
+    flag = (perf_counter() - start) / calls
+    return read * 1e6, flag * 1e6
+
+
+def main(argv):
+    presses = int(argv[argv.index('--presses') + 1]) if '--presses' in argv else 30
+    idle = float(argv[argv.index('--idle') + 1]) if '--idle' in argv else 1.0
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'value0')
+    try:
+        release(path)
+        sensor = FileTouchSensor(path)
+        print('idle CPU while waiting %.1fs for a press (CPU s per s)' % idle)
+        for label, wait in WAITS:
+            if wait is not poll_wait:
+                print('  %-11s %.3f' % (label, idle_cpu(path, sensor, wait, idle)))
+        print('press latency over %d presses, ms: median p90 max' % presses)
+        for label, wait in WAITS[1:]:
+            latencies = press_latencies(path, sensor, wait, presses)
+            print('  %-11s %6.1f %6.1f %6.1f' % (label, latencies[len(latencies) // 2] * 1e3,
+                                                 latencies[int(len(latencies) * 0.9)] * 1e3, latencies[-1] * 1e3))
+        release(path)
+        read, flag = tick_cost(sensor, ButtonWatcher(sensor))
+        print('per-tick stop check: is_pressed read %.2f us, stop_requested %.3f us' % (read, flag))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Calibrated color tables against the fixed thresholds under changing light.
+
+    python3 -m bench.calibration [--brightness 0.4,0.6,0.8,1.0,1.2]
+                                 [--noise 3] [--readings N] [--samples N]
+
+For every brightness the simulator's mat is calibrated the way the robot
+does it (robot/calibration.py): both sensors are sampled on each surface
+color, then the classifiers are fitted and compiled. Then the calibrated
+tables, TABLE_V1 and TABLE_V2 classify fresh simulated readings of every
+surface and of sensors straddling the line edge (a white and black mix;
+the truth is whichever covers more of the spot). Reported per table: the
+share of wrong labels, of edge readings taken for a marker color (a
+spurious station) and of marker readings missed (a missed station). A
+calibration refused as too ambiguous is reported with its margin and its
+tables are still evaluated, to show why.
+"""
+import random
+import sys
+
+from bench.controllers import option
+from robot import sim
+from robot.calibration import Calibration, MIN_SEPARATION, sample
+from robot.colors import TABLE_V1, TABLE_V2
+
+PORTS = (('color_sensor_l', sim.INPUT_3), ('color_sensor_r', sim.INPUT_2))
+MARKERS = ('GREEN', 'RED')
+
+
+def uniform_track(surface):
+    track = sim.Track(200.0, 200.0)
+    track.pixels[:] = bytes((surface,)) * len(track.pixels)
+    track.start = (100.0, 100.0, 0.0)
+    return track
+
+
+def calibrate_in_sim(brightness, noise, samples, seed):
+    """{sensor: {color: [rgb]}} sampled on the simulated mat, as calibration mode does."""
+    readings = dict((name, {}) for name, _ in PORTS)
+    for surface, color in enumerate(sim.SURFACE_NAMES):
+        sim.set_world(sim.World(uniform_track(surface), seed=seed + surface, noise=noise, brightness=brightness))
+        sensors = dict((name, sim.ColorSensor(port)) for name, port in PORTS)
+        for name, values in sample(sensors, samples).items():
+            readings[name][color] = values
+    return readings
+
+
+def test_readings(brightness, noise, count, rng):
+    """[(rgb, true color, kind)] like World.read_rgb: a 9-point spot, scaled and noisy."""
+    white, black = sim.SURFACE_RGB[sim.WHITE], sim.SURFACE_RGB[sim.BLACK]
+    readings = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            surface = rng.randrange(len(sim.SURFACE_NAMES))
+            mix = [sim.SURFACE_RGB[surface]] * 9
+            truth, kind = sim.SURFACE_NAMES[surface], 'marker' if surface in (sim.GREEN, sim.RED) else 'line'
+        else:
+            whites = rng.randrange(1, 9)
+            mix = [white] * whites + [black] * (9 - whites)
+            truth, kind = 'WHITE' if whites > 4 else 'BLACK', 'edge'
+        rgb = tuple(max(0, min(255, int(sum(c[i] for c in mix) * brightness / 9.0 + rng.gauss(0, noise))))
+                    for i in range(3))
+        readings.append((rgb, truth, kind))
+    return readings
+
+
+def error_rates(table, readings):
+    wrong = edge_marker = edges = markers_missed = markers = 0
+    for rgb, truth, kind in readings:
+        label = table.name(*rgb)
+        wrong += label != truth
+        if kind == 'edge':
+            edges += 1
+            edge_marker += label in MARKERS
+        elif kind == 'marker':
+            markers += 1
+            markers_missed += label != truth
+    return (100.0 * wrong / len(readings), 100.0 * edge_marker / max(1, edges),
+            100.0 * markers_missed / max(1, markers))
+
+
+def main(argv):
+    brightnesses = [float(b) for b in option(argv, '--brightness', '0.4,0.6,0.8,1.0,1.2').split(',')]
+    noise = float(option(argv, '--noise', '3'))
+    count = int(option(argv, '--readings', '20000'))
+    samples = int(option(argv, '--samples', '60'))
+    print('%d test readings per brightness, noise sd %.1f; %% wrong, %% edge read as marker, %% markers missed'
+          % (count, noise))
+    print('%-10s %-32s %-22s %-22s %-22s' % ('brightness', 'calibration margin', 'calibrated', 'TABLE_V1', 'TABLE_V2'))
+    for brightness in brightnesses:
+        readings = calibrate_in_sim(brightness, noise, samples, seed=int(brightness * 100))
+        calibration = Calibration.fit(readings)
+        separation, name, label = calibration.margin()
+        verdict = 'ok' if separation >= MIN_SEPARATION else 'REFUSED'
+        tests = test_readings(brightness, noise, count, random.Random(1))
+        columns = [calibration.tables()['color_sensor_l'], TABLE_V1, TABLE_V2]
+        print('%-10.2f %-32s %s' % (brightness, '%.1f %s (%s)' % (separation, verdict, label.split()[0]),
+                                    ' '.join('%6.2f %6.2f %6.2f   ' % error_rates(table, tests) for table in columns)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
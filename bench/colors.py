@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Check the color lookup tables against the if-chains and time both.
+
+    python3 -m bench.colors [--quick]
+
+The equivalence check walks the full 0-255 RGB cube for every threshold set
+and exits non-zero on the first mismatch. ``--quick`` only walks every 3rd
+value per channel, which still hits both sides of every threshold.
+"""
+import random
+import sys
+from timeit import repeat
+
+from robot.colors import COLOR_NAMES, TABLE_V1, TABLE_V2, classify_v1, classify_v2
+
+# Hand-measured readings noted at the bottom of Transporter.py, plus black tape.
+MAT_COLORS = (
+    (20, 75, 50), (130, 130, 180), (160, 130, 40), (120, 20, 15),
+    (20, 50, 120), (140, 135, 200), (100, 110, 180), (30, 30, 30),
+)
+
+THRESHOLD_SETS = (
+    ('v1', classify_v1, TABLE_V1),
+    ('v2', classify_v2, TABLE_V2),
+)
+
+
+def check_equivalence(classify, table, step=1):
+    """Return the first (r, g, b) where table and if-chain disagree, or None."""
+    code = table.code
+    values = range(0, 256, step)
+    for r in values:
+        for g in values:
+            for b in values:
+                if code(r, g, b) != classify(r, g, b):
+                    return r, g, b
+    return None
+
+
+def time_ns(func, samples, number=20):
+    """Best-of-5 nanoseconds per classification of ``samples``."""
+    def run():
+        for r, g, b in samples:
+            func(r, g, b)
+    best = min(repeat(run, number=number, repeat=5))
+    return best / (number * len(samples)) * 1e9
+
+
+def main(argv):
+    step = 3 if '--quick' in argv else 1
+    failed = False
+    for label, classify, table in THRESHOLD_SETS:
+        mismatch = check_equivalence(classify, table, step)
+        if mismatch is None:
+            print('%s: table matches if-chain on %d^3 cube' % (label, len(range(0, 256, step))))
+        else:
+            r, g, b = mismatch
+            print('%s: MISMATCH at %s: table %s, if-chain %s' % (
+                label, mismatch, COLOR_NAMES[table.code(r, g, b)], COLOR_NAMES[classify(r, g, b)]))
+            failed = True
+    if failed:
+        return 1
+
+    rng = random.Random(0)
+    sample_sets = (
+        ('cube', [(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(5000)]),
+        ('mat', [tuple(min(255, max(0, c + rng.randint(-15, 15))) for c in rng.choice(MAT_COLORS))
+                 for _ in range(5000)]),
+    )
+    baseline = time_ns(lambda r, g, b: None, sample_sets[0][1])
+    print('ns per classification, call overhead of %.1f ns subtracted' % baseline)
+    print('%-4s %-5s %10s %10s %10s' % ('set', 'input', 'if-chain', 'code', 'name'))
+    for label, classify, table in THRESHOLD_SETS:
+        for input_label, samples in sample_sets:
+            print('%-4s %-5s %10.1f %10.1f %10.1f' % (
+                label, input_label,
+                time_ns(classify, samples) - baseline,
+                time_ns(table.code, samples) - baseline,
+                time_ns(table.name, samples) - baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
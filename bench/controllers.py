@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""Drive the three controllers around reference tracks in the simulator.
+
+    python3 -m bench.controllers [--duration S] [--seed N]
+                                 [--controllers Transporter,lineFollower,test]
+                                 [--tracks plain,oval,wide,tight]
+                                 [--set NAME=VALUE,...]
+                                 [--output results.json] [--compare baseline.json]
+
+Every controller script is imported fresh with ev3dev2 blocked, so it falls
+back to robot.sim, and its main() runs until the simulated duration is used
+up. A world listener measures each run from ground truth rather than from
+what the controller believes:
+
+- laps and lap time, from progress along the track centreline, and that
+  progress in laps (fractions of a lap count);
+- deliveries per simulated hour: lift lowered next to a TARGET_COLOR pad
+  after being raised next to a SOURCE_COLOR pad;
+- misplaced lift moves: raised away from a SOURCE_COLOR pad or lowered
+  away from a TARGET_COLOR pad, i.e. station sequences started by a
+  misread marker;
+- control-loop iterations per simulated second (what the brick would reach)
+  and per host second (Python overhead of the loop and the simulator);
+- motor commands and LED changes per simulated second;
+- line-loss events (no line under or between the sensors) and how long
+  each took to recover.
+
+``--set`` overrides configuration globals of every script before its
+main() runs, e.g. ``--set COALESCE_WRITES=False`` for the run before an
+optimization. Results go to a JSON file. With ``--compare`` every metric is checked
+against a stored baseline and the run exits non-zero on a regression.
+
+The run also exits non-zero when the reference controller (Transporter)
+finishes no lap of a track, or delivers nothing on a track with stations.
+"""
+import ast
+import json
+import logging
+import os
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from robot import sim
+
+CONTROLLERS = ('Transporter', 'lineFollower', 'test')
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRACKS = {
+    'plain': lambda: sim.oval_track(radius=450.0, stations=()),
+    'oval': lambda: sim.oval_track(),
+    'wide': lambda: sim.oval_track(radius=450.0),
+    'tight': lambda: sim.oval_track(straight=600.0, radius=220.0),
+}
+
+# Shorter gaps in the line are grazes, not losses.
+LOSS_MIN = 0.05
+# A run that has not seen the line for this long is abandoned.
+GIVE_UP = 15.0
+# Centreline points searched around the previous match each step.
+SEARCH_WINDOW = 30
+# Distance from the sensors within which a pad counts as reached, mm.
+PAD_REACH = 80.0
+# The controller that must lap every track and deliver wherever there are stations.
+REFERENCE = 'Transporter'
+
+LOWER, HIGHER = -1, 1
+# (metric, better direction, relative tolerance, absolute slack)
+COMPARED = (
+    ('lap_time', LOWER, 0.05, 0.1),
+    ('deliveries_per_hour', HIGHER, 0.05, 1.0),
+    ('it_per_s', HIGHER, 0.05, 1.0),
+    ('line_loss_events', LOWER, 0.10, 1),
+    ('recovery_time_mean', LOWER, 0.10, 0.05),
+    ('errors', LOWER, 0.0, 0),
+)
+# host_it_per_s is reported but not compared: it depends on the machine and its load.
+
+
+class Probe():
+    """World listener measuring progress, line losses and lift cycles."""
+
+    def __init__(self, world, source_color=None, target_color=None):
+        self.world = world
+        self.track = world.track
+        self.centreline = world.track.centreline
+        self.source = sim.SURFACE_NAMES.index(source_color) if source_color in sim.SURFACE_NAMES else None
+        self.target = sim.SURFACE_NAMES.index(target_color) if target_color in sim.SURFACE_NAMES else None
+        # Both pads are on the track, so there is something to deliver.
+        self.stations = None not in (self.source, self.target) and \
+            self.source in self.track.pixels and self.target in self.track.pixels
+        x, y = self.sensor_midpoint()
+        self.index = self.nearest(x, y, None)
+        self.progress = 0
+        self.laps = []
+        self.lap_start = world.now
+        self.lost_since = None
+        self.recoveries = []
+        self.gave_up = False
+        self.lift_from = None
+        self.lift_moves = 0
+        self.carrying = False
+        self.deliveries = 0
+        self.misplaced = 0
+
+    def sensor_midpoint(self):
+        lx, ly = self.world.sensor_position(sim.INPUT_3)
+        rx, ry = self.world.sensor_position(sim.INPUT_2)
+        return (lx + rx) / 2, (ly + ry) / 2
+
+    def nearest(self, x, y, guess):
+        """Index of the centreline point closest to (x, y), searching near ``guess`` first."""
+        points = self.centreline
+        n = len(points)
+        if guess is None:
+            candidates = range(n)
+        else:
+            candidates = range(guess - SEARCH_WINDOW, guess + SEARCH_WINDOW + 1)
+        best, best_d = 0, float('inf')
+        for k in candidates:
+            px, py = points[k % n]
+            d = (px - x) ** 2 + (py - y) ** 2
+            if d < best_d:
+                best, best_d = k, d
+        if guess is not None and abs(best - guess) == SEARCH_WINDOW:
+            return self.nearest(x, y, None)
+        return best % n
+
+    def line_visible(self):
+        """True if any non-white surface lies under or between the two sensors."""
+        lx, ly = self.world.sensor_position(sim.INPUT_3)
+        rx, ry = self.world.sensor_position(sim.INPUT_2)
+        surface = self.track.surface
+        for i in range(7):
+            t = i / 6.0
+            if surface(lx + (rx - lx) * t, ly + (ry - ly) * t) != sim.WHITE:
+                return True
+        return False
+
+    def near(self, surface_code):
+        """True if ``surface_code`` is within PAD_REACH of the sensors."""
+        if surface_code is None:
+            return False
+        x, y = self.sensor_midpoint()
+        step = 10.0
+        reach = int(PAD_REACH / step)
+        for i in range(-reach, reach + 1):
+            for j in range(-reach, reach + 1):
+                if i * i + j * j <= reach * reach and self.track.surface(x + i * step, y + j * step) == surface_code:
+                    return True
+        return False
+
+    def __call__(self, world):
+        now = world.now
+        if self.centreline:
+            x, y = self.sensor_midpoint()
+            index = self.nearest(x, y, self.index)
+            n = len(self.centreline)
+            delta = (index - self.index + n // 2) % n - n // 2
+            self.index = index
+            self.progress += delta
+            if abs(self.progress) >= n * (len(self.laps) + 1):
+                self.laps.append(now - self.lap_start)
+                self.lap_start = now
+
+        if self.line_visible():
+            if self.lost_since is not None:
+                if now - self.lost_since >= LOSS_MIN:
+                    self.recoveries.append(now - self.lost_since)
+                self.lost_since = None
+        elif self.lost_since is None:
+            self.lost_since = now
+        elif now - self.lost_since > GIVE_UP and not self.gave_up:
+            self.gave_up = True
+            # The next clock advance ends the run.
+            world.duration = now
+
+        lift = world.motors.get(sim.OUTPUT_C)
+        if lift is not None:
+            if lift.velocity and self.lift_from is None:
+                self.lift_from = lift.position
+            elif not lift.velocity and self.lift_from is not None:
+                moved = lift.position - self.lift_from
+                self.lift_from = None
+                if moved:
+                    self.lift_moves += 1
+                if moved > 0:
+                    self.carrying = self.near(self.source)
+                    self.misplaced += not self.carrying
+                elif moved < 0:
+                    at_target = self.near(self.target)
+                    if self.carrying and at_target:
+                        self.deliveries += 1
+                    self.misplaced += not at_target
+                    self.carrying = False
+
+    def unrecovered(self):
+        """Duration of a line loss still in progress, or None."""
+        if self.lost_since is None:
+            return None
+        return self.world.now - self.lost_since
+
+
+class ErrorCounter(logging.Handler):
+    """Count ERROR records logged by a controller and keep the first one."""
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.count = 0
+        self.first = None
+
+    def emit(self, record):
+        self.count += 1
+        if self.first is None:
+            exc = record.exc_info[1] if record.exc_info else None
+            self.first = '%s: %s' % (type(exc).__name__, exc) if exc else str(record.msg)
+
+
+def run_one(name, track_name, duration, seed, overrides=(), noise=3.0, collect=None):
+    """Run one controller on one track; return its metrics.
+
+    ``collect(module)`` may return further metrics read from the script after the run.
+    """
+    world = sim.set_world(sim.World(TRACKS[track_name](), seed=seed, duration=duration, noise=noise))
+    module = sim.load_script(os.path.join(REPO, name + '.py'))
+    for setting, value in overrides:
+        setattr(module, setting, value)
+    probe = Probe(world, getattr(module, 'SOURCE_COLOR', None), getattr(module, 'TARGET_COLOR', None))
+    world.listeners.append(probe)
+
+    iterations = [0]
+    tick = module.loop_stats.tick
+
+    def counted_tick():
+        iterations[0] += 1
+        tick()
+    module.loop_stats.tick = counted_tick
+
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    start = perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            module.main()
+    except sim.SimulationEnd:
+        pass
+    finally:
+        wall = perf_counter() - start
+        logging.getLogger().removeHandler(errors)
+
+    elapsed = world.now
+    laps = probe.laps
+    recoveries = probe.recoveries
+    has_lift = hasattr(module, 'lift')
+    metrics = {
+        'sim_time': round(elapsed, 3),
+        'distance_m': round(world.odometer / 1000.0, 3),
+        'laps': len(laps),
+        'lap_progress': round(abs(probe.progress) / float(len(probe.centreline)), 3) if probe.centreline else None,
+        'lap_time': round(sum(laps) / len(laps), 3) if laps else None,
+        'best_lap_time': round(min(laps), 3) if laps else None,
+        'stations': probe.stations,
+        'deliveries': probe.deliveries if has_lift else None,
+        'deliveries_per_hour': round(probe.deliveries * 3600.0 / elapsed, 1) if has_lift and elapsed else None,
+        'lift_moves': probe.lift_moves if has_lift else None,
+        'misplaced_lifts': probe.misplaced if has_lift else None,
+        'iterations': iterations[0],
+        'it_per_s': round(iterations[0] / elapsed, 1) if elapsed else 0.0,
+        'host_it_per_s': round(iterations[0] / wall, 1) if wall else 0.0,
+        'writes_per_s': round(world.writes / elapsed, 1) if elapsed else 0.0,
+        'line_loss_events': len(recoveries) + (probe.lost_since is not None),
+        'recovery_time_mean': round(sum(recoveries) / len(recoveries), 3) if recoveries else None,
+        'recovery_time_max': round(max(recoveries), 3) if recoveries else None,
+        'unrecovered_loss': None if probe.unrecovered() is None else round(probe.unrecovered(), 3),
+        'gave_up': probe.gave_up,
+        'errors': errors.count,
+        'first_error': errors.first,
+    }
+    if collect is not None:
+        metrics.update(collect(module))
+    return metrics
+
+
+def compare(results, baseline):
+    """Return (key, metric, baseline value, new value) for every regression."""
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        old_metrics = baseline.get(key)
+        if old_metrics is None:
+            continue
+        for metric, better, rel_tol, slack in COMPARED:
+            old, new = old_metrics.get(metric), metrics.get(metric)
+            if old is None:
+                continue
+            if new is None:
+                regressions.append((key, metric, old, new))
+                continue
+            worse = (old - new) * better
+            if worse > abs(old) * rel_tol and worse > slack:
+                regressions.append((key, metric, old, new))
+    return regressions
+
+
+def stalls(results):
+    """(key, what) for every reference run that finished no lap, or delivered nothing with stations on the track."""
+    stalled = []
+    for key, metrics in sorted(results.items()):
+        if key.split('/')[0] != REFERENCE:
+            continue
+        if not metrics['laps']:
+            stalled.append((key, 'no lap'))
+        if metrics['stations'] and not metrics['deliveries']:
+            stalled.append((key, 'no delivery'))
+    return stalled
+
+
+def _fmt(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '%.2f' % value
+    return str(value)
+
+
+def print_table(results):
+    columns = ('laps', 'lap_time', 'deliveries_per_hour', 'it_per_s', 'host_it_per_s',
+               'writes_per_s', 'line_loss_events', 'recovery_time_mean', 'errors')
+    print('%-20s %s' % ('run', ' '.join('%10s' % c[:10] for c in columns)))
+    for key, metrics in sorted(results.items()):
+        print('%-20s %s' % (key, ' '.join('%10s' % _fmt(metrics[c]) for c in columns)))
+
+
+def option(argv, name, default):
+    return argv[argv.index(name) + 1] if name in argv else default
+
+
+def parse_overrides(text):
+    """[(name, value)] from 'NAME=VALUE,...'; values are Python literals."""
+    overrides = []
+    for item in filter(None, text.split(',')):
+        setting, value = item.split('=', 1)
+        overrides.append((setting, ast.literal_eval(value)))
+    return overrides
+
+
+def main(argv):
+    duration = float(option(argv, '--duration', '300'))
+    seed = int(option(argv, '--seed', '0'))
+    controllers = option(argv, '--controllers', ','.join(CONTROLLERS)).split(',')
+    tracks = option(argv, '--tracks', ','.join(sorted(TRACKS))).split(',')
+    output = option(argv, '--output', 'bench_controllers.json')
+    baseline_path = option(argv, '--compare', None)
+    overrides = parse_overrides(option(argv, '--set', ''))
+
+    # Keep the scripts' logging.basicConfig from writing robot.log.
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+    results = {}
+    for name in controllers:
+        for track_name in tracks:
+            key = '%s/%s' % (name, track_name)
+            results[key] = run_one(name, track_name, duration, seed, overrides)
+            print('%-20s done in %.1fs simulated' % (key, results[key]['sim_time']), file=sys.stderr)
+    print_table(results)
+
+    with open(output, 'w') as f:
+        json.dump({'duration': duration, 'seed': seed, 'settings': dict(overrides), 'results': results},
+                  f, indent=2, sort_keys=True)
+    print('wrote %s' % output)
+
+    stalled = stalls(results)
+    for key, what in stalled:
+        print('STALLED %-20s %s' % (key, what))
+    if baseline_path is None:
+        return 1 if stalled else 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if (baseline.get('duration'), baseline.get('seed')) != (duration, seed):
+        print('warning: baseline was recorded with duration=%s seed=%s' % (baseline.get('duration'), baseline.get('seed')))
+    regressions = compare(results, baseline['results'])
+    for key, metric, old, new in regressions:
+        print('REGRESSION %-20s %-20s %s -> %s' % (key, metric, _fmt(old), _fmt(new)))
+    if not regressions:
+        print('no regressions against %s' % baseline_path)
+    return 1 if regressions or stalled else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
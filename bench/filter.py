@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Color filter settings (robot/filter.py) on sensor streams from the simulator.
+
+    python3 -m bench.filter [--controllers Transporter,lineFollower]
+                            [--tracks oval,wide,tight] [--noise 3,10,20]
+                            [--duration S] [--seed N]
+
+Each controller drives each track once per noise level with filtering off.
+Every reading its get_readings() takes is recorded, together with the
+ground truth under the sensor spot: how many of the spot's 9 sample points
+lie on each surface. Each filter variant is then run over the recorded
+streams of both sensors, open loop, and scored against that truth:
+
+- false markers: the filtered color turns to a marker color while no point
+  of the spot is on that marker;
+- marker passes: runs of at least MIN_PASS readings with the whole spot on
+  one marker, and how many of them the filtered color does not report by
+  the end of the pass plus the window (missed);
+- delay: readings from the start of a pass to the filtered color reporting
+  it, averaged over the passes that were not missed;
+- suppressed: raw marker sightings the filter dropped (its own counter);
+- line switches per second between BLACK and WHITE, to show flicker.
+"""
+import logging
+import sys
+
+from bench.controllers import REPO, TRACKS, option
+from robot import sim
+from robot.filter import ColorFilter
+
+PORTS = (sim.INPUT_3, sim.INPUT_2)
+MARKERS = ('GREEN', 'RED')
+SPOT = 9
+# Passes shorter than this many readings are grazes a filter may drop.
+MIN_PASS = 2
+# (label, window, vote, hysteresis); a window of 1 passes every reading through.
+VARIANTS = (
+    ('off', 1, 'majority', 1),
+    ('majority 3', 3, 'majority', 1),
+    ('majority 5', 5, 'majority', 1),
+    ('median 5', 5, 'median', 1),
+    ('majority 3 hyst 2', 3, 'majority', 2),
+)
+
+
+def spot_surfaces(world, port):
+    """Number of the spot's sample points on each surface, as World.read_rgb averages them."""
+    x, y = world.sensor_position(port)
+    d = sim.SENSOR_SPOT_RADIUS / 2
+    counts = [0] * len(sim.SURFACE_NAMES)
+    for dx in (-d, 0.0, d):
+        for dy in (-d, 0.0, d):
+            counts[world.track.surface(x + dx, y + dy)] += 1
+    return counts
+
+
+def record(name, track, duration, seed, noise):
+    """[(sensor streams of (rgb, label, spot counts)), ...] and the tables, from one run with filtering off."""
+    world = sim.set_world(sim.World(TRACKS[track](), seed=seed, duration=duration, noise=noise))
+    module = sim.load_script('%s/%s.py' % (REPO, name))
+    module.FILTER_WINDOW = 1
+    module.LINE_HYSTERESIS = 1
+    streams = ([], [])
+    get_readings = module.get_readings
+
+    def recorded():
+        reading = get_readings()
+        lrgb, rrgb, lcol, rcol = reading
+        streams[0].append((lrgb, lcol, spot_surfaces(world, PORTS[0])))
+        streams[1].append((rrgb, rcol, spot_surfaces(world, PORTS[1])))
+        return reading
+    module.get_readings = recorded
+    try:
+        module.main()
+    except sim.SimulationEnd:
+        pass
+    return streams, (module.left_table, module.right_table), world.now
+
+
+def marker_passes(stream):
+    """[(marker, first, last reading)] with the whole spot on the marker, gaps of one reading bridged."""
+    passes = []
+    for index, (rgb, label, counts) in enumerate(stream):
+        for marker in MARKERS:
+            if counts[sim.SURFACE_NAMES.index(marker)] == SPOT:
+                if passes and passes[-1][0] == marker and index - passes[-1][2] <= 2:
+                    passes[-1][2] = index
+                else:
+                    passes.append([marker, index, index])
+    return [p for p in passes if p[2] - p[1] + 1 >= MIN_PASS]
+
+
+def score(stream, passes, table, window, vote, hysteresis):
+    color_filter = ColorFilter(window, vote, hysteresis)
+    colors = []
+    false_markers = 0
+    previous = None
+    for rgb, label, counts in stream:
+        color = color_filter.update(label, rgb, table)
+        if color in MARKERS and color != previous and not counts[sim.SURFACE_NAMES.index(color)]:
+            false_markers += 1
+        previous = color
+        colors.append(color)
+    missed = delay_sum = 0
+    for marker, first, last in passes:
+        reported = [i for i in range(first, min(len(colors), last + window + 1)) if colors[i] == marker]
+        if reported:
+            delay_sum += reported[0] - first
+        else:
+            missed += 1
+    return {
+        'false_markers': false_markers,
+        'passes': len(passes),
+        'missed': missed,
+        'delay_sum': delay_sum,
+        'suppressed': color_filter.suppressed,
+        'line_switches': color_filter.line_switches,
+    }
+
+
+def main(argv):
+    controllers = option(argv, '--controllers', 'Transporter,lineFollower').split(',')
+    tracks = option(argv, '--tracks', 'oval,wide,tight').split(',')
+    noises = [float(n) for n in option(argv, '--noise', '3,10,20').split(',')]
+    duration = float(option(argv, '--duration', '120'))
+    seed = int(option(argv, '--seed', '0'))
+    # Keep the scripts' logging.basicConfig from writing robot.log.
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+    print('%-6s %-18s %7s %6s %6s %6s %10s %10s %9s' % ('noise', 'variant', 'false', 'passes', 'missed',
+                                                       'delay', 'suppressed', 'switch/s', 'readings'))
+    for noise in noises:
+        recordings = []
+        seconds = 0.0
+        for name in controllers:
+            for track in tracks:
+                streams, tables, elapsed = record(name, track, duration, seed, noise)
+                recordings.extend((stream, marker_passes(stream), table) for stream, table in zip(streams, tables))
+                seconds += elapsed
+                print('%s %s noise %g recorded' % (name, track, noise), file=sys.stderr)
+        readings = sum(len(stream) for stream, _, _ in recordings)
+        for label, window, vote, hysteresis in VARIANTS:
+            total = {}
+            for stream, passes, table in recordings:
+                for key, value in score(stream, passes, table, window, vote, hysteresis).items():
+                    total[key] = total.get(key, 0) + value
+            found = total['passes'] - total['missed']
+            print('%-6g %-18s %7d %6d %6d %6s %10d %10.2f %9d' % (
+                noise, label, total['false_markers'], total['passes'], total['missed'],
+                '%.1f' % (total['delay_sum'] / float(found)) if found else '-',
+                total['suppressed'], total['line_switches'] / seconds, readings))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Several robots in separate processes against one fleet coordinator.
+
+    python3 -m bench.fleet [--robots 1,2,3,4,6] [--hours H] [--speedup N] [--seed N]
+    python3 -m bench.fleet --transporter [--robots 3] [--duration S]
+
+The coordinator (robot/fleet.py) is started in its own process on a free
+localhost port. Each robot is another process that talks to it over TCP
+through FleetClient, exactly as Transporter does. A robot drives a
+model of the transport loop in compressed time (``--speedup``):
+
+- it drives to the source station (TRAVEL seconds, +-JITTER);
+- it enters the station and picks up for SERVICE seconds;
+- it drives to the target station and drops for SERVICE seconds.
+
+Robots start at random points of the loop. With reservations
+(``coordinated``) a robot asks for each station before entering,
+waits stopped in line while another robot is inside, and releases it
+after the pick-up or drop. Without them (``blind``) it drives in
+regardless. If another robot is inside they collide, which costs
+COLLISION seconds to recover before it tries again. The table gives
+aggregate deliveries per hour for each fleet size and both modes,
+collisions, and the time spent waiting for a station.
+
+The simulator drives the real script only for a single robot, so each
+robot has a track of its own and they never meet. ``--transporter``
+runs Transporter.main in several simulator processes with
+FLEET_COORDINATOR set and prints what the coordinator heard from them.
+They share the coordinator, so all but one wait at the first station
+for as long as it is held. The button stops each robot halfway and
+starts it again. The check fails unless every robot reported IDLE at
+the stop and logged no errors.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import sys
+from time import monotonic, sleep
+
+from bench.controllers import REPO, TRACKS, ErrorCounter, option
+from robot.fleet import Coordinator, CoordinatorServer, FleetClient
+
+# Model of the transport loop, seconds of robot time.
+TRAVEL = 50.0
+JITTER = 0.1
+SERVICE = 15.0
+COLLISION = 20.0
+STATIONS = ('GREEN', 'RED')
+
+
+def serve(port_out, lease):
+    """Coordinator process: report the port it got, then serve until terminated."""
+    logging.basicConfig(level=logging.WARNING)
+    server = CoordinatorServer(('localhost', 0), Coordinator(lease=lease))
+    port_out.send(server.server_address[1])
+    server.serve_forever()
+
+
+def start_coordinator(lease):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=serve, args=(sender, lease))
+    process.daemon = True
+    process.start()
+    return process, ('localhost', receiver.recv())
+
+
+def model_robot(address, name, coordinated, hours, speedup, seed, results):
+    """One robot process driving the model loop; puts its counters on ``results``."""
+    rng = random.Random(seed)
+    started = monotonic()
+
+    def clock():
+        return (monotonic() - started) * speedup
+
+    def wait(seconds):
+        sleep(seconds / speedup)
+
+    client = FleetClient(address, name, clock=clock)
+    client.register()
+    end = hours * 3600.0
+    deliveries = collisions = 0
+    # Start somewhere along the loop: part of the way to the source.
+    wait(rng.uniform(0, 2 * (TRAVEL + SERVICE)))
+    while clock() < end:
+        for station, state in zip(STATIONS, ('PICKING_UP', 'DELIVERING')):
+            wait(TRAVEL * rng.uniform(1 - JITTER, 1 + JITTER))
+            client.report(state)
+            if coordinated:
+                client.wait_for(station, wait, poll=1.0)
+            else:
+                while not client.reserve(station, queue=False):
+                    collisions += 1
+                    wait(COLLISION)
+            wait(SERVICE)
+            client.release(station)
+            client.report('TO_TARGET' if station == STATIONS[0] else 'TO_SOURCE')
+        if clock() < end:
+            deliveries += 1
+    results.put((name, deliveries, collisions, client.wait_time, client.failures))
+    client.close()
+
+
+def run_fleet(robots, coordinated, hours, speedup, seed):
+    coordinator, address = start_coordinator(lease=60.0 / speedup)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=model_robot, args=(
+        address, 'robot%d' % i, coordinated, hours, speedup, seed * 100 + i, results)) for i in range(robots)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    coordinator.terminate()
+    return {
+        'deliveries_per_hour': sum(r[1] for r in rows) / hours,
+        'collisions': sum(r[2] for r in rows),
+        'wait': sum(r[3] for r in rows),
+        'failures': sum(r[4] for r in rows),
+    }
+
+
+def transporter(address, name, track, duration, results):
+    """One simulator process running Transporter.main against the coordinator."""
+    from contextlib import redirect_stdout
+    from robot import sim
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    sim.set_world(sim.World(TRACKS[track](), seed=int(name[-1]), duration=duration, presses=presses(duration)))
+    module = sim.load_script(os.path.join(REPO, 'Transporter.py'))
+    module.FLEET_COORDINATOR = '%s:%d' % address
+    module.ROBOT_NAME = name
+    reported = []
+
+    class ReportingClient(FleetClient):
+        def report(self, state):
+            reported.append(state)
+            return FleetClient.report(self, state)
+    module.FleetClient = ReportingClient
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            module.main()
+    except sim.SimulationEnd:
+        pass
+    results.put((name, module.fleet.calls, module.fleet.failures, reported, errors.count, errors.first))
+
+
+def presses(duration):
+    """Button presses of a --transporter run: start, stop halfway, start again at three quarters."""
+    return tuple((start, start + 0.2) for start in (0.0, duration * 0.5, duration * 0.75))
+
+
+def check_transporter(robots, duration):
+    coordinator, address = start_coordinator(lease=30.0)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=transporter, args=(address, 'robot%d' % i, 'oval', duration, results))
+                 for i in range(robots)]
+    for process in processes:
+        process.start()
+    # Ask while they run; at the end each robot leaves and is forgotten.
+    client = FleetClient(address, 'bench')
+    seen = {}
+    while any(p.is_alive() for p in processes):
+        status = client._call('status')
+        if status:
+            for robot, entry in status['robots'].items():
+                if robot != 'bench':
+                    seen[robot] = entry
+        sleep(0.05)
+    failed = robots - len(seen)
+    for _ in processes:
+        name, calls, failures, reported, errors, first = results.get()
+        entry = seen.get(name, {})
+        failed += errors > 0 or 'IDLE' not in reported
+        print('%s: %d requests, %d failed, reported %s; coordinator saw state %s after %d transitions; '
+              '%d errors%s' % (name, calls, failures, ' '.join(reported), entry.get('state'),
+                               entry.get('transitions', 0), errors, ' (%s)' % first if first else ''))
+    client.close()
+    coordinator.terminate()
+    return 1 if failed else 0
+
+
+def main(argv):
+    if '--transporter' in argv:
+        return check_transporter(int(option(argv, '--robots', '3')), float(option(argv, '--duration', '30')))
+    fleet_sizes = [int(n) for n in option(argv, '--robots', '1,2,3,4,6').split(',')]
+    hours = float(option(argv, '--hours', '2'))
+    speedup = float(option(argv, '--speedup', '400'))
+    seed = int(option(argv, '--seed', '0'))
+    print('model: %.0fs between stations +-%.0f%%, %.0fs per pick-up or drop, %.0fs per collision; '
+          '%.1f robot hours at x%.0f' % (TRAVEL, JITTER * 100, SERVICE, COLLISION, hours, speedup))
+    print('%-7s %-12s %10s %12s %11s %10s %9s' % ('robots', 'mode', 'deliv/h', 'per robot', 'collisions',
+                                                 'waited s', 'failures'))
+    for robots in fleet_sizes:
+        for coordinated in (False, True):
+            result = run_fleet(robots, coordinated, hours, speedup, seed)
+            print('%-7d %-12s %10.1f %12.1f %11d %10.0f %9d' % (
+                robots, 'coordinated' if coordinated else 'blind', result['deliveries_per_hour'],
+                result['deliveries_per_hour'] / robots, result['collisions'], result['wait'], result['failures']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
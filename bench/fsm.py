@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Validate the scripts' state machine tables and time their dispatch.
+
+    python3 -m bench.fsm [--controllers Transporter,lineFollower,test]
+                         [--set NAME=VALUE,...] [--table]
+
+Every script is loaded with ev3dev2 blocked and its init_machine()
+compiles its rules (robot/fsm.py); ``--set`` overrides configuration
+globals first, e.g. ``--set FOLLOW_MODE='pid'``. For each script the
+number of rules and table cells and the problems validate() finds are
+printed, with ``--table`` the compiled table as well. Finding what to do
+for a reading is timed over random states and colors, as the table lookup
+step() makes and by trying the rules one after the other the way the
+if/elif chains did; the actions themselves are not run.
+"""
+import logging
+import random
+import sys
+from time import perf_counter
+
+from bench.controllers import CONTROLLERS, option, parse_overrides
+from robot import sim
+from robot.fsm import SAME, expand
+
+
+def load_machine(name, overrides):
+    module = sim.load_script('%s.py' % name)
+    for setting, value in overrides:
+        setattr(module, setting, value)
+    module.init_machine()
+    return module.machine
+
+
+def first_match(rules, state, lcol, rcol):
+    """(action, next state) of the first matching rule, as a chain would find it."""
+    for states, left, right, action, then in rules:
+        if state in states and lcol in left and rcol in right:
+            return action, state if then == SAME else then
+    return None, state
+
+
+def dispatch_cost(machine, ticks=20000):
+    """Microseconds per tick to find the entry for a reading: table lookup and rule by rule."""
+    rng = random.Random(1)
+    cells = [(rng.choice(list(machine.states)), rng.choice(machine.colors), rng.choice(machine.colors))
+             for _ in range(ticks)]
+    table = machine.table
+    start = perf_counter()
+    for state, lcol, rcol in cells:
+        table[state].get((lcol, rcol))
+    lookup = (perf_counter() - start) / ticks
+    rules = [(set(expand(r.state, machine.states)), set(expand(r.left, machine.colors)),
+              set(expand(r.right, machine.colors)), r.action, r.then) for r in machine.rules]
+    start = perf_counter()
+    for state, lcol, rcol in cells:
+        first_match(rules, state, lcol, rcol)
+    scan = (perf_counter() - start) / ticks
+    return lookup * 1e6, scan * 1e6
+
+
+def main(argv):
+    controllers = option(argv, '--controllers', ','.join(CONTROLLERS)).split(',')
+    overrides = parse_overrides(option(argv, '--set', ''))
+    # Keep the scripts' logging.basicConfig from writing robot.log.
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    status = 0
+    for name in controllers:
+        machine = load_machine(name, overrides)
+        problems = machine.validate()
+        table, chain = dispatch_cost(machine)
+        print('%s: %d states, %d rules, %d cells; dispatch %.2f us per tick (rule by rule %.2f us)' % (
+            name, len(machine.states), len(machine.rules), len(machine.states) * len(machine.colors) ** 2,
+            table, chain))
+        if '--table' in argv:
+            for line in machine.dump():
+                print('  ' + line)
+        for problem in problems:
+            print('  ' + problem)
+        if not problems:
+            print('  no problems found')
+        status = status or (1 if problems else 0)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
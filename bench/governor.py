@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Adaptive speed (robot/governor.py) against constant speed in the simulator.
+
+    python3 -m bench.governor [--duration S] [--seeds 0,1,2]
+                              [--controllers Transporter,lineFollower]
+                              [--tracks plain,oval,wide,tight]
+                              [--ratios 1.25,1.5,2] [--ramps 1.0,3.0] [--set NAME=VALUE,...]
+
+Every controller runs on every track and seed as bench.controllers does,
+once at constant speed (ADAPTIVE_SPEED=False) and once per combination of
+BOOST_RATIO and BOOST_RAMP_TIME with the governor on. For each variant
+the laps completed, the mean lap time, line-loss events and the runs given
+up after losing the line are summed over tracks and seeds; lap time is
+also compared run by run against constant speed, over the runs where both
+completed a lap. ``--set`` applies further overrides to every variant.
+"""
+import logging
+import sys
+
+from bench.controllers import TRACKS, option, parse_overrides, run_one
+
+
+def summarize(runs):
+    laps = sum(r['laps'] for r in runs)
+    lap_time = sum(r['lap_time'] * r['laps'] for r in runs if r['laps']) / laps if laps else None
+    return {
+        'laps': laps,
+        'lap_time': lap_time,
+        'line_loss_events': sum(r['line_loss_events'] for r in runs),
+        'gave_up': sum(1 for r in runs if r['gave_up']),
+        'distance_m': sum(r['distance_m'] for r in runs),
+    }
+
+
+def paired_speedup(runs, constant):
+    """Mean relative lap time change against constant speed, over runs where both lapped."""
+    changes = [r['lap_time'] / c['lap_time'] - 1 for r, c in zip(runs, constant) if r['laps'] and c['laps']]
+    return (sum(changes) / len(changes), len(changes)) if changes else (None, 0)
+
+
+def main(argv):
+    duration = float(option(argv, '--duration', '300'))
+    seeds = [int(s) for s in option(argv, '--seeds', '0,1,2').split(',')]
+    controllers = option(argv, '--controllers', 'Transporter,lineFollower').split(',')
+    tracks = option(argv, '--tracks', ','.join(sorted(TRACKS))).split(',')
+    ratios = [float(r) for r in option(argv, '--ratios', '1.25,1.5,2').split(',')]
+    ramps = [float(r) for r in option(argv, '--ramps', '1.0,3.0').split(',')]
+    overrides = parse_overrides(option(argv, '--set', ''))
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+    variants = [('constant', [('ADAPTIVE_SPEED', False)])]
+    for ratio in ratios:
+        for ramp in ramps:
+            variants.append(('x%g ramp %gs' % (ratio, ramp), [('ADAPTIVE_SPEED', True), ('BOOST_RATIO', ratio),
+                                                             ('BOOST_RAMP_TIME', ramp)]))
+    print('%d tracks x %d seeds, %.0fs each' % (len(tracks), len(seeds), duration))
+    print('%-13s %-16s %5s %8s %9s %8s %7s %9s' % ('controller', 'variant', 'laps', 'lap_time', 'vs const',
+                                                   'line_loss', 'gave_up', 'distance'))
+    for name in controllers:
+        constant = None
+        for label, settings in variants:
+            runs = []
+            for track in tracks:
+                for seed in seeds:
+                    runs.append(run_one(name, track, duration, seed, overrides + settings))
+                    print('%s %s %s/%d done' % (name, label, track, seed), file=sys.stderr)
+            if constant is None:
+                constant = runs
+            summary = summarize(runs)
+            change, paired = paired_speedup(runs, constant)
+            print('%-13s %-16s %5d %8s %9s %8d %7d %8.1fm' % (
+                name, label, summary['laps'], '-' if summary['lap_time'] is None else '%.2f' % summary['lap_time'],
+                '-' if change is None or runs is constant else '%+.1f%%/%d' % (change * 100, paired),
+                summary['line_loss_events'], summary['gave_up'], summary['distance_m']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
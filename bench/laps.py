@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Lap times while a LapProfile (robot/laps.py) learns a track, in a model of the lap.
+
+    python3 -m bench.laps [--laps N] [--seed N] [--base 12] [--ratio 1.5]
+
+The scripts do not get round a track with markers in the simulator (they
+stop beside a marker, or lose the line in the curves), so this drives the
+real SpeedGovernor and LapProfile through a model of the lap, as the
+scripts' loop does. Each tick takes TICK seconds:
+
+- the track is a list of straights and curves. Markers lie beside the
+  line under the right sensor;
+- the straight speed is the profile's when it has one, else the
+  governor's, else the base speed;
+- corrections come every CURVE_GAP mm in curves and every DRIFT_GAP mm on
+  straights (+-50%). A correction reads BLACK and drives CORRECTION mm at
+  the base speed;
+- a correction in a curve taken faster than CURVE_LIMIT loses the line
+  with a chance growing with the excess. Finding it again takes
+  LOSS_TIME seconds and is reported to the profile as trouble.
+
+Variants: constant speed, the governor alone, and the governor with the
+learned profile. Then the profile saved by that run is loaded on the
+same track, and on a changed one (curves and a marker moved) to show
+the fall back and relearning. The table gives the first laps, the mean of
+the rest, line losses and mismatches.
+"""
+import logging
+import os
+import random
+import sys
+import tempfile
+
+from bench.controllers import option
+from robot.governor import SpeedGovernor
+from robot.laps import LapProfile
+
+TICK = 0.02
+DEGREES_PER_S = 1050 / 100.0  # per percent of speed
+MM_PER_DEGREE = 3.14159 * 56.0 / 360.0
+CURVE_GAP = 60.0
+DRIFT_GAP = 500.0
+CORRECTION = 20.0
+CURVE_LIMIT = 13
+LOSS_TIME = 3.0
+MARKER_LENGTH = 40.0
+SHOWN = 4
+
+# (kind, length mm) round the lap; markers as (position mm, color).
+TRACKS = {
+    'stadium': ([('straight', 800.0), ('curve', 1400.0), ('straight', 800.0), ('curve', 1400.0)],
+                [(100.0, 'GREEN'), (2300.0, 'RED')]),
+    'changed': ([('straight', 300.0), ('curve', 1400.0), ('straight', 1300.0), ('curve', 1400.0)],
+                [(100.0, 'GREEN'), (1500.0, 'RED')]),
+}
+
+
+def section_at(sections, position):
+    for kind, length in sections:
+        if position < length:
+            return kind
+        position -= length
+    return sections[-1][0]
+
+
+def drive(track, laps, base, governor=None, profile=None, seed=0):
+    """Ground truth lap times and line losses for ``laps`` laps of the model."""
+    sections, markers = TRACKS[track]
+    total = sum(length for _, length in sections)
+    rng = random.Random(seed)
+    now = odometer = position = 0.0
+    lap_start = 0.0
+    times = []
+    losses = 0
+    next_correction = CURVE_GAP
+    speed = base
+    while len(times) < laps:
+        kind = section_at(sections, position % total)
+        lcol = rcol = 'WHITE'
+        for at, color in markers:
+            if 0 <= position % total - at < MARKER_LENGTH:
+                rcol = color
+        correcting = position >= next_correction
+        if correcting:
+            lcol = 'BLACK'
+        if governor is not None:
+            governor.update(lcol, rcol, now)
+        if profile is not None:
+            profile.update(lcol, rcol, odometer / MM_PER_DEGREE, now)
+        if correcting:
+            if kind == 'curve' and speed > CURVE_LIMIT and rng.random() < (speed - CURVE_LIMIT) / float(CURVE_LIMIT):
+                losses += 1
+                now += LOSS_TIME
+                if profile is not None:
+                    profile.trouble(odometer / MM_PER_DEGREE)
+            step, speed = CORRECTION, base
+            now += CORRECTION / (base * DEGREES_PER_S * MM_PER_DEGREE)
+            gap = CURVE_GAP if kind == 'curve' else DRIFT_GAP
+            next_correction = position + step + gap * rng.uniform(0.5, 1.5)
+        else:
+            learned = profile.speed if profile is not None else None
+            speed = learned if learned is not None else governor.speed if governor is not None else base
+            step = speed * DEGREES_PER_S * MM_PER_DEGREE * TICK
+            now += TICK
+        position += step
+        odometer += step
+        if position >= total * (len(times) + 1):
+            times.append(now - lap_start)
+            lap_start = now
+    return times, losses
+
+
+def row(label, times, losses, profile=None):
+    rest = times[SHOWN:]
+    print('%-24s %s %8.1f %7d %10s' % (label, ' '.join('%6.1f' % t for t in times[:SHOWN]),
+                                       sum(rest) / len(rest) if rest else 0.0, losses,
+                                       '-' if profile is None else profile.mismatches))
+
+
+def main(argv):
+    laps = int(option(argv, '--laps', '12'))
+    seed = int(option(argv, '--seed', '0'))
+    base = int(option(argv, '--base', '12'))
+    ratio = float(option(argv, '--ratio', '1.5'))
+    logging.basicConfig(level=logging.ERROR)
+    path = os.path.join(tempfile.mkdtemp(), 'laps.json')
+
+    def governed():
+        return SpeedGovernor(base, int(base * 1.25))
+
+    def learning():
+        return LapProfile(base, int(base * ratio))
+
+    print('model: %d%% base, curves safe up to %d%%, learned up to %d%%; %d laps, seed %d' % (
+        base, CURVE_LIMIT, int(base * ratio), laps, seed))
+    print('%-24s %s %8s %7s %10s' % ('variant', ' '.join('%6s' % ('lap%d' % (i + 1)) for i in range(SHOWN)),
+                                     'rest', 'losses', 'mismatch'))
+    row('constant', *drive('stadium', laps, base, seed=seed))
+    row('governor', *drive('stadium', laps, base, governed(), seed=seed))
+    profile = learning()
+    row('governor + profile', *drive('stadium', laps, base, governed(), profile, seed), profile=profile)
+    profile.save(path)
+    for track in ('stadium', 'changed'):
+        profile = learning()
+        profile.load(path)
+        row('loaded, %s' % track, *drive(track, laps, base, governed(), profile, seed), profile=profile)
+    os.remove(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
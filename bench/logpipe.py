@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Control-loop jitter with synchronous logging against the log pipeline.
+
+    python3 -m bench.logpipe [--iterations N] [--dir PATH] [--write-latency MS]
+
+A stand-in control loop does a fixed amount of work per iteration and logs
+what the scripts log from the hot path: a "Stopping all motors" line every
+few iterations and a printed lost-line counter every iteration. It runs
+three times, with no logging, with ``logging.basicConfig(filename=...)``
+(what the scripts do today, print() going to stdout) and with LogPipeline
+capturing print(). Iteration times are reported as percentiles and their
+standard deviation. On the brick point ``--dir`` at the SD card, which is
+where the synchronous writes hurt. Elsewhere ``--write-latency`` adds a
+sleep to every write() on the log file and stdout to stand in for slow
+storage and a slow terminal.
+"""
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from time import perf_counter, sleep
+
+from robot.logpipe import DEFAULT_FORMAT, LogPipeline
+from robot.loopstats import Histogram
+
+# Iterations of busy work standing in for sensor reads and classification.
+WORK = 300
+
+
+class SlowFile():
+    """File wrapper whose write() takes at least ``latency`` seconds."""
+
+    def __init__(self, f, latency):
+        self.f = f
+        self.latency = latency
+
+    def write(self, text):
+        sleep(self.latency)
+        return self.f.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+def control_loop(iterations, log):
+    """Run the stand-in loop and return its per-iteration durations."""
+    durations = []
+    lost_counter = 0
+    last = perf_counter()
+    for i in range(iterations):
+        total = 0
+        for k in range(WORK):
+            total += k * k
+        if log:
+            print('Lost line counter: ', lost_counter)
+            if i % 10 == 0:
+                logging.getLogger('loop').info('Stopping all motors')
+        lost_counter = (lost_counter + 1) % 100
+        now = perf_counter()
+        durations.append(now - last)
+        last = now
+    return durations
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def run_mode(mode, iterations, directory, latency):
+    path = os.path.join(directory, '%s.log' % mode)
+    stdout_path = os.path.join(directory, '%s.stdout' % mode)
+    reset_logging()
+    # Line buffered, like the SSH terminal the scripts print to.
+    with open(stdout_path, 'w', buffering=1) as stdout, redirect_stdout(SlowFile(stdout, latency)):
+        if mode == 'none':
+            return control_loop(iterations, log=False)
+        if mode == 'sync':
+            logging.basicConfig(filename=path, level=logging.INFO, format=DEFAULT_FORMAT)
+            handler = logging.getLogger().handlers[0]
+            handler.stream = SlowFile(handler.stream, latency)
+            return control_loop(iterations, log=True)
+        pipeline = LogPipeline(path, DEFAULT_FORMAT).install(logging.INFO, capture_stdout=True)
+        pipeline.stream = SlowFile(pipeline.stream, latency)
+        try:
+            return control_loop(iterations, log=True)
+        finally:
+            pipeline.stop()
+
+
+def report(mode, durations):
+    hist = Histogram()
+    for d in durations:
+        hist.add(d)
+    mean = sum(durations) / len(durations)
+    stdev = math.sqrt(sum((d - mean) ** 2 for d in durations) / len(durations))
+    print('%-6s mean=%.3f stdev=%.3f %s' % (mode, mean * 1e3, stdev * 1e3, hist.summary()))
+
+
+def main(argv):
+    iterations = int(argv[argv.index('--iterations') + 1]) if '--iterations' in argv else 20000
+    base = argv[argv.index('--dir') + 1] if '--dir' in argv else None
+    latency = float(argv[argv.index('--write-latency') + 1]) / 1e3 if '--write-latency' in argv else 0.0
+    directory = tempfile.mkdtemp(dir=base)
+    try:
+        results = [(mode, run_mode(mode, iterations, directory, latency)) for mode in ('none', 'sync', 'async')]
+    finally:
+        reset_logging()
+        shutil.rmtree(directory)
+    print('%d iterations, %.1f ms added per write, times in ms' % (iterations, latency * 1e3))
+    for mode, durations in results:
+        report(mode, durations)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
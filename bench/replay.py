@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Replay a recorded trace into controller scripts and diff their motor commands.
+
+    python3 -m bench.replay TRACE SCRIPT [OTHER_SCRIPT] [--show N]
+    python3 -m bench.replay --record TRACE [--script Transporter.py]
+                            [--track oval] [--duration S] [--seed N] [--presses 0,20,25]
+
+TRACE is a telemetry file (TELEMETRY_FILE in the scripts, robot/telemetry.py).
+A SCRIPT is a path, or ``REV:path`` to take the file from git revision REV,
+e.g. ``HEAD~1:Transporter.py``. With one script the replay speed and the
+number of commands are printed. With two scripts both are replayed on the
+same trace and their command streams are aligned and compared, ignoring
+timing; the differing blocks are printed with the simulated time they
+happened at, and the exit status is 1 if the streams differ.
+
+``--record`` writes a trace by running a script on a simulator track, for
+trying changes when no recording from the mat is at hand. The button is
+clicked at each time in ``--presses``: the first starts the script, and
+later ones stop and restart it.
+
+Without arguments, a DEFAULT_DURATION trace of Transporter.py on the oval
+is recorded to a temporary file and replayed into it.
+"""
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from difflib import SequenceMatcher
+from time import perf_counter
+
+from bench.controllers import REPO, TRACKS
+from robot import sim
+from robot.replay import command_key, replay
+from robot.telemetry import read_records
+
+TIME = 1
+DEFAULT_SCRIPT = 'Transporter.py'
+DEFAULT_DURATION = 20.0
+
+
+def resolve(spec, directory):
+    """Path of a script spec, checking ``REV:path`` specs out of git into ``directory``."""
+    if os.path.exists(spec) or ':' not in spec:
+        return spec
+    rev, path = spec.split(':', 1)
+    source = subprocess.check_output(['git', 'show', '%s:%s' % (rev, path)])
+    target = os.path.join(directory, '%s_%s' % (rev.replace('/', '_').replace('~', '_'), os.path.basename(path)))
+    with open(target, 'wb') as f:
+        f.write(source)
+    return target
+
+
+def timed_replay(script, records):
+    start = perf_counter()
+    commands = replay(script, records)
+    return commands, perf_counter() - start
+
+
+def format_command(command):
+    when, port, name, speed, degrees = command
+    args = '' if speed is None else ('%g' % speed if degrees is None else '%g, %g' % (speed, degrees))
+    return '%10.3f %-5s %s(%s)' % (when, port, name, args)
+
+
+def diff(a, b, show):
+    """Print the blocks where command streams ``a`` and ``b`` differ; return how many there are."""
+    matcher = SequenceMatcher(None, [command_key(c) for c in a], [command_key(c) for c in b], autojunk=False)
+    blocks = [op for op in matcher.get_opcodes() if op[0] != 'equal']
+    for tag, i1, i2, j1, j2 in blocks[:show]:
+        print('@@ %s a[%d:%d] b[%d:%d]' % (tag, i1, i2, j1, j2))
+        for command in a[i1:i2][:10]:
+            print('- ' + format_command(command))
+        for command in b[j1:j2][:10]:
+            print('+ ' + format_command(command))
+    if len(blocks) > show:
+        print('... %d more differing blocks' % (len(blocks) - show))
+    return len(blocks)
+
+
+def record(trace, script, track_name, duration, seed, presses):
+    world = sim.set_world(sim.World(TRACKS[track_name](), seed=seed, duration=duration,
+                                    presses=[(start, start + 0.2) for start in presses]))
+    module = sim.load_script(script)
+    module.TELEMETRY_FILE = trace
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            module.main()
+    except sim.SimulationEnd:
+        pass
+    print('recorded %.1fs of %s on %s to %s' % (world.now, script, track_name, trace))
+
+
+def option(argv, name, default):
+    return argv[argv.index(name) + 1] if name in argv else default
+
+
+def main(argv):
+    # Keep the scripts' logging.basicConfig from writing robot.log.
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    if '--record' in argv:
+        record(option(argv, '--record', None), option(argv, '--script', 'Transporter.py'),
+               option(argv, '--track', 'oval'), float(option(argv, '--duration', '60')),
+               int(option(argv, '--seed', '0')),
+               [float(t) for t in option(argv, '--presses', '0').split(',')])
+        return 0
+
+    show = int(option(argv, '--show', '20'))
+    positional = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg.startswith('--'):
+            skip = True
+        else:
+            positional.append(arg)
+    if len(positional) == 1:
+        print(__doc__.split('\n\n')[1])
+        return 2
+    directory = tempfile.mkdtemp()
+    try:
+        if positional:
+            trace, scripts = positional[0], positional[1:]
+        else:
+            script = os.path.join(REPO, DEFAULT_SCRIPT)
+            trace, scripts = os.path.join(directory, 'trace.bin'), [script]
+            record(trace, script, 'oval', DEFAULT_DURATION, 0, [0.0])
+        records = read_records(trace)
+        span = records[-1][TIME] - records[0][TIME]
+        streams = []
+        for spec in scripts:
+            commands, wall = timed_replay(resolve(spec, directory), records)
+            print('%-30s %6d commands, %.1fs of trace in %.2fs (%.0fx real time)' % (
+                spec, len(commands), span, wall, span / wall if wall else 0.0))
+            streams.append(commands)
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    if len(streams) < 2:
+        return 0
+    differing = diff(streams[0], streams[1], show)
+    if not differing:
+        print('command streams are identical')
+    return 1 if differing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
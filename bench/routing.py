@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Empty travel per delivery, fixed shuttle against routed jobs (robot/routing.py).
+
+    python3 -m bench.routing [--layouts loop,shortcut,depots] [--deliveries N]
+
+The simulator has no junctions, so this walks the layouts below as graphs.
+A robot moves from marker to marker along the edges. At each marker it
+takes the branch it was told to, and straight on otherwise.
+
+- fixed: the Transporter without TRACK_FILE. It follows the line
+  (straight at every junction) to the next SOURCE_COLOR marker, picks up,
+  then follows it on to the next TARGET_COLOR marker and drops.
+- routed: a Navigator with JOBS = ((SOURCE_COLOR, TARGET_COLOR),). It is
+  fed every marker the robot drives over and decides the branches and
+  where to stop. The walk checks that it stops where the plan said.
+
+The table gives millimetres driven empty and loaded per delivery, and the
+markers driven over.
+"""
+import logging
+import sys
+
+from bench.controllers import option
+from robot.routing import STRAIGHT, Navigator, TrackGraph
+
+SOURCE_COLOR = 'GREEN'
+TARGET_COLOR = 'RED'
+
+LAYOUTS = {
+    # One loop, one station of each color: nothing to choose.
+    'loop': ('D', {'S': 'GREEN', 'D': 'RED'}, [['D', 'S', 2000], ['S', 'D', 2000]]),
+    # A loop with a shortcut branching off left after the drop, back to the pickup.
+    'shortcut': ('D', {'S': 'GREEN', 'D': 'RED', 'J': 'JUNCTION', 'K': 'JUNCTION'}, [
+        ['S', 'D', 1500], ['D', 'J', 300], ['J', 'K', 2500], ['J', 'S', 600, 'left'], ['K', 'S', 400]]),
+    # Two pickups and two drops round an outer loop, with a cross link through the middle.
+    'depots': ('D2', {'S1': 'GREEN', 'S2': 'GREEN', 'D1': 'RED', 'D2': 'RED', 'J1': 'JUNCTION',
+                      'J2': 'JUNCTION'}, [
+        ['S1', 'J1', 400], ['J1', 'D1', 1800], ['J1', 'D2', 700, 'right'], ['D1', 'S2', 900],
+        ['S2', 'J2', 400], ['J2', 'D2', 1800], ['J2', 'D1', 700, 'right'], ['D2', 'S1', 900]]),
+}
+
+
+def drive(graph, node, branch):
+    """(next node, length) leaving ``node`` on ``branch``, straight if there is no such edge."""
+    edges = graph.edges[node]
+    for following, length, taken in edges:
+        if taken == branch:
+            return following, length
+    for following, length, taken in edges:
+        if taken == STRAIGHT:
+            return following, length
+    return edges[0][:2]
+
+
+def fixed(graph, deliveries):
+    node = graph.start
+    empty = full = markers = 0.0
+    for _ in range(deliveries):
+        for color, loaded in ((SOURCE_COLOR, False), (TARGET_COLOR, True)):
+            while True:
+                node, length = drive(graph, node, STRAIGHT)
+                markers += 1
+                if loaded:
+                    full += length
+                else:
+                    empty += length
+                if graph.nodes[node] == color:
+                    break
+    return empty, full, markers
+
+
+def routed(graph, deliveries):
+    navigator = Navigator(graph, ((SOURCE_COLOR, TARGET_COLOR),))
+    navigator.start_job()
+    node = graph.start
+    branch = STRAIGHT
+    odometer = empty = full = 0.0
+    while navigator.done < deliveries:
+        loaded = navigator.loaded
+        node, length = drive(graph, node, branch)
+        odometer += length
+        if loaded:
+            full += length
+        else:
+            empty += length
+        what, at, branch = navigator.arrive(graph.nodes[node], odometer)
+        if what == 'unexpected' or at != node:
+            raise AssertionError('navigator lost at %s: %s %s' % (node, what, at))
+        branch = branch or STRAIGHT
+    return empty, full, navigator.markers
+
+
+def main(argv):
+    layouts = option(argv, '--layouts', ','.join(sorted(LAYOUTS))).split(',')
+    deliveries = int(option(argv, '--deliveries', '100'))
+    logging.basicConfig(level=logging.WARNING)
+    print('%-10s %-7s %10s %10s %10s' % ('layout', 'mode', 'empty mm', 'loaded mm', 'markers'))
+    for name in layouts:
+        start, nodes, edges = LAYOUTS[name]
+        graph = TrackGraph(nodes, edges, start)
+        for mode, walk in (('fixed', fixed), ('routed', routed)):
+            empty, full, markers = walk(graph, deliveries)
+            print('%-10s %-7s %10.0f %10.0f %10.1f' % (name, mode, empty / deliveries, full / deliveries,
+                                                       markers / float(deliveries)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""The asyncio runtime (robot/runtime.py) against the sequential loop, in the simulator.
+
+    python3 -m bench.runtime [--tracks plain,oval] [--duration S] [--seed N]
+
+Two checks, both on Transporter:
+
+- station moves: the pick-up sequence (arrive_at_source, then
+  pick_up_load: turn, drive in, lift, back out, turn round) and a turn
+  onto a junction's branch are run through the script's own hooks, once
+  blocking, as run_transport_cycle does, and once awaited on a runtime
+  with the sensing, control and button tasks running. Both paths run the
+  same moves (perform). For each the table gives how long the moves took,
+  the sensor readings taken meanwhile, the longest time without one and
+  the periods the control and button tasks skipped (a late reading shows
+  in the longest time). The run exits non-zero if on the runtime that time
+  exceeds BLIND_PERIODS sensing periods or a period was skipped;
+- driving: bench.controllers' metrics for whole runs on each track with
+  ASYNC_RUNTIME off and on. ``steps/s`` is control steps per simulated
+  second: loop iterations for the sequential loop, control task steps for
+  the runtime.
+
+The station moves are started directly rather than driven to, so both
+take the same sequence from the same pose.
+"""
+import logging
+import os
+import sys
+
+from bench.controllers import REPO, TRACKS, option, run_one
+from robot import sim
+from robot.runtime import Runtime
+
+# Sensing periods the runtime may go without a reading while the moves run.
+BLIND_PERIODS = 2
+
+
+def load(seed):
+    """Transporter with its devices attached, in a world without button presses."""
+    world = sim.set_world(sim.World(TRACKS['plain'](), seed=seed, duration=120.0, presses=()))
+    module = sim.load_script(os.path.join(REPO, 'Transporter.py'))
+    module.ASYNC_RUNTIME = True
+    module.init_machine()
+    module.init_filters()
+    module.init_devices()
+    module.attach_devices()
+    return world, module
+
+
+def station_moves(seed):
+    """Per mode: (seconds of moves, readings taken, longest gap between readings, control and button periods
+    skipped), and the sensing period."""
+    reading = ((0, 0, 0), (0, 0, 0), 'GREEN', 'WHITE')
+
+    def hooks(module):
+        return (module.arrive_at_source, module.pick_up_load,
+                lambda reading: module.perform(module.take_branch('right', reading)))
+
+    world, module = load(seed)
+    start = world.now
+    for hook in hooks(module):
+        hook(reading)
+    blocking = world.now - start
+    rows = [('blocking', blocking, 0, blocking, 0)]
+
+    world, module = load(seed)
+    runtime = module.runtime = Runtime(on_brick=module.ON_BRICK)
+    sense = runtime.every('sense', module.SENSE_PERIOD, module.sense)
+    runtime.every('control', module.CONTROL_PERIOD, module.control)
+    runtime.every('button', module.BUTTON_PERIOD, module.check_button)
+
+    async def sequence():
+        # Each hook starts its moves as module.station_task (perform).
+        for hook in hooks(module):
+            hook(reading)
+            await module.station_task
+        runtime.stop()
+    runtime.start(sequence())
+    start = world.now
+    runtime.run()
+    rows.append(('runtime', world.now - start, sense.ticks, sense.interval.max,
+                 sum(periodic.skipped for periodic in runtime.periodic if periodic is not sense)))
+    runtime.close()
+    return rows, module.SENSE_PERIOD
+
+
+def main(argv):
+    tracks = option(argv, '--tracks', 'plain,oval').split(',')
+    duration = float(option(argv, '--duration', '120'))
+    seed = int(option(argv, '--seed', '0'))
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+    rows, period = station_moves(seed)
+    print('station moves')
+    print('%-9s %8s %9s %15s %8s' % ('mode', 'moves s', 'readings', 'longest blind s', 'skipped'))
+    for mode, seconds, readings, blind, skipped in rows:
+        print('%-9s %8.2f %9s %15.3f %8d' % (mode, seconds, '%d of %d' % (readings, seconds / period)
+                                             if readings else '-', blind, skipped))
+    mode, seconds, readings, blind, skipped = rows[-1]
+    failed = blind > BLIND_PERIODS * period or skipped
+    if failed:
+        print('FAILED: the runtime went %.3fs without a reading (at most %.3fs) and skipped %d periods'
+              % (blind, BLIND_PERIODS * period, skipped))
+
+    print('\ndriving, %.0fs per run' % duration)
+    print('%-7s %-8s %5s %9s %8s %10s %7s' % ('track', 'mode', 'laps', 'lap_time', 'steps/s', 'line_loss', 'errors'))
+    for track in tracks:
+        for mode in ('loop', 'runtime'):
+            result = run_one('Transporter', track, duration, seed, [('ASYNC_RUNTIME', mode == 'runtime')])
+            print('%-7s %-8s %5d %9s %8.1f %10d %7d' % (
+                track, mode, result['laps'], '-' if result['lap_time'] is None else '%.2f' % result['lap_time'],
+                result['it_per_s'], result['line_loss_events'], result['errors']))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Time from launch to the "ready" LED, eager device set-up against robot.devices.
+
+    python3 -m bench.startup [--runs N]
+
+Each run starts a fresh interpreter that does what a script does before
+showing "ready": its imports and its device set-up, then sets the LEDs.
+The parent times from starting the process to the child reporting ready,
+so interpreter start-up is included. ``eager`` is how the scripts used to
+start (all four ev3dev2 modules imported and every device opened, Sound
+included, before the LEDs); ``lazy`` uses robot.devices like the scripts
+do now: only the touch sensor and the LEDs come before "ready" and the
+motors and color sensors load in the background, so ``all devices`` is
+also reported. Run it on the brick; elsewhere both modes fall back to
+robot.sim and only the interpreter and Python imports are measured.
+"""
+import json
+import subprocess
+import sys
+from time import perf_counter
+
+
+EAGER = r'''
+import sys, json
+from time import time
+start = time()
+try:
+    from ev3dev2.motor import LargeMotor, MediumMotor, OUTPUT_A, OUTPUT_B, OUTPUT_C
+    from ev3dev2.sensor import INPUT_1, INPUT_2, INPUT_3
+    from ev3dev2.sensor.lego import TouchSensor, ColorSensor
+    from ev3dev2.sound import Sound
+    from ev3dev2.led import Leds
+except Exception:
+    from robot.sim import LargeMotor, MediumMotor, OUTPUT_A, OUTPUT_B, OUTPUT_C
+    from robot.sim import INPUT_1, INPUT_2, INPUT_3
+    from robot.sim import TouchSensor, ColorSensor
+    from robot.sim import Sound, Leds
+import robot.calibration, robot.colors, robot.filter, robot.logpipe, robot.loopstats, robot.pid
+import robot.profiling, robot.sampler, robot.steering, robot.sysfs, robot.telemetry
+imported = time()
+devices = [TouchSensor(INPUT_1), ColorSensor(INPUT_2), ColorSensor(INPUT_3), LargeMotor(OUTPUT_A),
+           LargeMotor(OUTPUT_B), MediumMotor(OUTPUT_C), Sound()]
+leds = Leds()
+leds.set_color('LEFT', 'GREEN')
+leds.set_color('RIGHT', 'GREEN')
+ready = time()
+print('ready', flush=True)
+print(json.dumps({'imports': imported - start, 'devices': ready - imported, 'all devices': 0.0}))
+'''
+
+LAZY = r'''
+import sys, json
+from robot.devices import Devices
+import robot.calibration, robot.colors, robot.filter, robot.logpipe, robot.loopstats, robot.pid
+import robot.profiling, robot.sampler, robot.steering, robot.telemetry
+from time import time
+devices = Devices()
+touch_sensor = devices.touch_sensor
+devices.preload('color_sensor_l', 'color_sensor_r', 'left_wheel', 'right_wheel', 'lift')
+devices.set_led_status('ready')
+ready = time()
+print('ready', flush=True)
+devices.wait()
+timings = dict(devices.startup_timings())
+timings['all devices'] = time() - ready
+print(json.dumps(timings))
+'''
+
+MODES = (('eager', EAGER), ('lazy', LAZY))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run(source):
+    """Start a child running ``source``; return (seconds to ready, its own timings)."""
+    start = perf_counter()
+    child = subprocess.Popen([sys.executable, '-c', source], stdout=subprocess.PIPE, universal_newlines=True)
+    line = child.stdout.readline()
+    ready = perf_counter() - start
+    if line.strip() != 'ready':
+        child.wait()
+        raise RuntimeError('start-up child failed')
+    timings = json.loads(child.stdout.readline())
+    child.wait()
+    return ready, timings
+
+
+def main(argv):
+    runs = int(argv[argv.index('--runs') + 1]) if '--runs' in argv else 10
+    results = {}
+    for i in range(runs):
+        # Interleaved, so drift in the machine's load hits both modes alike.
+        for mode, source in MODES:
+            results.setdefault(mode, []).append(run(source))
+    print('%d runs, median (min) seconds' % runs)
+    for mode, _ in MODES:
+        ready = [r for r, _ in results[mode]]
+        total = [r + t['all devices'] for r, t in results[mode]]
+        print('%-6s launch to ready %.3f (%.3f)  all devices %.3f' % (mode, median(ready), min(ready), median(total)))
+        phases = [phase for phase in results[mode][0][1] if phase != 'all devices']
+        print('       ' + ', '.join('%s %.3f' % (phase, median(t.get(phase, 0.0) for _, t in results[mode]))
+                                    for phase in phases))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
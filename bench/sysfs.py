@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Per-call latency of the raw sysfs driver against ev3dev2.
+
+    python3 -m bench.sysfs [--calls N]
+
+On the brick (color sensor on INPUT_2, large motor on OUTPUT_A) both
+backends are timed on the same devices; the motor only receives speed 0
+commands. Elsewhere ev3dev2 is unavailable, so only the fast driver is
+timed against a fake sysfs tree of regular files, which measures its
+Python-side overhead.
+
+The fast driver also times the two halves of on(). Between the left and
+right wheel starting, go() spends one whole on() when the wheels are
+commanded one after the other, and one run_forever() when robot.drive
+batches them.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+from robot.sysfs import FastColorSensor, FastTachoMotor
+
+
+def time_calls(func, calls):
+    """Return sorted per-call latencies of ``func()`` in microseconds."""
+    samples = []
+    for _ in range(calls):
+        start = perf_counter()
+        func()
+        samples.append((perf_counter() - start) * 1e6)
+    samples.sort()
+    return samples
+
+
+def summary(samples):
+    return '%8.1f %8.1f %8.1f' % (
+        sum(samples) / len(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99)])
+
+
+def benchmark_calls(sensor, motor):
+    """(label, callable) pairs covering the calls made from the control loop."""
+    calls = [
+        ('rgb', lambda: sensor.rgb),
+        ('on', lambda: motor.on(0, brake=False)),
+        ('on_for_degrees', lambda: motor.on_for_degrees(1, 0, brake=False, block=False)),
+        ('stop', motor.stop),
+    ]
+    if isinstance(motor, FastTachoMotor):
+        calls.append(('set_speed', lambda: motor.set_speed(0, brake=False)))
+        calls.append(('run_forever', motor.run_forever))
+    return calls
+
+
+def fake_sysfs(root):
+    """Create a sensor and a motor attribute directory under ``root``."""
+    sensor = os.path.join(root, 'lego-sensor', 'sensor0')
+    motor = os.path.join(root, 'tacho-motor', 'motor0')
+    files = {
+        sensor: {'mode': 'RGB-RAW', 'value0': '150', 'value1': '160', 'value2': '210'},
+        motor: {'command': '', 'speed_sp': '0', 'position_sp': '0', 'stop_action': 'coast', 'state': ''},
+    }
+    for path, attrs in files.items():
+        os.makedirs(path)
+        for name, value in attrs.items():
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(value + '\n')
+    return sensor, motor
+
+
+def main(argv):
+    calls = int(argv[argv.index('--calls') + 1]) if '--calls' in argv else 2000
+    backends = []
+    try:
+        from ev3dev2.motor import LargeMotor, OUTPUT_A
+        from ev3dev2.sensor import INPUT_2
+        from ev3dev2.sensor.lego import ColorSensor
+    except ImportError:
+        root = tempfile.mkdtemp()
+        sensor_path, motor_path = fake_sysfs(root)
+        print('ev3dev2 not available, timing the fast driver on a fake sysfs tree in %s' % root)
+        backends.append(('fast', FastColorSensor(sensor_path), FastTachoMotor(motor_path, 1050, 360)))
+    else:
+        root = None
+        sensor = ColorSensor(INPUT_2)
+        motor = LargeMotor(OUTPUT_A)
+        backends.append(('ev3dev2', sensor, motor))
+        backends.append(('fast', FastColorSensor.wrap(sensor), FastTachoMotor.wrap(motor)))
+
+    print('%-8s %-15s %8s %8s %8s   (microseconds, %d calls)' % ('backend', 'call', 'mean', 'p50', 'p99', calls))
+    try:
+        for label, sensor, motor in backends:
+            for call, func in benchmark_calls(sensor, motor):
+                print('%-8s %-15s %s' % (label, call, summary(time_calls(func, calls))))
+            motor.stop()
+    finally:
+        if root is not None:
+            shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Tune a controller's configuration in the simulator, over all cores.
+
+    python3 -m bench.tune [--controller lineFollower] [--tracks plain,oval] [--seeds 0,1]
+                          [--space NAME=LOW:HIGH:STEP,...] [--set NAME=VALUE,...]
+                          [--configs 27] [--eta 3] [--duration 270] [--min-duration 30]
+                          [--workers N] [--sample-seed 0]
+                          [--cache tune_cache.jsonl] [--output tuning.json]
+
+Speeds, correction angles and thresholds were set by hand on the mat. This
+samples ``--configs`` settings of the parameters in the controller's space
+(SPACES, or ``--space``) and narrows them down by successive halving:
+
+- every configuration still in is run on each track and seed for the
+  rung's duration, with bench.controllers' run_one. The runs are spread
+  over a process pool of ``--workers`` (all cores by default), and they
+  are independent, so a sweep scales with the cores;
+- configurations are ranked by their mean score. The best 1/eta go on
+  to the next rung, which runs eta times longer, up to ``--duration``
+  in the last one. Most of the time is spent on the promising settings,
+  while a grid would give every corner the full duration;
+- the script's own settings are carried through every rung, so the last
+  table compares the winner with them at the full duration.
+
+The score is the run's progress in laps per simulated hour, over the
+duration asked for so a run given up early is not rewarded. Deliveries
+add DELIVERY_VALUE laps each; lifts away from a pad and line losses cost
+some. A run logging an error scores nothing.
+
+Every run's metrics are appended to ``--cache`` as they come in, keyed by
+controller, track, seed, duration, noise, settings and a hash of the
+controller and robot/ sources. A sweep run again, or after being
+interrupted, takes those from the cache and only runs the rest. The same
+``--sample-seed`` samples the same configurations, and a change to the
+code starts afresh.
+
+The best settings go to ``--output`` as a profile (robot/tuning.py),
+which the script uses with TUNING_FILE set to it.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+from time import perf_counter, process_time
+
+from bench.controllers import REPO, option, parse_overrides, run_one
+from robot import sim
+from robot.tuning import save_tuning
+
+# (name, low, high, step) of the parameters tuned for each controller.
+SPACES = {
+    'Transporter': (('STRAIGHT_SPEED', 5, 14, 1), ('BASE_SPEED', 6, 16, 1),
+                    ('CORRECTION_DEGREES', 5, 30, 1), ('BOOST_RATIO', 1.0, 2.0, 0.25)),
+    'lineFollower': (('BASE_SPEED', 6, 18, 1), ('CORRECTION_DEGREES', 8, 40, 1),
+                     ('CROSSING_TICKS', 1, 10, 1), ('BOOST_RATIO', 1.0, 2.0, 0.25)),
+    'test': (('BASE_SPEED', 5, 16, 1), ('TURN_GAIN', 2, 14, 1),
+             ('RECOVERY_ITERATIONS', 5, 60, 5), ('LOST_LINE_THRESHOLD', 20, 160, 10)),
+}
+# Score, in laps: what a delivery is worth, and what a lift away from a pad and a line loss cost.
+DELIVERY_VALUE = 1.0
+MISPLACED_COST = 0.5
+LOSS_COST = 0.01
+SHOWN = 5
+
+
+# === SEARCH SPACE ===
+def parse_space(text):
+    """((name, low, high, step), ...) from 'NAME=LOW:HIGH:STEP,...'; the step defaults to 1."""
+    space = []
+    for item in filter(None, text.split(',')):
+        name, bounds = item.split('=', 1)
+        numbers = [json.loads(number) for number in bounds.split(':')]
+        space.append((name,) + tuple(numbers) + (1,) * (3 - len(numbers)))
+    return tuple(space)
+
+
+def values(low, high, step):
+    count = int(round((high - low) / float(step))) + 1
+    if all(isinstance(x, int) for x in (low, high, step)):
+        return [low + i * step for i in range(count)]
+    return [round(low + i * step, 6) for i in range(count)]
+
+
+def sample(space, count, seed, defaults):
+    """``count`` distinct configurations, the script's own settings first."""
+    rng = random.Random(seed)
+    grids = [(name, values(low, high, step)) for name, low, high, step in space]
+    size = 1
+    for _, grid in grids:
+        size *= len(grid)
+    configs = [defaults]
+    seen = {json.dumps(defaults, sort_keys=True)}
+    while len(configs) < min(count, size + 1):
+        config = dict((name, rng.choice(grid)) for name, grid in grids)
+        key = json.dumps(config, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def defaults_of(controller, space):
+    module = sim.load_script(os.path.join(REPO, controller + '.py'))
+    return dict((name, getattr(module, name)) for name, _, _, _ in space)
+
+
+# === RESULTS CACHE ===
+def code_version(controller):
+    """Hash of the sources a run depends on; results of other code are not reused."""
+    digest = hashlib.sha1()
+    paths = [os.path.join(REPO, controller + '.py'), os.path.join(REPO, 'bench', 'controllers.py')]
+    robot = os.path.join(REPO, 'robot')
+    paths += [os.path.join(robot, name) for name in sorted(os.listdir(robot)) if name.endswith('.py')]
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def cache_key(run):
+    return json.dumps(run, sort_keys=True)
+
+
+def load_cache(path):
+    cache = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted sweep.
+                    continue
+                cache[cache_key(entry['run'])] = entry['metrics']
+    return cache
+
+
+# === RUNS ===
+def quiet():
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+
+
+def execute(run):
+    """Worker: (run, metrics, CPU seconds) of one simulated run."""
+    start = process_time()
+    metrics = run_one(run['controller'], run['track'], run['duration'], run['seed'],
+                      sorted(run['settings'].items()), run['noise'])
+    return run, metrics, process_time() - start
+
+
+def score(metrics, duration):
+    """Laps per simulated hour with the bonuses and costs above; None for a run with errors."""
+    if metrics['errors']:
+        return None
+    laps = (metrics['lap_progress'] or 0.0) - LOSS_COST * metrics['line_loss_events']
+    if metrics['deliveries'] is not None:
+        laps += DELIVERY_VALUE * metrics['deliveries'] - MISPLACED_COST * metrics['misplaced_lifts']
+    return laps * 3600.0 / duration
+
+
+class Tuner():
+    """Runs configurations through the pool and the cache, and scores them."""
+
+    def __init__(self, controller, tracks, seeds, fixed, noise, workers, cache_path):
+        self.controller = controller
+        self.tracks = tracks
+        self.seeds = seeds
+        self.fixed = fixed
+        self.noise = noise
+        self.workers = workers
+        self.cache_path = cache_path
+        self.cache = load_cache(cache_path)
+        self.version = code_version(controller)
+        self.pool = multiprocessing.Pool(workers, initializer=quiet) if workers > 1 else None
+        self.runs = self.cached = 0
+        self.busy = self.wall = 0.0
+
+    def run_for(self, config, track, seed, duration):
+        settings = dict(self.fixed)
+        settings.update(config)
+        return {'controller': self.controller, 'track': track, 'seed': seed, 'duration': duration,
+                'noise': self.noise, 'settings': settings, 'code': self.version}
+
+    def evaluate(self, configs, duration):
+        """Mean score of each configuration over the tracks and seeds, in order."""
+        runs = [self.run_for(config, track, seed, duration)
+                for config in configs for track in self.tracks for seed in self.seeds]
+        missing = [run for run in runs if cache_key(run) not in self.cache]
+        self.cached += len(runs) - len(missing)
+        start = perf_counter()
+        results = self.pool.imap_unordered(execute, missing) if self.pool else map(execute, missing)
+        with open(self.cache_path, 'a') if self.cache_path else open(os.devnull, 'w') as cache:
+            for run, metrics, seconds in results:
+                self.cache[cache_key(run)] = metrics
+                cache.write(json.dumps({'run': run, 'metrics': metrics}, sort_keys=True) + '\n')
+                cache.flush()
+                self.runs += 1
+                self.busy += seconds
+        self.wall += perf_counter() - start
+        per_config = len(self.tracks) * len(self.seeds)
+        scores = []
+        for i in range(len(configs)):
+            scored = [score(self.cache[cache_key(run)], duration) for run in runs[i * per_config:(i + 1) * per_config]]
+            scores.append(None if None in scored else sum(scored) / len(scored))
+        return scores, len(missing)
+
+    def metrics(self, config, duration):
+        return [self.cache[cache_key(self.run_for(config, track, seed, duration))]
+                for track in self.tracks for seed in self.seeds]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+def ranked(configs, scores):
+    order = sorted(range(len(configs)), key=lambda i: float('-inf') if scores[i] is None else scores[i], reverse=True)
+    return [configs[i] for i in order], [scores[i] for i in order]
+
+
+def rungs(configs, eta, duration, min_duration):
+    """(configurations, duration) of each rung, the last at ``duration``."""
+    sizes = [configs]
+    while sizes[-1] > eta:
+        sizes.append(sizes[-1] // eta)
+    return [(size, max(min_duration, duration / float(eta ** (len(sizes) - 1 - r)))) for r, size in enumerate(sizes)]
+
+
+def show(configs, scores, defaults, names):
+    for config, value in list(zip(configs, scores))[:SHOWN]:
+        print('  %8s  %s%s' % ('-' if value is None else '%.1f' % value,
+                               ' '.join('%s=%s' % (name, config[name]) for name in names),
+                               '  (script)' if config == defaults else ''))
+
+
+def main(argv):
+    controller = option(argv, '--controller', 'lineFollower')
+    tracks = option(argv, '--tracks', 'plain,oval').split(',')
+    seeds = [int(seed) for seed in option(argv, '--seeds', '0,1').split(',')]
+    space = parse_space(option(argv, '--space', '')) or SPACES[controller]
+    fixed = dict(parse_overrides(option(argv, '--set', '')))
+    count = int(option(argv, '--configs', '27'))
+    eta = int(option(argv, '--eta', '3'))
+    duration = float(option(argv, '--duration', '270'))
+    min_duration = float(option(argv, '--min-duration', '30'))
+    noise = float(option(argv, '--noise', '3.0'))
+    workers = int(option(argv, '--workers', str(multiprocessing.cpu_count())))
+    sample_seed = int(option(argv, '--sample-seed', '0'))
+    cache_path = option(argv, '--cache', 'tune_cache.jsonl')
+    output = option(argv, '--output', 'tuning.json')
+    # Keep the scripts' logging.basicConfig from writing robot.log.
+    quiet()
+
+    names = [name for name, _, _, _ in space]
+    defaults = defaults_of(controller, space)
+    configs = sample(space, count, sample_seed, defaults)
+    tuner = Tuner(controller, tracks, seeds, fixed, noise, workers, cache_path)
+    print('%s: %d configurations of %s on %s, seeds %s, %d workers' % (
+        controller, len(configs), ', '.join(names), ','.join(tracks), ','.join(map(str, seeds)), workers))
+    try:
+        for rung, (size, seconds) in enumerate(rungs(len(configs), eta, duration, min_duration)):
+            if defaults not in configs[:size]:
+                configs = configs[:size - 1] + [defaults]
+            configs = configs[:size]
+            start = perf_counter()
+            scores, ran = tuner.evaluate(configs, seconds)
+            configs, scores = ranked(configs, scores)
+            runs = len(configs) * len(tracks) * len(seeds)
+            print('rung %d: %d configurations x %d runs of %.0fs, %d run (%d cached) in %.1fs' % (
+                rung + 1, len(configs), len(tracks) * len(seeds), seconds, ran, runs - ran, perf_counter() - start))
+            show(configs, scores, defaults, names)
+    finally:
+        tuner.close()
+
+    best, best_score = configs[0], scores[0]
+    default_score = scores[configs.index(defaults)]
+    if tuner.runs:
+        print('%d runs, %d from the cache; %.1f CPU seconds of runs in %.1fs on %d workers (%.0f%% busy)' % (
+            tuner.runs, tuner.cached, tuner.busy, tuner.wall, workers, 100.0 * tuner.busy / tuner.wall / workers))
+    else:
+        print('all %d runs from the cache' % tuner.cached)
+    settings = dict(fixed)
+    settings.update(best)
+    metrics = tuner.metrics(best, seconds)
+    save_tuning(output, controller, settings, score=best_score, default_score=default_score, tracks=tracks,
+                seeds=seeds, duration=seconds, noise=noise, code=tuner.version,
+                lap_progress=[m['lap_progress'] for m in metrics],
+                line_loss_events=[m['line_loss_events'] for m in metrics])
+    print('best %s (score %s, the script\'s own %s); wrote %s' % (
+        ' '.join('%s=%s' % (name, settings[name]) for name in sorted(settings)),
+        '-' if best_score is None else '%.1f' % best_score,
+        '-' if default_score is None else '%.1f' % default_score, output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,20 +1,48 @@
 #!/usr/bin/env python3
-from time import time
-try:
-    from ev3dev2.motor import LargeMotor, OUTPUT_A, OUTPUT_B
-    from ev3dev2.sensor import INPUT_1, INPUT_2, INPUT_3
-    from ev3dev2.sensor.lego import TouchSensor, ColorSensor
-    from ev3dev2.sound import Sound
-    from ev3dev2.led import Leds
-except Exception:
-    print("Lib import error")
+from robot.devices import Script, time, sleep
+
 import logging
-from time import sleep
+from robot.colors import TABLE_V1, TABLE_V2
+from robot.fsm import ANY, StateMachine, when
+from robot.governor import SpeedGovernor
+from robot.laps import LapProfile
+from robot.logpipe import LogPipeline
+from robot.loopstats import LoopStats
+from robot.pid import LineFollowerPID
+from robot.steering import Steering
+from robot.tuning import load_tuning
 
 # === CONFIGURATION ===
 SOURCE_COLOR = 'GREEN'
 TARGET_COLOR = 'RED'
 BASE_SPEED = 12
+CORRECTION_DEGREES = 23  # wheel degrees the wheel on the line's side backs up in a correction
+CROSSING_TICKS = 5  # black under both sensors within this many ticks is a crossing, driven straight over
+USE_SAMPLER = False  # read sensors on a background thread (robot/sampler.py)
+SAMPLER_RATE_HZ = 100
+FAST_SYSFS = False  # raw sysfs driver for color sensors and motors (robot/sysfs.py)
+ASYNC_LOGGING = False  # queue log records and print() lines, write them on a background thread (robot/logpipe.py)
+TELEMETRY_FILE = None  # e.g. 'telemetry.bin': binary record of every loop iteration (robot/telemetry.py)
+CALIBRATION_FILE = 'calibration.json'  # color tables from calibration mode, used when present (robot/calibration.py)
+CALIBRATION_HOLD = 2.0  # seconds to hold the button at "ready" to start calibration mode
+TUNING_FILE = None  # e.g. 'tuning.json': settings found by bench/tune.py, applied when main() starts (robot/tuning.py)
+PROFILE = None  # 'cprofile' or 'sample': where the loop's time goes; ROBOT_PROFILE or --profile MODE[:SECONDS] at launch (robot/profiling.py)
+PROFILE_FILE = 'profile'  # written as profile.prof (cprofile) or profile.folded (sample) when profiling stops
+PROFILE_SECONDS = 60.0  # seconds profiled once the robot is started, 0 for until the script stops
+PROFILE_INTERVAL = 0.005  # seconds between stacks taken in sample mode
+FILTER_WINDOW = 3  # last readings per sensor a marker color is voted over, 1 turns filtering off (robot/filter.py)
+FILTER_VOTE = 'majority'  # or 'median': the median rgb of the window must classify as the marker
+LINE_HYSTERESIS = 1  # consecutive readings needed to switch between BLACK and WHITE
+COALESCE_WRITES = True  # skip motor and LED commands that repeat what the hardware is doing (robot/drive.py)
+NON_BLOCKING_STEERING = False  # keep sampling during corrections (robot/steering.py)
+ADAPTIVE_SPEED = True  # speed up on straights, back to BASE_SPEED at a correction or marker (robot/governor.py)
+BOOST_RAMP_TIME = 1.0
+LAP_PROFILE_FILE = None  # e.g. 'laps.json': learn where corrections come lap over lap and speed up elsewhere (robot/laps.py)
+LEARNED_SPEED_RATIO = 1.5  # top learned straight speed, times the straight speed
+FOLLOW_MODE = 'bangbang'  # or 'pid': continuous PID on light intensity (robot/pid.py)
+PID_KP = 30.0
+PID_KI = 0.0
+PID_KD = 1.0
 # LIFT_UP_SPEED = 10
 # LIFT_DEGREES = 120
 
@@ -27,122 +55,60 @@ BASE_SPEED = 12
 # STATE_TO_TARGET = 3
 # STATE_DELIVERING = 4
 # STATE_DELIVERED = 5
+STATE_FOLLOWING = 1  # the only state: this script just follows the line
 
 # # === LOGGING SETUP ===
 LOG_FILE = 'robot.log'
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(message)s')
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+if ASYNC_LOGGING:
+    LogPipeline(LOG_FILE, LOG_FORMAT).install(logging.INFO, capture_stdout=True)
+else:
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
+loop_stats = LoopStats('run_transport_cycle')
 
 # logger.basicConfig(level=logging.DEBUG)
 
 # === DEVICE INITIALIZATION ===
+# devices, button, the sensors and motors, sampler, recorder, profiler, the
+# color tables and filters are globals that script sets (robot/devices.py).
+script = Script(globals(), ('color_sensor_l', 'color_sensor_r', 'left_wheel', 'right_wheel'))
+steering = None
+
 def init_devices():
-    """Initialize all motors, sensors, sound, and LEDs as global variables."""
-    global touch_sensor, color_sensor_l, color_sensor_r, left_wheel, right_wheel, sound, leds
-    touch_sensor = TouchSensor(INPUT_1)
-    color_sensor_r = ColorSensor(INPUT_2)
-    color_sensor_l = ColorSensor(INPUT_3)
-    left_wheel = LargeMotor(OUTPUT_A)
-    right_wheel = LargeMotor(OUTPUT_B)
-    sound = Sound()
-    leds = Leds()
-
-# === LED FEEDBACK ===
-def set_led_status(status):
-    """Set LED color and pattern based on status string. Uses more distinct colors and patterns for clarity."""
-    # Color map: (left_color, right_color)
-    color_map = {
-        'ready':    ('GREEN', 'GREEN'),         # Ready to start
-        'lost':     ('ORANGE', 'ORANGE'),       # Lost line
-        'error':    ('RED', 'RED'),             # Error state
-        'working':  ('GREEN', 'AMBER'),         # Following line/working
-        'pickup':   ('AMBER', 'AMBER'),          # Picking up object
-        'drop':     ('AMBER', 'AMBER'),          # Dropping object
-        'pause':    ('YELLOW', 'RED'),          # Paused
-        'stopped':  ('RED', 'BLACK'),           # Stopped by user
-        'default':  ('BLACK', 'BLACK'),         # All off
-    }
-    left, right = color_map.get(status, color_map['default'])
-    leds.set_color('LEFT', left)
-    leds.set_color('RIGHT', right)
+    """Start watching the touch sensor and load the rest in the background."""
+    script.init_devices()
+
+def attach_devices():
+    """Wait for the background set-up and make the motors and color sensors global variables."""
+    global steering
+    script.attach_devices()
+    steering = Steering(left_wheel, right_wheel, blocking=not NON_BLOCKING_STEERING, clock=time)
+
+init_filters, reset_filters, get_readings = script.init_filters, script.reset_filters, script.get_readings
+set_led_status, stop_all_motors = script.set_led_status, script.stop_all_motors
+wait_for_button_press = script.wait_for_button_press
 
 # === COLOR DETECTION ===
 def get_color(sensor):
     """Return color string based on RGB values from a ColorSensor."""
-    r, g, b = sensor.rgb
-
-    # #print(r,g,b)
-    if b > 100:
-        return 'WHITE'
-    if r < 60 and g > 60 and b < 80:
-        return 'GREEN'
-    if r > 100 and g<60:
-        return 'RED'
-    if r < 100 and g<100 and b<100:
-        return 'BLACK'
-    return 'WHITE'
+    return devices.get_color(sensor, TABLE_V1)
 
 def get_color2(sensor):
     """Return color string based on RGB values from a ColorSensor."""
     try:
-        r, g, b = sensor.rgb
+        return devices.get_color(sensor, TABLE_V2)
     except Exception as e:
         logger.error('Sensor read error: ', e)
         set_led_status('error')
         return 'UNKNOWN'
-    if r > 100 and g > 100 and b > 100:
-        return 'WHITE'
-    # if r < 70 and g < 120 and b > 100:
-    #     return 'BLUE'
-    if r < 50 and g > 100 and b < 40:
-        return 'GREEN'
-    if r < 100 and g < 100 and b < 100:
-        return 'BLACK'
-    if r > 120 and g < 60 and b < 60:
-        return 'RED'
-    # if r > 120 and g > 100 and b < 60:
-    #     return 'YELLOW'
-    return 'WHITE'
 
 def go(left, right):
-    left_wheel.on(left)
-    right_wheel.on(right)
+    steering.cancel()
+    devices.go(left, right)
     # right_wheel.on_for_degrees(right, 25, block=False, brake=False)
     # left_wheel.on_for_degrees(left, 25, block=False, brake=False)
 
-# === MOTOR SAFETY ===
-def stop_all_motors():
-    """Stop all drive and lift motors."""
-    logger.info('Stopping all motors')
-    left_wheel.on(0, brake=False, block=False)
-    right_wheel.on(0, brake=False, block=False)
-    left_wheel.stop()
-    right_wheel.stop()
-    # lift.on(0, brake=False, block=False)
-    # lift.stop()
-
-# === LINE FOLLOWING ===
-def get_colors() -> (str, str):
-    """Perform one step of proportional line following. Returns detected colors."""
-    lcol = get_color(color_sensor_l)
-    rcol = get_color(color_sensor_r)
-    return lcol, rcol
-
-# === BUTTON HANDLING ===
-def wait_for_button_press(prompt='Waiting for button press to start...'):
-    """Block until the touch sensor is pressed and released."""
-    #print(prompt)
-    logger.info('Awaiting button press: %s', prompt)
-    set_led_status('ready')
-    while not touch_sensor.is_pressed:
-        sleep(0.05)
-    while touch_sensor.is_pressed:
-        sleep(0.05)
-    logger.info('Button pressed')
-    set_led_status('working')
-
-
 
 def turn(degrees):
     degrees <<= 1
@@ -150,76 +116,160 @@ def turn(degrees):
     left_wheel.on_for_degrees(BASE_SPEED, -degrees, block=True)
 
 
-BOOST_RATIO = 2
+BOOST_RATIO = 1.25
 MAX_SPEED = 20
+follower = None
+
+# === LEARNED SPEED PROFILE ===
+lap_profile = None
+
+def init_lap_profile():
+    """Speeds by distance since the last marker (robot/laps.py), carried on from LAP_PROFILE_FILE."""
+    global lap_profile
+    lap_profile = LapProfile(BASE_SPEED, min(MAX_SPEED, BASE_SPEED * LEARNED_SPEED_RATIO))
+    lap_profile.load(LAP_PROFILE_FILE)
+
+def save_lap_profile():
+    if lap_profile is not None:
+        lap_profile.save(LAP_PROFILE_FILE)
+        lap_profile.log_summary()
+
+def odometer():
+    """Wheel degrees driven forward, averaged over both wheels."""
+    return (left_wheel.position + right_wheel.position) / 2
+
+def straight_speed():
+    """The learned speed for this point of the lap if there is one, else the governor's."""
+    speed = None if lap_profile is None else lap_profile.speed
+    return governor.speed if speed is None else speed
+
+# === LINE FOLLOWING TABLE ===
+# Ticks since each sensor last triggered a correction; a black line under
+# both in quick succession is crossed straight on.
+memory_of_black = [2 * CROSSING_TICKS] * 2
+
+# Actions take the reading (lrgb, rrgb, lcol, rcol) (robot/fsm.py).
+def follow_pid(reading):
+    lrgb, rrgb, lcol, rcol = reading
+    go(*follower.update(lrgb, rrgb, time()))
+
+def drive_straight(reading):
+    # go(8, 8)
+    steering.clear()
+    speed = straight_speed()
+    go(speed, speed)
+
+def steer_right(reading):
+    if memory_of_black[1] < CROSSING_TICKS:
+        steering.correct('forward', BASE_SPEED, 20, 20)
+    else:
+        steering.correct('right', BASE_SPEED, right_degrees=-CORRECTION_DEGREES)
+    memory_of_black[0] = 0
+
+def steer_left(reading):
+    if memory_of_black[0] < CROSSING_TICKS:
+        steering.correct('forward', BASE_SPEED, 20, 20)
+    else:
+        steering.correct('left', BASE_SPEED, left_degrees=-CORRECTION_DEGREES)
+        memory_of_black[1] = 0
+
+def cross_line(reading):
+    steering.correct('forward', BASE_SPEED, 20, 20)
+    # go(BASE_SPEED*last_state,-BASE_SPEED*last_state)
+    if lap_profile is not None:
+        lap_profile.trouble(odometer())
+    memory_of_black[:] = [2 * CROSSING_TICKS] * 2
+
+def follow_rules():
+    """(state, left color, right color, action, next state) rules, the first match wins."""
+    if FOLLOW_MODE == 'pid':
+        return [when(ANY, ANY, ANY, follow_pid)]
+    # !!!! reersed color sensors !!!
+    return [
+        when(ANY, 'WHITE', 'WHITE', drive_straight),
+        when(ANY, 'BLACK', 'WHITE', steer_right),
+        when(ANY, ANY, 'WHITE'),
+        when(ANY, 'WHITE', 'BLACK', steer_left),
+        when(ANY, 'WHITE', ANY),
+        when(ANY, ANY, ANY, cross_line),
+    ]
+
+machine = None
+governor = None
+
+def init_machine():
+    """Compile the line following table (robot/fsm.py), logging what validation finds, and set up the speed governor and PID follower."""
+    global machine, governor, follower
+    follower = LineFollowerPID(BASE_SPEED, PID_KP, PID_KI, PID_KD, max_speed=MAX_SPEED)
+    ceiling = min(MAX_SPEED, BASE_SPEED * BOOST_RATIO) if ADAPTIVE_SPEED else BASE_SPEED
+    if LAP_PROFILE_FILE:
+        init_lap_profile()
+    governor = SpeedGovernor(BASE_SPEED, ceiling, BOOST_RAMP_TIME)
+    machine = StateMachine('follow', {STATE_FOLLOWING: 'FOLLOWING'}, follow_rules(), STATE_FOLLOWING)
+    machine.check()
 
 # === MAIN TRANSPORT ROUTINE WITH STATE MACHINE ===
 def run_transport_cycle(state):
     """Run a single transport cycle using a state machine."""
-    memory_of_black= [10,10]
-    prev_states = [None, None, None]
-    global special_black
+    memory_of_black[:] = [2 * CROSSING_TICKS] * 2
+    loop_stats.start()
+    reset_filters()
+    follower.reset()
+    governor.reset()
+    if lap_profile is not None:
+        lap_profile.reset()
+    machine.reset(STATE_FOLLOWING)
     while True:
-        lcol, rcol = get_colors()
-        
-        # if prev_states != [lcol, rcol, state]:
-        #     prev_states = [lcol, rcol, state]
-        #     print(lcol, rcol, state)
-        #     print(color_sensor_l.rgb,color_sensor_r.rgb)
-        if touch_sensor.is_pressed:
+        loop_stats.tick()
+        if profiler is not None:
+            profiler.check()
+        reading = get_readings()
+        if recorder is not None:
+            lrgb, rrgb, lcol, rcol = reading
+            recorder.record(time(), lrgb, rrgb, lcol, rcol, machine.state, left_wheel, right_wheel)
+        if button.stop_requested:
             stop_all_motors()
+            loop_stats.log_summary()
+            steering.log_summary()
             # logger.info('Button pressed, stopping')
             sleep(0.5)
-            while(not touch_sensor.is_pressed):
-                pass
+            button.wait_for_press()
             return 0
-        elif 'WHITE' == rcol:
-            # !!!! reersed color sensors !!!
-            if lcol == 'WHITE':
-                # go(8, 8)
-                go(BASE_SPEED,BASE_SPEED)
-                # continue
-            elif(lcol == 'BLACK'):
-                if memory_of_black[1] < 5:
-                    right_wheel.on_for_degrees(BASE_SPEED, 20, block=False)
-                    left_wheel.on_for_degrees(BASE_SPEED, 20, block=True)
-                else:
-                    right_wheel.on_for_degrees(BASE_SPEED, -23, block=True)
-                # continue
-                memory_of_black[0] = 0
-        elif 'WHITE' == lcol:
-            if(rcol == 'BLACK'):
-                if memory_of_black[0] < 5:
-                    right_wheel.on_for_degrees(BASE_SPEED, 20, block=False)
-                    left_wheel.on_for_degrees(BASE_SPEED, 20, block=True)
-                else:
-                    left_wheel.on_for_degrees(BASE_SPEED, -23, block=True)
-                    memory_of_black[1] = 0
-                # last_state = -1
-                # continue
-        else:
-            # last_state = -1
-            right_wheel.on_for_degrees(BASE_SPEED, 20, block=False)
-            left_wheel.on_for_degrees(BASE_SPEED, 20, block=True)
-            # go(BASE_SPEED*last_state,-BASE_SPEED*last_state)
-            # go(BASE_SPEED,BASE_SPEED)
-            memory_of_black = [10,10]
+        if ADAPTIVE_SPEED:
+            governor.update(reading[2], reading[3], time())
+        if lap_profile is not None:
+            lap_profile.update(reading[2], reading[3], odometer(), time())
+        machine.step(reading)
         memory_of_black[0] +=1
         memory_of_black[1] +=1
 
-    return state
-
 # === MAIN ENTRY POINT ===
 def main():
     """Main program loop handling repeated transport cycles and safe shutdown."""
+    if TUNING_FILE:
+        load_tuning(TUNING_FILE, globals(), 'lineFollower')
+    init_machine()
+    init_filters()
     init_devices()
-    state = 1
+    state = STATE_FOLLOWING
     try:
-
+        # The motors and color sensors finish loading while waiting for the first press.
+        calibrating = wait_for_button_press()
+        attach_devices()
+        script.load_calibration()
+        while calibrating:
+            script.calibrate_colors()
+            calibrating = wait_for_button_press()
+        if USE_SAMPLER:
+            script.start_sampler()
+        if TELEMETRY_FILE:
+            script.start_recorder()
+        script.start_profiling()
         while True:
-            wait_for_button_press()
             state = run_transport_cycle(state)
             # After button stop, go back to IDLE (wait for next press)
+            while wait_for_button_press():
+                script.calibrate_colors()
     except KeyboardInterrupt:
         stop_all_motors()
         #print('KeyboardInterrupt, motors stopped')
@@ -231,6 +281,20 @@ def main():
     finally:
         stop_all_motors()
         set_led_status('error')
+        script.stop_sampler()
+        script.stop_recorder()
+        script.stop_profiling()
+        button.log_stats()
+        devices.log_summary()
+        loop_stats.log_summary()
+        if left_filter is not None:
+            left_filter.log_summary('Left')
+            right_filter.log_summary('Right')
+        if steering is not None:
+            steering.log_summary()
+        if governor is not None:
+            governor.log_summary()
+        save_lap_profile()
 
 if __name__ == '__main__':
     main()
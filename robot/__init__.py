@@ -0,0 +1 @@
+"""Shared helpers for the EV3 line-following transport robots."""
@@ -0,0 +1,658 @@
+"""Thousands of simulated lineFollower robots stepped together in NumPy arrays.
+
+robot/sim.py runs one robot per World through the script's own code, one
+Python call per sensor read, motor command and integration step. A Batch
+holds the same state for N robots in arrays: pose and odometer, both
+wheels' position, speed and move target, the last readings, and the
+script's controller state (filter windows, speed governor,
+memory_of_black and the last command of each coalesced motor). It
+advances them all with whole-array operations. Its sensing, drive train
+and timing are those of robot.sim.World, and its decisions are those of
+lineFollower.run_transport_cycle in the bang-bang mode:
+
+- a reading is classified with the script's color tables (get_color,
+  left_table and right_table) by indexing their lookup arrays, and
+  filtered like its ColorFilters (majority or median vote, hysteresis);
+- the action for each pair of colors comes from the script's compiled
+  state machine table (robot/fsm.py), mapped to drive_straight,
+  steer_right, steer_left and cross_line. A table with any other action
+  is refused;
+- speeds come from the SpeedGovernor's settings, and the correction
+  angles and thresholds from the script's CONFIGURATION globals.
+
+Every robot runs the scalar loop's sequence of simulated-time advances
+with its own clock: read left, read right, up to two motor commands, then
+STEP-sized waits while a blocking correction moves. It keeps a program
+counter of which advance it is in. Each call to step() first runs the
+logic of the robots whose advance has ended. That logic takes no
+simulated time and ends by starting the next advance. Then step()
+integrates every robot by its own min(STEP, time left), as World.advance
+does. No robot waits for another.
+
+With the same start and no noise, a robot therefore reads, decides and
+commands exactly as the script does in a World, tick for tick, as long as
+NumPy's sin and cos agree with the math module's (bench/batch.py checks
+both this and noisy runs). Noise is drawn with NumPy's generator from a
+table of the normal's quantiles, so a noisy batch robot does not repeat
+a World's noise. For checking, ``replay`` gives recorded readings to use
+instead of the sensed ones.
+
+Progress along each track's centreline and line losses are measured every
+PROBE_EVERY steps, as bench.controllers' Probe does every simulator step.
+A robot that has not seen the line for GIVE_UP seconds is stopped, unless
+``give_up`` is None.
+
+Needs NumPy, so it runs on the host only.
+"""
+import math
+
+import numpy as np
+
+from robot import sim
+from robot.colors import COLOR_CODES, COLOR_NAMES
+
+# What the advance a robot is in is for.
+READ_LEFT, READ_RIGHT, FIRST_COMMAND, SECOND_COMMAND, WAIT = range(5)
+# Actions of the line following table.
+NOTHING, STRAIGHT, RIGHT, LEFT, CROSS = range(5)
+ACTIONS = {'drive_straight': STRAIGHT, 'steer_right': RIGHT, 'steer_left': LEFT, 'cross_line': CROSS}
+# What follows a robot's first command: nothing, the right wheel's on(), or the left wheel's forward move.
+NO_SECOND, ON_RIGHT, FORWARD_LEFT = range(3)
+LEFT_WHEEL, RIGHT_WHEEL = 0, 1
+PORTS = (sim.OUTPUT_A, sim.OUTPUT_B)
+# Both wheels turn this far when steer_right, steer_left or cross_line drive over the line.
+FORWARD_DEGREES = 20
+MAX_SPEED = sim.LargeMotor.MAX_SPEED
+NONE = -1
+# The majority vote's window per sensor and robot is two integers. One holds the last labels, CODE_BITS
+# apiece with the newest lowest; a slot not yet filled holds EMPTY. The other counts each label in a field
+# of COUNT_BITS, EMPTY's included, which no vote reads.
+EMPTY = len(COLOR_NAMES)
+CODE_BITS = EMPTY.bit_length()
+COUNT_BITS = 8
+ONE_OF = np.array([1 << COUNT_BITS * code for code in range(EMPTY + 1)], np.int64)
+# Offsets of the sensor spot's sample points on each axis, and the surfaces' colors, as World.read_rgb.
+SPOT = np.array((-sim.SENSOR_SPOT_RADIUS / 2, 0.0, sim.SENSOR_SPOT_RADIUS / 2))
+SURFACE_RGB = np.array(sim.SURFACE_RGB, np.int64)
+OFF_MAT = 9 * SURFACE_RGB[sim.WHITE]
+# Noise picks one of QUANTILES equally likely quantiles of the standard normal, at a third of the cost of
+# drawing it; its tails are cut at 4.3 sigma.
+QUANTILES = 1 << 16
+
+PROBE_EVERY = 16
+# As bench.controllers' Probe: gaps shorter than LOSS_MIN are grazes, and a
+# robot lost for GIVE_UP seconds is given up. SEARCH_WINDOW centreline points
+# are searched round the last match, fewer than Probe's 30: points are 5mm
+# or more apart, and at the script's speeds the sensors move under 10mm in
+# PROBE_EVERY steps. A match at the window's edge is searched for again over
+# the whole centreline.
+LOSS_MIN = 0.05
+GIVE_UP = 15.0
+SEARCH_WINDOW = 4
+# Robots whose whole centreline is searched at once.
+NEAREST_CHUNK = 256
+
+
+def _per_robot(value, count, dtype=np.float64):
+    array = np.empty(count, dtype)
+    array[:] = value
+    return array
+
+
+def normal_quantiles(count):
+    """The standard normal's quantiles at (i + 0.5) / count, from its density summed on a fine grid."""
+    grid = np.linspace(-8.0, 8.0, 1 << 20)
+    density = np.exp(-grid * grid / 2)
+    cdf = np.concatenate(([0.0], np.cumsum((density[1:] + density[:-1]) / 2)))
+    return np.interp((np.arange(count) + 0.5) / count, cdf / cdf[-1], grid)
+
+
+NORMAL = normal_quantiles(QUANTILES)
+
+
+class Batch():
+    """N lineFollower robots on one or more tracks, advanced together."""
+
+    def __init__(self, module, tracks, track_of, starts, duration, noise=3.0, brightness=1.0, seed=0,
+                 record=(), replay=None, give_up=GIVE_UP):
+        """``module`` is a lineFollower loaded with robot.sim.load_script; ``track_of`` gives each robot's
+        index in ``tracks``, ``starts`` its (x, y, heading). ``noise`` and ``brightness`` are per robot
+        or for all. Readings and motor commands of the robots in ``record`` are kept in ``readings``
+        and ``commands`` as World.commands keeps them; ``replay`` maps robots to the (lrgb, rrgb)
+        readings to use, tick by tick, instead of sensing. ``give_up`` None keeps lost robots going."""
+        self._configure(module)
+        self.tracks = list(tracks)
+        self.track_of = np.asarray(track_of, np.int64)
+        n = self.count = len(self.track_of)
+        starts = np.asarray(starts, np.float64).reshape(n, 3)
+        self.duration = duration
+        self.give_up = give_up
+        self.noise = _per_robot(noise, n)
+        self.brightness = _per_robot(brightness, n)
+        # World.read_rgb's k: the sum of the spot's 9 points times this is their mean, brightened.
+        self.gain = self.brightness / 9
+        self.random = np.random.Generator(np.random.SFC64(seed))
+        self._load_tracks()
+
+        self.x, self.y, self.heading = starts[:, 0].copy(), starts[:, 1].copy(), starts[:, 2].copy()
+        # cos and sin of each heading, worked out again only when it changes.
+        self.cos, self.sin = np.cos(self.heading), np.sin(self.heading)
+        self.odometer = np.zeros(n)
+        self.now = np.zeros(n)
+        self.end = np.zeros(n)
+        self.alive = np.ones(n, bool)
+        self.ticks = np.zeros(n, np.int64)
+        self.steps = 0
+        # Per wheel: position, speed (degrees/s), move target (NaN for none) and last coalesced on() speed.
+        self.position = np.zeros((2, n))
+        self.velocity = np.zeros((2, n))
+        self.target = np.full((2, n), np.nan)
+        self.command = np.full((2, n), np.nan)
+
+        self.pc = np.zeros(n, np.int8)
+        self.second = np.zeros(n, np.int8)
+        self.waited = np.full(n, NONE, np.int8)
+        self.speed = np.zeros(n)
+        self.rgb = np.zeros((2, n, 3), np.int64)
+        self.raw = np.zeros((2, n), np.int64)
+        self.colors = np.zeros((2, n), np.int64)
+        # memory_of_black is the ticks since the tick stamped here.
+        self.cleared = np.full((2, n), -2 * self.crossing_ticks, np.int64)
+
+        # The filters' state, one row per sensor and robot: side * n + robot.
+        self.history = np.full(2 * n, sum(EMPTY << CODE_BITS * i for i in range(self.window)), np.int64)
+        self.tally = np.full(2 * n, self.window * ONE_OF[EMPTY], np.int64)
+        self.window_rgb = np.zeros((2 * n, self.window, 3), np.int64)
+        self.slot = np.zeros(2 * n, np.int64)
+        self.filled = np.zeros(2 * n, np.int64)
+        self.line = np.full(2 * n, NONE, np.int64)
+        self.streak = np.zeros(2 * n, np.int64)
+
+        self.governed = np.full(n, self.base_speed, np.float64)
+        self.since = np.full(n, np.nan)
+
+        self.record = [int(i) for i in record]
+        self.recorded = np.zeros(n, bool)
+        self.recorded[self.record] = True
+        self.readings = dict((i, []) for i in self.record)
+        self.commands = dict((i, []) for i in self.record)
+        self.replay = dict(replay or {})
+        self.replayed = np.zeros(n, bool)
+        self.replayed[list(self.replay)] = True
+
+        self.progress = np.zeros(n, np.int64)
+        self.lost_since = np.full(n, np.nan)
+        self.losses = np.zeros(n, np.int64)
+        self.gave_up = np.zeros(n, bool)
+        self.index = self._nearest(*self._midpoint(), None)
+
+        everyone = np.arange(n)
+        self._advance(everyone, sim.RGB_READ_TIME, READ_LEFT)
+
+    # === CONFIGURATION ===
+    def _configure(self, module):
+        """Read what the vectorized loop needs from the script, refusing what it does not mirror."""
+        if module.FOLLOW_MODE != 'bangbang' or module.NON_BLOCKING_STEERING or module.LAP_PROFILE_FILE:
+            raise ValueError('only blocking bang-bang line following without a lap profile is vectorized')
+        if module.machine is None:
+            module.init_machine()
+        if module.left_filter is None and (module.FILTER_WINDOW > 1 or module.LINE_HYSTERESIS > 1):
+            module.init_filters()
+        machine = module.machine
+        self.actions = np.zeros((len(COLOR_NAMES), len(COLOR_NAMES)), np.int8)
+        for (lcol, rcol), (action, _) in machine.table[machine.state].items():
+            if action is None:
+                continue
+            code = ACTIONS.get(action.__name__)
+            if code is None or getattr(module, action.__name__) is not action:
+                raise ValueError('%s has no vectorized form' % action.__name__)
+            self.actions[COLOR_CODES[lcol], COLOR_CODES[rcol]] = code
+
+        self.base_speed = module.BASE_SPEED
+        self.correction = module.CORRECTION_DEGREES
+        self.crossing_ticks = module.CROSSING_TICKS
+        self.coalesce = module.COALESCE_WRITES
+        governor = module.governor
+        self.adaptive = module.ADAPTIVE_SPEED
+        # No ramp: an infinite rate makes every boosted tick max_speed, as SpeedGovernor does.
+        rate = np.inf if governor.rate is None else governor.rate
+        self.governor = (governor.base_speed, governor.max_speed, rate, governor.hold_time,
+                         COLOR_CODES[governor.background])
+
+        self.tables = [self._table(module.left_table), self._table(module.right_table)]
+        color_filter = module.left_filter
+        self.filtering = color_filter is not None
+        self.window = color_filter.window if self.filtering else 1
+        self.median = self.filtering and color_filter.median
+        if self.filtering:
+            self.votes = color_filter.votes
+            self.hysteresis = color_filter.hysteresis
+            self.background = color_filter.background
+            self.markers = np.array(color_filter.markers, np.int64)
+            self.is_marker = np.array(color_filter.is_marker)
+            if not self.median and self.window * CODE_BITS > 63:
+                raise ValueError('a majority vote over more than %d readings is not vectorized' % (63 // CODE_BITS))
+            self.oldest = CODE_BITS * (self.window - 1)
+            self.marker_fields = sum((1 << COUNT_BITS) - 1 << COUNT_BITS * int(m) for m in self.markers)
+
+    @staticmethod
+    def _table(table):
+        """(r index, g index, b index, codes) arrays of a ColorTable."""
+        return (np.array(table._r, np.int64), np.array(table._g, np.int64), np.array(table._b, np.int64),
+                np.frombuffer(table.codes, np.uint8).astype(np.int64))
+
+    def _load_tracks(self):
+        """All tracks' pixels and centrelines in flat arrays, and the centrelines padded to one length."""
+        tracks = self.tracks
+        self.pixels = np.concatenate([np.frombuffer(bytes(t.pixels), np.uint8) for t in tracks])
+        offsets = np.cumsum([0] + [len(t.pixels) for t in tracks])[:-1]
+        of = self.track_of
+        self.pixel_offset = offsets[of]
+        self.width = np.array([t.width for t in tracks])[of]
+        self.height = np.array([t.height for t in tracks])[of]
+        self.scale = np.array([t.mm_per_px for t in tracks], np.float64)[of]
+        # Each centreline flat, wrapped round by SEARCH_WINDOW points at both ends; an empty one is a
+        # point at infinity.
+        padded = [np.take(np.array(t.centreline or [(np.inf, np.inf)], np.float64),
+                          np.arange(-SEARCH_WINDOW, max(len(t.centreline), 1) + SEARCH_WINDOW), axis=0, mode='wrap')
+                  for t in tracks]
+        line = np.concatenate(padded)
+        self.line_x, self.line_y = line[:, 0].copy(), line[:, 1].copy()
+        self.line_start = (np.cumsum([0] + [len(p) for p in padded])[:-1] + SEARCH_WINDOW)[of]
+        longest = max(len(t.centreline) for t in tracks)
+        self.centreline = np.full((len(tracks), longest, 2), np.inf)
+        for i, track in enumerate(tracks):
+            if track.centreline:
+                self.centreline[i, :len(track.centreline)] = track.centreline
+        self.points = np.array([len(t.centreline) for t in tracks])[of]
+        strides = [int(round(SPOT[2] / t.mm_per_px)) for t in tracks]
+        blocks = np.concatenate([self._blocks(t, stride) for t, stride in zip(tracks, strides)])
+        # A spot covers few mixes of surfaces: each pixel keeps the index of its sum in block_rgb, a byte
+        # where the sum takes 24. Packed 12 bits a color to find them, as 9 * 255 fits in 12 bits.
+        packed = blocks[:, 0] | blocks[:, 1] << 12 | blocks[:, 2] << 24
+        sums, index = np.unique(packed, return_inverse=True)
+        self.block_rgb = np.stack((sums & 4095, sums >> 12 & 4095, sums >> 24), axis=1)
+        self.blocks = index.astype(np.min_scalar_type(len(sums) - 1))
+        self.stride = np.array(strides)[of]
+
+    @staticmethod
+    def _blocks(track, stride):
+        """Per pixel, the colors summed over the 3 x 3 pixels ``stride`` apart from it to the right and below
+        (0 where they leave the track)."""
+        rgb = SURFACE_RGB[np.frombuffer(bytes(track.pixels), np.uint8)].reshape(track.height, track.width, 3)
+        blocks = np.zeros(rgb.shape, np.int64)
+        rows, columns = track.height - 2 * stride, track.width - 2 * stride
+        for i in range(3):
+            for j in range(3):
+                blocks[:rows, :columns] += rgb[i * stride:i * stride + rows, j * stride:j * stride + columns]
+        return blocks.reshape(-1, 3)
+
+    # === SENSING ===
+    def _surface(self, idx, x, y):
+        """Surface codes under the points (x, y) in mm of robots ``idx``; off the mat is WHITE."""
+        scale = self.scale[idx]
+        px = (x / scale).astype(np.int64)
+        py = (y / scale).astype(np.int64)
+        width = self.width[idx]
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < self.height[idx])
+        flat = np.where(inside, self.pixel_offset[idx] + py * width + px, 0)
+        return np.where(inside, self.pixels[flat], sim.WHITE)
+
+    def _sensor(self, idx, port):
+        forward, side = sim.SENSOR_OFFSETS[port]
+        c, s = self.cos[idx], self.sin[idx]
+        return self.x[idx] + forward * c - side * s, self.y[idx] + forward * s + side * c
+
+    def _read(self, idx, x, y):
+        """World.read_rgb of robots ``idx`` whose sensor is at (x, y)."""
+        # The spot's 3 x 3 points: a point's pixel column depends on its x only, its row on its y only.
+        # Mostly they are 3 columns and 3 rows a stride apart on the track, whose sum the block map holds.
+        scale, stride = self.scale[idx], self.stride[idx]
+        first_x, middle_x = ((x + SPOT[0]) / scale).astype(np.int64), (x / scale).astype(np.int64)
+        first_y, middle_y = ((y + SPOT[0]) / scale).astype(np.int64), (y / scale).astype(np.int64)
+        last_x, last_y = ((x + SPOT[2]) / scale).astype(np.int64), ((y + SPOT[2]) / scale).astype(np.int64)
+        width = self.width[idx]
+        regular = ((middle_x - first_x == stride) & (last_x - middle_x == stride) & (first_x >= 0)
+                   & (last_x < width) & (middle_y - first_y == stride) & (last_y - middle_y == stride)
+                   & (first_y >= 0) & (last_y < self.height[idx]))
+        block = self.blocks[np.where(regular, self.pixel_offset[idx] + first_y * width + first_x, 0)]
+        total = np.take(self.block_rgb, block, axis=0)
+        irregular = np.flatnonzero(~regular)
+        if len(irregular):
+            # A spot wholly off the mat reads 9 WHITE.
+            off = ((last_x[irregular] < 0) | (first_x[irregular] >= width[irregular]) | (last_y[irregular] < 0)
+                   | (first_y[irregular] >= self.height[idx[irregular]]))
+            total[irregular[off]] = OFF_MAT
+            irregular = irregular[~off]
+            total[irregular] = self._spot(idx[irregular], x[irregular], y[irregular])
+        noise = np.take(NORMAL, self.random.integers(QUANTILES, size=(len(idx), 3), dtype=np.uint16))
+        noise *= self.noise[idx][:, None]
+        return np.clip(total * self.gain[idx][:, None] + noise, 0, 255).astype(np.int64)
+
+    def _spot(self, idx, x, y):
+        """The spot's 9 surface colors of robots ``idx`` summed."""
+        scale = self.scale[idx, None]
+        px = ((x[:, None] + SPOT) / scale).astype(np.int64)
+        py = ((y[:, None] + SPOT) / scale).astype(np.int64)
+        width, height = self.width[idx, None], self.height[idx, None]
+        in_x, in_y = (px >= 0) & (px < width), (py >= 0) & (py < height)
+        px, py = np.clip(px, 0, width - 1), np.clip(py, 0, height - 1)
+        surface = self.pixels[self.pixel_offset[idx, None, None] + py[:, None, :] * width[:, :, None] + px[:, :, None]]
+        if not (in_x.all() and in_y.all()):
+            surface = np.where(in_x[:, :, None] & in_y[:, None, :], surface, sim.WHITE)
+        return np.take(SURFACE_RGB, surface, axis=0).sum(axis=(1, 2))
+
+    def _sense(self, left, right):
+        """Read the left sensor of robots ``left`` and the right one of robots ``right``, in one pass."""
+        (lx, ly), (rx, ry) = self._sensor(left, sim.INPUT_3), self._sensor(right, sim.INPUT_2)
+        both = self._read(np.concatenate((left, right)), np.concatenate((lx, rx)), np.concatenate((ly, ry)))
+        for side, idx, rgb in ((0, left, both[:len(left)]), (1, right, both[len(left):])):
+            replayed = idx[self.replayed[idx]]
+            for i in replayed:
+                readings = self.replay[i]
+                tick = self.ticks[i]
+                if tick < len(readings):
+                    rgb[np.searchsorted(idx, i)] = readings[tick][side]
+            # Kept for the median vote, else only for the robots whose readings are recorded.
+            kept = slice(None) if self.median else self.recorded[idx]
+            self.rgb[side][idx[kept]] = rgb[kept]
+            self.raw[side][idx] = self._classify(side, rgb)
+
+    # === CONTROLLER ===
+    def _classify(self, side, rgb):
+        """get_color of readings ``rgb`` with the table of the sensor on ``side``."""
+        r_index, g_index, b_index, codes = self.tables[side]
+        return codes[r_index[rgb[:, 0]] + g_index[rgb[:, 1]] + b_index[rgb[:, 2]]]
+
+    def _filter(self, idx, side, code):
+        """ColorFilter.update of robots ``idx`` on ``side``; returns the filtered codes."""
+        window = self.window
+        row = side * self.count + idx
+        if self.median:
+            i = self.slot[row]
+            self.slot[row] = np.where(i + 1 < window, i + 1, 0)
+            filled = np.minimum(self.filled[row] + 1, window)
+            self.filled[row] = filled
+            self.window_rgb[row, i] = np.take(self.rgb[side], idx, axis=0)
+            unused = np.arange(window)[None, :] >= filled[:, None]
+            values = np.where(unused[:, :, None], 256, self.window_rgb[row])
+            middle = np.sort(values, axis=1)[np.arange(len(idx)), filled // 2]
+            voted = self._classify(side, middle)
+            confirmed = np.flatnonzero(self.is_marker[voted] & (filled >= self.votes))
+            marker = voted[confirmed]
+        else:
+            history = self.history[row]
+            old = history >> self.oldest
+            self.history[row] = (history - (old << self.oldest)) << CODE_BITS | code
+            tally = self.tally[row] + ONE_OF[code] - ONE_OF[old]
+            self.tally[row] = tally
+            # Only a window with a marker in it can confirm one: the first marker with the votes.
+            voting = np.flatnonzero((tally & self.marker_fields) != 0)
+            votes = ((tally[voting, None] >> COUNT_BITS * self.markers) & ((1 << COUNT_BITS) - 1)) >= self.votes
+            won = votes.any(axis=1)
+            confirmed = voting[won]
+            marker = self.markers[votes[won].argmax(axis=1)]
+
+        # _settle for the readings that confirmed no marker: a line color is taken, or held while the
+        # other needs more readings, and a marker reports the line color, or background before any.
+        line = self.line[row]
+        take = ~self.is_marker[code]
+        take[confirmed] = False
+        if self.hysteresis > 1:
+            streak = self.streak[row]
+            other = take & (line != NONE) & (code != line)
+            streak = np.where(other, streak + 1, np.where(take, 0, streak))
+            held = other & (streak < self.hysteresis)
+            streak[other & ~held] = 0
+            self.streak[row] = streak
+            take &= ~held
+        line = np.where(take, code, line)
+        self.line[row] = line
+        output = np.where(line == NONE, self.background, line)
+        output[confirmed] = marker
+        return output
+
+    def _govern(self, idx, lcol, rcol):
+        """SpeedGovernor.update of robots ``idx``."""
+        base, top, rate, hold, background = self.governor
+        on = (lcol == background) & (rcol == background)
+        off = idx[np.flatnonzero(~on)]
+        self.governed[off] = base
+        self.since[off] = np.nan
+        on = idx[np.flatnonzero(on)]
+        now = self.now[on]
+        since = self.since[on]
+        starting = np.isnan(since)
+        since = np.where(starting, now, since)
+        self.since[on] = since
+        boost = now - since - hold
+        up = np.flatnonzero(~starting & (boost > 0))
+        self.governed[on[up]] = np.minimum(top, base + np.trunc(boost[up] * rate))
+
+    def _decide(self, idx):
+        """Colors, governor and table for robots that have both readings; issues their first commands."""
+        lcol, rcol = self.raw[0][idx], self.raw[1][idx]
+        if self.filtering:
+            lcol, rcol = self._filter(idx, 0, lcol), self._filter(idx, 1, rcol)
+        self.colors[0][idx], self.colors[1][idx] = lcol, rcol
+        if self.adaptive:
+            self._govern(idx, lcol, rcol)
+        recorded = idx[self.recorded[idx]]
+        for i in recorded:
+            self.readings[i].append((self.now[i], tuple(self.rgb[0, i].tolist()), tuple(self.rgb[1, i].tolist()),
+                                     COLOR_NAMES[self.colors[0, i]], COLOR_NAMES[self.colors[1, i]]))
+
+        action = self.actions[lcol, rcol]
+        ticks, cleared = self.ticks, self.cleared
+        self.second[idx] = NO_SECOND
+        self.waited[idx] = NONE
+
+        straight = idx[np.flatnonzero(action == STRAIGHT)]
+        speed = self.governed[straight]
+        self.speed[straight] = speed
+        if self.coalesce:
+            need_left = self.command[LEFT_WHEEL][straight] != speed
+            need_right = self.command[RIGHT_WHEEL][straight] != speed
+        else:
+            need_left = need_right = np.ones(len(straight), bool)
+        self._on(LEFT_WHEEL, straight[need_left], speed[need_left])
+        self.second[straight[need_left & need_right]] = ON_RIGHT
+        self._on(RIGHT_WHEEL, straight[~need_left & need_right], speed[~need_left & need_right])
+        commanded = [straight[need_left | need_right]]
+
+        right = idx[np.flatnonzero(action == RIGHT)]
+        left = idx[np.flatnonzero(action == LEFT)]
+        cross = idx[np.flatnonzero(action == CROSS)]
+        black_right = ticks[right] - cleared[1][right] < self.crossing_ticks
+        black_left = ticks[left] - cleared[0][left] < self.crossing_ticks
+        forward = np.concatenate([right[black_right], left[black_left], cross])
+        steer_right = right[~black_right]
+        steer_left = left[~black_left]
+        cleared[0][right] = ticks[right]
+        cleared[1][steer_left] = ticks[steer_left]
+        cleared[:, cross] = ticks[cross] - 2 * self.crossing_ticks
+
+        self._on_for_degrees(RIGHT_WHEEL, forward, FORWARD_DEGREES)
+        self.second[forward] = FORWARD_LEFT
+        self._on_for_degrees(RIGHT_WHEEL, steer_right, -self.correction)
+        self.waited[steer_right] = RIGHT_WHEEL
+        self._on_for_degrees(LEFT_WHEEL, steer_left, -self.correction)
+        self.waited[steer_left] = LEFT_WHEEL
+        commanded = np.concatenate(commanded + [forward, steer_right, steer_left])
+        self._advance(commanded, sim.COMMAND_TIME, FIRST_COMMAND)
+        # The robots that sent no command: their tick is over.
+        over = np.ones(self.count, bool)
+        over[commanded] = False
+        return idx[np.flatnonzero(over[idx])]
+
+    # === DRIVE TRAIN ===
+    def _log(self, wheel, idx, command, speed, degrees=None):
+        recorded = self.recorded[idx]
+        if not recorded.any():
+            return
+        speeds = np.broadcast_to(speed, idx.shape)
+        for i, value in zip(idx[recorded], speeds[recorded]):
+            self.commands[i].append((self.now[i], PORTS[wheel], command, value.item(), degrees))
+
+    def _on(self, wheel, idx, speed):
+        self._log(wheel, idx, 'on', speed)
+        self.velocity[wheel][idx] = speed * MAX_SPEED / 100.0
+        self.target[wheel][idx] = np.nan
+        self.command[wheel][idx] = speed
+
+    def _on_for_degrees(self, wheel, idx, degrees):
+        self._log(wheel, idx, 'on_for_degrees', self.base_speed, degrees)
+        native = self.base_speed * MAX_SPEED / 100.0
+        if native < 0:
+            degrees = -degrees
+        self.target[wheel][idx] = self.position[wheel][idx] + degrees if degrees else np.nan
+        self.velocity[wheel][idx] = math.copysign(abs(native), degrees) if degrees else 0.0
+        self.command[wheel][idx] = np.nan
+
+    def _advance(self, idx, seconds, pc):
+        self.end[idx] = self.now[idx] + seconds
+        self.pc[idx] = pc
+
+    def _integrate(self, dt):
+        """One World.advance step of every robot by its own ``dt`` (0 for the stopped ones)."""
+        # Both wheels at once. Only wheels in a blocking correction have a target: NaN reaches nothing.
+        step = self.velocity * dt
+        reached = np.flatnonzero(np.abs(step) >= np.abs(self.target - self.position))
+        self.position += step
+        position, velocity, target = self.position.reshape(-1), self.velocity.reshape(-1), self.target.reshape(-1)
+        position[reached] = target[reached]
+        velocity[reached] = 0.0
+        target[reached] = np.nan
+        vl = self.velocity[LEFT_WHEEL] * sim.MM_PER_DEGREE
+        vr = self.velocity[RIGHT_WHEEL] * sim.MM_PER_DEGREE
+        v = (vl + vr) / 2
+        omega = (vr - vl) / sim.AXLE_TRACK
+        # A robot whose wheels turn alike keeps its heading, and the cos and sin of it.
+        turning = np.flatnonzero(omega != 0)
+        heading = self.heading[turning] + omega[turning] * dt[turning] / 2
+        forward, sideways = v * self.cos, v * self.sin
+        forward[turning] = v[turning] * np.cos(heading)
+        sideways[turning] = v[turning] * np.sin(heading)
+        self.x += forward * dt
+        self.y += sideways * dt
+        self.heading += omega * dt
+        heading = self.heading[turning]
+        self.cos[turning], self.sin[turning] = np.cos(heading), np.sin(heading)
+        self.odometer += np.abs(v) * dt
+        self.now += dt
+
+    # === STEPPING ===
+    def step(self):
+        """Run the logic of robots whose advance has ended, then integrate every robot one step."""
+        done = self.alive & (self.now >= self.end)
+        ended = done & (self.now >= self.duration)
+        self.alive &= ~ended
+        done &= ~ended
+        # Stages go by where each robot was, so none runs two stages in one step.
+        pc = self.pc.copy()
+
+        left = np.flatnonzero(done & (pc == READ_LEFT))
+        idx = np.flatnonzero(done & (pc == READ_RIGHT))
+        self._sense(left, idx)
+        self._advance(left, sim.RGB_READ_TIME, READ_RIGHT)
+        over = [self._decide(idx)]
+
+        idx = np.flatnonzero(done & (pc == FIRST_COMMAND))
+        second = self.second[idx]
+        on_right = idx[second == ON_RIGHT]
+        self._on(RIGHT_WHEEL, on_right, self.speed[on_right])
+        forward_left = idx[second == FORWARD_LEFT]
+        self._on_for_degrees(LEFT_WHEEL, forward_left, FORWARD_DEGREES)
+        self.waited[forward_left] = LEFT_WHEEL
+        self._advance(np.concatenate([on_right, forward_left]), sim.COMMAND_TIME, SECOND_COMMAND)
+        waiting = [idx[second == NO_SECOND], np.flatnonzero(done & ((pc == SECOND_COMMAND) | (pc == WAIT)))]
+
+        # wait_until_not_moving() of blocking corrections.
+        idx = np.concatenate(waiting)
+        waited = self.waited[idx]
+        moving = (waited != NONE) & ~np.isnan(self.target.reshape(-1)[idx + self.count * (waited == RIGHT_WHEEL)])
+        self._advance(idx[np.flatnonzero(moving)], sim.STEP, WAIT)
+        over.append(idx[np.flatnonzero(~moving)])
+
+        idx = np.concatenate(over)
+        self.ticks[idx] += 1
+        self._advance(idx, sim.RGB_READ_TIME, READ_LEFT)
+
+        self._integrate(np.where(self.alive, np.minimum(sim.STEP, self.end - self.now), 0.0))
+        self.steps += 1
+        if self.steps % PROBE_EVERY == 0:
+            self._probe()
+
+    def run(self):
+        """Step until every robot has used up the duration or been given up."""
+        while self.alive.any():
+            self.step()
+        self._probe()
+        return self
+
+    # === MEASURING ===
+    def _midpoint(self):
+        everyone = np.arange(self.count)
+        lx, ly = self._sensor(everyone, sim.INPUT_3)
+        rx, ry = self._sensor(everyone, sim.INPUT_2)
+        return (lx + rx) / 2, (ly + ry) / 2
+
+    def _nearest(self, x, y, guess):
+        """Index of each robot's centreline point closest to (x, y), searching round ``guess`` first."""
+        if guess is None:
+            index = np.zeros(self.count, np.int64)
+            for start in range(0, self.count, NEAREST_CHUNK):
+                chunk = slice(start, start + NEAREST_CHUNK)
+                points = self.centreline[self.track_of[chunk]]
+                d = (points[:, :, 0] - x[chunk, None]) ** 2 + (points[:, :, 1] - y[chunk, None]) ** 2
+                index[chunk] = np.argmin(d, axis=1)
+            return index
+        flat = (self.line_start + guess)[:, None] + np.arange(-SEARCH_WINDOW, SEARCH_WINDOW + 1)
+        d = (self.line_x[flat] - x[:, None]) ** 2 + (self.line_y[flat] - y[:, None]) ** 2
+        best = np.argmin(d, axis=1)
+        index = (guess + best - SEARCH_WINDOW) % np.maximum(self.points, 1)
+        lost = np.flatnonzero(np.abs(best - SEARCH_WINDOW) == SEARCH_WINDOW)
+        if len(lost):
+            points = self.centreline[self.track_of[lost]]
+            d = (points[:, :, 0] - x[lost, None]) ** 2 + (points[:, :, 1] - y[lost, None]) ** 2
+            index[lost] = np.argmin(d, axis=1)
+        return index
+
+    def _probe(self):
+        """Progress along the centreline and line losses, as bench.controllers' Probe measures them."""
+        x, y = self._midpoint()
+        index = self._nearest(x, y, self.index)
+        n = np.maximum(self.points, 1)
+        delta = (index - self.index + n // 2) % n - n // 2
+        self.progress += np.where(self.points > 0, delta, 0)
+        self.index = index
+
+        everyone = np.arange(self.count)
+        lx, ly = self._sensor(everyone, sim.INPUT_3)
+        rx, ry = self._sensor(everyone, sim.INPUT_2)
+        t = np.arange(7) / 6.0
+        surface = self._surface(everyone[:, None], lx[:, None] + (rx - lx)[:, None] * t,
+                                ly[:, None] + (ry - ly)[:, None] * t)
+        visible = (surface != sim.WHITE).any(axis=1)
+        now = self.now
+        lost = ~np.isnan(self.lost_since)
+        found = visible & lost
+        self.losses += found & (now - self.lost_since >= LOSS_MIN)
+        self.lost_since[found] = np.nan
+        self.lost_since[~visible & ~lost] = now[~visible & ~lost]
+        if self.give_up is not None:
+            give_up = self.alive & ~visible & lost & (now - self.lost_since > self.give_up)
+            self.gave_up |= give_up
+            self.alive &= ~give_up
+
+    def metrics(self):
+        """Per-robot arrays: simulated time, distance (m), laps along the centreline, line losses, ticks."""
+        laps = np.abs(self.progress) / np.maximum(self.points, 1).astype(np.float64)
+        return {
+            'sim_time': self.now.copy(),
+            'distance_m': self.odometer / 1000.0,
+            'lap_progress': laps,
+            'line_loss_events': self.losses + ~np.isnan(self.lost_since),
+            'gave_up': self.gave_up.copy(),
+            'ticks': self.ticks.copy(),
+        }
@@ -0,0 +1,147 @@
+"""Touch sensor watcher turning the button into press and release events.
+
+The scripts used to read the touch sensor on every control tick, poll it
+every 50 ms while waiting to start and spin on it without sleeping after a
+stop. A ButtonWatcher reads the sensor away from the control loop and
+keeps its state: ``stop_requested`` is set on every press until clear(),
+so the loop checks an attribute instead of making a sysfs read, and the
+wait_for_*() methods block on a condition variable that is notified on
+the edge instead of polling.
+
+On the brick start() runs a thread that reads the sensor every
+``interval`` seconds. Elsewhere something else feeds readings to
+update() (robot.devices does so from the simulator's clock, which keeps
+simulated runs deterministic, and sets ``fed``), or the owner calls
+poll() to read the sensor once (the asyncio runtime's button task,
+robot/runtime.py). The waits sleep with the given ``sleep`` between
+checks and poll the sensor themselves unless it is fed.
+
+After record_edges() every press and release is also kept with the time
+``clock`` gives, until take_edges() hands them over. The telemetry
+recorder (robot/telemetry.py) does so each tick.
+"""
+import logging
+import threading
+from time import sleep as _sleep, time as _time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.01
+
+
+class ButtonWatcher():
+    """Press/release edges of a touch sensor, with waits and a stop flag."""
+
+    def __init__(self, sensor, interval=DEFAULT_INTERVAL, sleep=_sleep, clock=_time):
+        self.sensor = sensor
+        self.interval = interval
+        self.sleep = sleep
+        self.clock = clock
+        # (time, pressed) of the edges since take_edges(), once record_edges() was called.
+        self.edges = None
+        self.pressed = False
+        self.stop_requested = False
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        # update() is called from elsewhere, e.g. the simulator's clock.
+        self.fed = False
+        self.presses = 0
+        self.releases = 0
+        self.polls = 0
+        self.errors = 0
+
+    # === WATCHING ===
+    def start(self):
+        """Watch the sensor on a daemon thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='button-watcher')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        interval = self.interval
+        while self.running:
+            self.poll()
+            _sleep(interval)
+
+    def poll(self):
+        """Read the sensor once, for an owner that watches it without the thread."""
+        try:
+            pressed = self.sensor.is_pressed
+        except Exception:
+            self.errors += 1
+        else:
+            self.update(pressed)
+
+    def update(self, pressed):
+        """Take one reading of the sensor; notifies waiters on an edge."""
+        self.polls += 1
+        if pressed == self.pressed:
+            return
+        with self.condition:
+            self.pressed = pressed
+            if pressed:
+                self.presses += 1
+                self.stop_requested = True
+            else:
+                self.releases += 1
+            if self.edges is not None:
+                self.edges.append((self.clock(), pressed))
+            self.condition.notify_all()
+
+    def record_edges(self):
+        """Keep every press and release from now on for take_edges()."""
+        with self.condition:
+            self.edges = []
+
+    def take_edges(self):
+        """The (time, pressed) edges kept since the last call, oldest first."""
+        with self.condition:
+            edges, self.edges = self.edges, []
+        return edges
+
+    def clear(self):
+        """Forget presses so far; ``stop_requested`` is set again by the next one."""
+        self.stop_requested = False
+
+    # === WAITING ===
+    def _wait(self, predicate, timeout):
+        if self.thread is None:
+            waited = 0.0
+            while not predicate():
+                if timeout is not None and waited >= timeout:
+                    return False
+                self.sleep(self.interval)
+                if not self.fed:
+                    self.poll()
+                waited += self.interval
+            return True
+        with self.condition:
+            return self.condition.wait_for(predicate, timeout)
+
+    def wait_for_press(self, timeout=None):
+        """Return once the button is down or has been pressed since the call; False on timeout."""
+        presses = self.presses
+        return self._wait(lambda: self.pressed or self.presses != presses, timeout)
+
+    def wait_for_release(self, timeout=None):
+        """Return once the button is up or has been released since the call; False on timeout."""
+        releases = self.releases
+        return self._wait(lambda: not self.pressed or self.releases != releases, timeout)
+
+    def wait_for_click(self):
+        """Wait for the button to be pressed and released."""
+        self.wait_for_press()
+        self.wait_for_release()
+
+    def log_stats(self):
+        logger.info('Button watcher: %d presses, %d releases, %d readings, %d read errors',
+                    self.presses, self.releases, self.polls, self.errors)
@@ -0,0 +1,337 @@
+"""Color calibration: per-sensor color tables fitted to readings from the mat.
+
+The threshold sets in robot/colors.py were tuned by hand on one mat in
+one light, and the two sensors do not read alike. In calibration mode
+the robot is put with both sensors on each surface color in turn; every
+sensor's readings of a color give its centroid and covariance. Classifying
+a reading then means picking the nearest centroid, measured in that
+color's own covariance (Mahalanobis distance), so a noisy color gets a
+wider region than a steady one.
+
+A sensor over the edge of the line reads a mix of WHITE and BLACK, which
+may lie closer to a marker color than to either of them. Distances are
+therefore also taken to the segment between the WHITE and BLACK
+centroids, and a reading nearest to it counts as whichever end it is
+closer to, as the hand-tuned thresholds do.
+
+Every sensor's classifier is compiled into a ColorTable on a grid of
+8-value cells per channel (32^3 cells), evaluated at the cell centres, and
+the tables are saved with the centroids so loading does not compile again.
+The calibration is refused if any two colors, or a marker color and the
+edge mix, are less than MIN_SEPARATION standard deviations apart (the
+distance between their centroids over the sum of their spreads along
+it), because such colors would be mistaken for one another on the mat.
+"""
+import base64
+import json
+import logging
+import math
+import os
+
+from robot.colors import COLOR_CODES, ColorTable
+
+logger = logging.getLogger(__name__)
+
+COLORS = ('WHITE', 'BLACK', 'GREEN', 'RED')
+# Surfaces a sensor straddling the line edge reads a mix of.
+MIX = ('WHITE', 'BLACK')
+SAMPLES = 60
+INTERVAL = 0.01
+# Added to the variance of every channel: readings from one spot on the
+# mat vary less than they will while driving.
+VARIANCE_FLOOR = 4.0
+MIN_SEPARATION = 3.0
+MIX_STEPS = 16
+CELL = 8
+EDGES = (tuple(range(CELL, 256, CELL)),) * 3
+VERSION = 1
+
+
+# === 3-VECTOR ALGEBRA ===
+def _sub(a, b):
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _quad(m, v):
+    """v^T m v for a 3x3 matrix ``m``."""
+    return sum(v[i] * m[i][j] * v[j] for i in range(3) for j in range(3))
+
+
+def _inverse(m):
+    (a, b, c), (d, e, f), (g, h, i) = m
+    cofactors = ((e * i - f * h, c * h - b * i, b * f - c * e),
+                 (f * g - d * i, a * i - c * g, c * d - a * f),
+                 (d * h - e * g, b * g - a * h, a * e - b * d))
+    det = a * cofactors[0][0] + b * cofactors[1][0] + c * cofactors[2][0]
+    return [[x / det for x in row] for row in cofactors]
+
+
+def _regularized(cov):
+    return [[cov[i][j] + (VARIANCE_FLOOR if i == j else 0.0) for j in range(3)] for i in range(3)]
+
+
+def _quadratic_form(m):
+    """q(dx, dy, dz) = v^T m v for a symmetric 3x3 ``m``, unrolled: compiling a table calls it ~10^5 times."""
+    a, b, c = m[0][0], m[1][1], m[2][2]
+    d, e, f = 2 * m[0][1], 2 * m[0][2], 2 * m[1][2]
+
+    def q(dx, dy, dz):
+        return a * dx * dx + b * dy * dy + c * dz * dz + d * dx * dy + e * dx * dz + f * dy * dz
+    return q
+
+
+# === MODELS ===
+class ColorModel():
+    """Centroid and covariance of one sensor's readings of one color."""
+
+    def __init__(self, mean, cov, samples):
+        self.mean = tuple(mean)
+        self.cov = [list(row) for row in cov]
+        self.samples = samples
+        self.spread_cov = _regularized(self.cov)
+        self.inverse = _inverse(self.spread_cov)
+        self._distance = _quadratic_form(self.inverse)
+
+    @classmethod
+    def fit(cls, readings):
+        n = len(readings)
+        mean = [sum(channel) / float(n) for channel in zip(*readings)]
+        cov = [[sum((x[i] - mean[i]) * (x[j] - mean[j]) for x in readings) / max(1, n - 1)
+                for j in range(3)] for i in range(3)]
+        return cls(mean, cov, n)
+
+    def distance(self, x):
+        """Squared Mahalanobis distance of reading ``x`` from the centroid."""
+        mean = self.mean
+        return self._distance(x[0] - mean[0], x[1] - mean[1], x[2] - mean[2])
+
+    def spread(self, direction):
+        """Standard deviation along the unit vector ``direction``."""
+        return math.sqrt(_quad(self.spread_cov, direction))
+
+    def to_json(self):
+        return {'mean': list(self.mean), 'cov': self.cov, 'samples': self.samples}
+
+
+class SensorCalibration():
+    """Nearest-centroid classifier of one sensor."""
+
+    def __init__(self, models, codes=None):
+        self.models = dict(models)
+        self.mix = MIX if all(color in self.models for color in MIX) else None
+        if self.mix is not None:
+            a, b = self.models[self.mix[0]], self.models[self.mix[1]]
+            # The spread along the mix, interpolated between its ends in MIX_STEPS steps.
+            self.mix_distance = [_quadratic_form(_inverse(self._mix_cov(step / float(MIX_STEPS))))
+                                 for step in range(MIX_STEPS + 1)]
+        self.table = ColorTable(self._classify_cell, EDGES, codes)
+
+    def _mix_cov(self, t):
+        a, b = self.models[self.mix[0]], self.models[self.mix[1]]
+        return [[(1 - t) * a.spread_cov[i][j] + t * b.spread_cov[i][j] for j in range(3)] for i in range(3)]
+
+    def _segment(self, x):
+        """(t, closest point) of the WHITE-BLACK mix closest to ``x``."""
+        a, b = self.models[self.mix[0]].mean, self.models[self.mix[1]].mean
+        v = _sub(b, a)
+        t = max(0.0, min(1.0, _dot(_sub(x, a), v) / _dot(v, v)))
+        return t, (a[0] + t * v[0], a[1] + t * v[1], a[2] + t * v[2])
+
+    def classify(self, r, g, b):
+        """Color code of a reading: nearest centroid, or nearest end of the edge mix."""
+        x = (r, g, b)
+        best, best_d = None, float('inf')
+        for color, model in self.models.items():
+            d = model.distance(x)
+            if d < best_d:
+                best, best_d = color, d
+        if self.mix is not None:
+            t, point = self._segment(x)
+            d = self.mix_distance[int(t * MIX_STEPS + 0.5)](r - point[0], g - point[1], b - point[2])
+            if d < best_d:
+                best = self.mix[0] if t < 0.5 else self.mix[1]
+        return COLOR_CODES[best]
+
+    def _classify_cell(self, r, g, b):
+        # ColorTable evaluates a cell at its first value; classify its centre.
+        half = (CELL - 1) / 2.0
+        return self.classify(r + half, g + half, b + half)
+
+    def separations(self):
+        """[(label, separation in standard deviations)] for every pair that could be confused."""
+        result = []
+        colors = sorted(self.models, key=lambda color: COLOR_CODES[color])
+        for i, first in enumerate(colors):
+            for second in colors[i + 1:]:
+                a, b = self.models[first], self.models[second]
+                result.append(('%s/%s' % (first, second), _separation(a.mean, a.spread, b.mean, b.spread)))
+        if self.mix is not None:
+            for color in colors:
+                if color in self.mix:
+                    continue
+                model = self.models[color]
+                t, point = self._segment(model.mean)
+                result.append(('%s/%s-%s edge' % ((color,) + self.mix),
+                               _separation(model.mean, model.spread, point, _spread(self._mix_cov(t)))))
+        return result
+
+    def accuracy(self, readings):
+        """Fraction of ``{color: [rgb]}`` readings the compiled table labels correctly."""
+        name = self.table.name
+        total = right = 0
+        for color, samples in readings.items():
+            for r, g, b in samples:
+                total += 1
+                right += name(r, g, b) == color
+        return right / float(total) if total else 1.0
+
+
+def _spread(cov):
+    return lambda direction: math.sqrt(_quad(cov, direction))
+
+
+def _separation(a, a_spread, b, b_spread):
+    d = _sub(b, a)
+    length = math.sqrt(_dot(d, d))
+    if not length:
+        return 0.0
+    u = tuple(c / length for c in d)
+    return length / (a_spread(u) + b_spread(u))
+
+
+class Calibration():
+    """Per-sensor classifiers with their separation report; saved as JSON."""
+
+    def __init__(self, sensors):
+        self.sensors = dict(sensors)
+
+    @classmethod
+    def fit(cls, readings):
+        """From ``{sensor name: {color: [rgb, ...]}}``."""
+        return cls((name, SensorCalibration((color, ColorModel.fit(samples)) for color, samples in colors.items()))
+                   for name, colors in readings.items())
+
+    def tables(self):
+        """{sensor name: ColorTable}."""
+        return dict((name, sensor.table) for name, sensor in self.sensors.items())
+
+    def margin(self):
+        """The smallest separation over all sensors, with its sensor and pair."""
+        return min((separation, name, label) for name, sensor in self.sensors.items()
+                   for label, separation in sensor.separations())
+
+    def problems(self, colors=COLORS, min_separation=MIN_SEPARATION):
+        """Why this calibration should not be used, as messages; empty when it can be."""
+        problems = []
+        for name, sensor in sorted(self.sensors.items()):
+            missing = [color for color in colors if color not in sensor.models]
+            if missing:
+                problems.append('%s: no samples of %s' % (name, ', '.join(missing)))
+            for label, separation in sensor.separations():
+                if separation < min_separation:
+                    problems.append('%s: %s only %.1f standard deviations apart (need %.1f)' % (
+                        name, label, separation, min_separation))
+        return problems
+
+    def log_report(self, readings=None):
+        for name, sensor in sorted(self.sensors.items()):
+            for color, model in sorted(sensor.models.items()):
+                logger.info('Calibration %s %s: mean %s, sd %s, %d samples', name, color,
+                            ' '.join('%.0f' % c for c in model.mean),
+                            ' '.join('%.1f' % math.sqrt(model.cov[i][i]) for i in range(3)), model.samples)
+            logger.info('Calibration %s separations: %s', name, ', '.join(
+                '%s %.1f' % item for item in sensor.separations()))
+            if readings is not None and name in readings:
+                logger.info('Calibration %s: %.1f%% of samples classified right',
+                            name, 100.0 * sensor.accuracy(readings[name]))
+        separation, name, label = self.margin()
+        logger.info('Calibration margin %.1f standard deviations (%s %s)', separation, name, label)
+
+    # === FILE ===
+    def save(self, path):
+        data = {'version': VERSION, 'cell': CELL, 'sensors': {}}
+        for name, sensor in self.sensors.items():
+            data['sensors'][name] = {
+                'colors': dict((color, model.to_json()) for color, model in sensor.models.items()),
+                'table': base64.b64encode(sensor.table.codes).decode('ascii'),
+            }
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != VERSION:
+            raise ValueError('%s: unsupported calibration version %r' % (path, data.get('version')))
+        sensors = []
+        for name, sensor in data['sensors'].items():
+            models = [(color, ColorModel(m['mean'], m['cov'], m['samples'])) for color, m in sensor['colors'].items()]
+            # Tables saved with another cell size are compiled again.
+            codes = base64.b64decode(sensor['table']) if data.get('cell') == CELL else None
+            sensors.append((name, SensorCalibration(models, codes)))
+        return cls(sensors)
+
+
+def load_tables(path):
+    """{sensor name: ColorTable} saved by calibrate() at ``path``, or None if there is no usable file."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        calibration = Calibration.load(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error('Ignoring calibration file %s: %s', path, e)
+        return None
+    logger.info('Color tables from %s', path)
+    return calibration.tables()
+
+
+# === CALIBRATION MODE ===
+def sample(sensors, count=SAMPLES, interval=INTERVAL, sleep=None):
+    """{sensor name: [rgb, ...]}: ``count`` readings of every sensor, ``interval`` seconds apart."""
+    readings = dict((name, []) for name in sensors)
+    for _ in range(count):
+        for name, sensor in sensors.items():
+            readings[name].append(tuple(sensor.rgb))
+        if sleep is not None:
+            sleep(interval)
+    return readings
+
+
+def calibrate(path, sensors, button, set_led_status, sleep, colors=COLORS, samples=SAMPLES):
+    """Calibration mode, driven by the touch sensor; returns the new tables or None if refused.
+
+    For every color the LEDs show 'pause' until the button is clicked with
+    both ``sensors`` ({name: sensor}) on that color, then 'working' while it
+    is sampled. A calibration that passes problems() is saved to ``path``
+    (unless that is None) and the LEDs show 'ready'; otherwise nothing is
+    saved and they show 'error'.
+    """
+    readings = dict((name, {}) for name in sensors)
+    for color in colors:
+        logger.info('Calibration: put both sensors on %s and press the button', color)
+        set_led_status('pause')
+        button.wait_for_click()
+        button.clear()
+        set_led_status('working')
+        for name, values in sample(sensors, samples, INTERVAL, sleep).items():
+            readings[name][color] = values
+    calibration = Calibration.fit(readings)
+    calibration.log_report(readings)
+    problems = calibration.problems(colors)
+    if problems:
+        for problem in problems:
+            logger.error('Calibration refused: %s', problem)
+        set_led_status('error')
+        return None
+    if path:
+        calibration.save(path)
+        logger.info('Calibration saved to %s', path)
+    set_led_status('ready')
+    return calibration.tables()
@@ -0,0 +1,123 @@
+"""Table-driven RGB color classification shared by the line-following scripts.
+
+The hand-tuned if-chains are compiled once into a lookup table so that
+classifying a reading is three index operations, ``rows[r][g][b]``. Every
+threshold in the chains is an axis-aligned comparison, so each channel is
+first mapped to the interval it falls in between two thresholds; the table
+holds one label per (r, g, b) interval cell and is exact on the whole 0-255
+cube. A row is shared by the values of one interval and rows alike are
+kept once, so a table takes kilobytes, not 16M cells.
+"""
+
+# === COLOR CODES ===
+WHITE = 0
+BLACK = 1
+GREEN = 2
+RED = 3
+UNKNOWN = 4
+# Junction pads ("laczenie", about 100 110 180). The fixed thresholds take them for
+# WHITE; only a calibrated table that was shown one returns it (robot/calibration.py).
+JUNCTION = 5
+
+COLOR_NAMES = ('WHITE', 'BLACK', 'GREEN', 'RED', 'UNKNOWN', 'JUNCTION')
+COLOR_CODES = {name: code for code, name in enumerate(COLOR_NAMES)}
+
+
+# === THRESHOLD SETS ===
+def classify_v1(r, g, b):
+    """Thresholds of get_color in Transporter.py and lineFollower.py."""
+    if b > 100:
+        return WHITE
+    if r < 60 and g > 60 and b < 80:
+        return GREEN
+    if r > 100 and g < 60:
+        return RED
+    if r < 100 and g < 100 and b < 100:
+        return BLACK
+    return WHITE
+
+# First value of every interval in which classify_v1 is constant, per channel.
+V1_EDGES = ((60, 100, 101), (60, 61, 100), (80, 100, 101))
+
+
+def classify_v2(r, g, b):
+    """Thresholds of get_color2 (get_color in test.py)."""
+    if r > 100 and g > 100 and b > 100:
+        return WHITE
+    if r < 50 and g > 100 and b < 40:
+        return GREEN
+    if r < 100 and g < 100 and b < 100:
+        return BLACK
+    if r > 120 and g < 60 and b < 60:
+        return RED
+    return WHITE
+
+V2_EDGES = ((50, 100, 101, 121), (60, 100, 101), (40, 60, 100, 101))
+
+
+# === LOOKUP TABLE ===
+class ColorTable():
+    """RGB classifier compiled into a flat lookup table.
+
+    ``classify(r, g, b)`` must return a color code and be constant between the
+    per-channel ``edges``; it is evaluated once per table cell, at the first
+    value of the cell. Given ``codes`` (another table's ``codes`` for the
+    same edges) it is not evaluated at all.
+    """
+
+    def __init__(self, classify, edges, codes=None):
+        self.edges = tuple(tuple(e) for e in edges)
+        bins = [len(e) + 1 for e in self.edges]
+        strides = (bins[1] * bins[2], bins[2], 1)
+        self._r, self._g, self._b = [_channel_index(e, s) for e, s in zip(self.edges, strides)]
+        if codes is None:
+            starts = [(0,) + e for e in self.edges]
+            codes = bytearray(bins[0] * bins[1] * bins[2])
+            for i, r in enumerate(starts[0]):
+                for j, g in enumerate(starts[1]):
+                    for k, b in enumerate(starts[2]):
+                        codes[i * strides[0] + j * strides[1] + k] = classify(r, g, b)
+        elif len(codes) != bins[0] * bins[1] * bins[2]:
+            raise ValueError('%d codes for a table of %d cells' % (len(codes), bins[0] * bins[1] * bins[2]))
+        self.codes = bytes(codes)
+        self.names = tuple(COLOR_NAMES[c] for c in self.codes)
+        # Closures over locals avoid attribute lookups on the hot path.
+        self.code = _lookup(_rows(self.codes, self._r, self._g, self._b))
+        self.name = _lookup(_rows(self.names, self._r, self._g, self._b))
+
+
+def _rows(labels, r_index, g_index, b_index):
+    """``rows[r][g][b]``: the label of every 0-255 RGB reading. A row is built once per interval, and rows
+    alike are kept once."""
+    alike = {}
+    b_rows = {}
+    g_rows = {}
+    for cell in sorted(set(r_index)):
+        for offset in sorted(set(g_index)):
+            row = tuple(labels[cell + offset + index] for index in b_index)
+            b_rows[cell + offset] = alike.setdefault(row, row)
+        row = tuple(b_rows[cell + offset] for offset in g_index)
+        g_rows[cell] = alike.setdefault(row, row)
+    return tuple(g_rows[cell] for cell in r_index)
+
+
+def _lookup(rows):
+    """Build ``lookup(r, g, b)`` returning the label of a 0-255 RGB reading."""
+    def lookup(r, g, b):
+        return rows[r][g][b]
+    return lookup
+
+
+def _channel_index(edges, stride):
+    """Map every channel value 0-255 to its interval number times ``stride``."""
+    index = []
+    cell = 0
+    for value in range(256):
+        while cell < len(edges) and value >= edges[cell]:
+            cell += 1
+        index.append(cell * stride)
+    return tuple(index)
+
+
+TABLE_V1 = ColorTable(classify_v1, V1_EDGES)
+TABLE_V2 = ColorTable(classify_v2, V2_EDGES)
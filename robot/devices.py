@@ -0,0 +1,420 @@
+"""Device layer shared by the scripts, with lazy ev3dev2 imports.
+
+Importing ev3dev2.motor, ev3dev2.sensor.lego, ev3dev2.sound and
+ev3dev2.led up front and opening every device before anything else costs
+the brick several seconds before the "ready" LED comes on. A Devices
+object creates each device on first access and imports the ev3dev2
+module it needs at that moment; ``preload()`` creates the rest on a
+background thread while the program waits for the start button, and
+``wait()`` joins it before the devices are used. Without ev3dev2 (on a
+laptop) the devices, ``time()`` and ``sleep()`` come from robot.sim and
+``preload()`` runs inline, so simulated runs stay deterministic.
+
+Every import and device creation is timed. The first ``'ready'`` LED logs
+the start-up breakdown: interpreter start-up (process start to this
+module being imported, read from /proc), the script's own imports and
+set-up, each ev3dev2 import and each device, and the total time from
+launch to ready. Import this module before anything else in a script so
+the first two phases are told apart correctly.
+
+Script does the set-up the scripts share on the script's own globals:
+the devices, sensor sampler, telemetry recorder, profiler, color tables
+and filters, reading both sensors and waiting for the button.
+"""
+import logging
+import os
+import threading
+import time as _clock
+from importlib import import_module
+from importlib.util import find_spec
+
+# Taken before the robot modules below, which count as the script's imports.
+IMPORTED_AT = _clock.time()
+
+from robot.button import DEFAULT_INTERVAL, ButtonWatcher
+from robot.calibration import COLORS, calibrate, load_tables
+from robot.colors import TABLE_V1
+from robot.drive import CoalescingLeds, CoalescingMotor, CommandBatch, CommandStats
+from robot.filter import ColorFilter
+from robot.loopstats import TimedMotor
+from robot.profiling import profile_mode, start_profiler
+from robot.sampler import LEFT, RIGHT, SensorSampler
+from robot.sysfs import FastColorSensor, FastTachoMotor
+from robot.telemetry import TelemetryRecorder
+
+ON_BRICK = find_spec('ev3dev2') is not None
+if ON_BRICK:
+    from time import time, sleep
+else:
+    # No ev3dev2 (e.g. on a laptop): run on the track simulator in simulated time.
+    from robot.sim import time, sleep
+
+logger = logging.getLogger(__name__)
+
+# name: (module, class, port module, port). The color sensors are wired
+# reversed: the one the scripts call left sits on INPUT_3.
+DEVICES = {
+    'touch_sensor': ('ev3dev2.sensor.lego', 'TouchSensor', 'ev3dev2.sensor', 'INPUT_1'),
+    'color_sensor_r': ('ev3dev2.sensor.lego', 'ColorSensor', 'ev3dev2.sensor', 'INPUT_2'),
+    'color_sensor_l': ('ev3dev2.sensor.lego', 'ColorSensor', 'ev3dev2.sensor', 'INPUT_3'),
+    'left_wheel': ('ev3dev2.motor', 'LargeMotor', 'ev3dev2.motor', 'OUTPUT_A'),
+    'right_wheel': ('ev3dev2.motor', 'LargeMotor', 'ev3dev2.motor', 'OUTPUT_B'),
+    'lift': ('ev3dev2.motor', 'MediumMotor', 'ev3dev2.motor', 'OUTPUT_C'),
+    'leds': ('ev3dev2.led', 'Leds', None, None),
+}
+MOTORS = ('left_wheel', 'right_wheel', 'lift')
+COLOR_SENSORS = ('color_sensor_l', 'color_sensor_r')
+# What get_readings returns for a sensor that could not be read.
+NO_READING = (0, 0, 0)
+
+# (left, right) LED colors of each status.
+LED_STATUS = {
+    'ready':    ('GREEN', 'GREEN'),         # Ready to start
+    'lost':     ('ORANGE', 'ORANGE'),       # Lost line
+    'error':    ('RED', 'RED'),             # Error state
+    'working':  ('GREEN', 'AMBER'),         # Following line/working
+    'pickup':   ('AMBER', 'AMBER'),         # Picking up object
+    'drop':     ('AMBER', 'AMBER'),         # Dropping object
+    'pause':    ('YELLOW', 'RED'),          # Paused
+    'stopped':  ('RED', 'BLACK'),           # Stopped by user
+    'default':  ('BLACK', 'BLACK'),         # All off
+}
+
+
+def process_start():
+    """Wall-clock time this process was started, or None where /proc is not available."""
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces; the fields after it do not.
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return _clock.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+
+
+class Devices():
+    """The robot's devices, each created when first accessed as an attribute.
+
+    Motors are wrapped in TimedMotor when ``loop_stats`` is given, and the
+    motors and color sensors in the raw sysfs drivers when ``fast_sysfs``
+    is set. With ``coalesce`` repeated motor and LED commands are not sent
+    (robot/drive.py).
+    """
+
+    def __init__(self, loop_stats=None, fast_sysfs=False, coalesce=False):
+        self.created_at = _clock.time()
+        self.loop_stats = loop_stats
+        self.fast_sysfs = fast_sysfs
+        self.coalesce = coalesce
+        self.motor_commands = CommandStats()
+        self.led_commands = CommandStats()
+        self.batch = CommandBatch()
+        self.timings = [('imports', self.created_at - IMPORTED_AT)]
+        self.reported = False
+        self.lock = threading.RLock()
+        self.thread = None
+        self.error = None
+
+    def __getattr__(self, name):
+        # Only called until the device is stored as an instance attribute.
+        if name not in DEVICES:
+            raise AttributeError(name)
+        with self.lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = self._create(name)
+        return self.__dict__[name]
+
+    def _import(self, module):
+        if not ON_BRICK:
+            module = 'robot.sim'
+        start = _clock.time()
+        imported = import_module(module)
+        elapsed = _clock.time() - start
+        if elapsed > 0.001:
+            self.timings.append(('import ' + module, elapsed))
+        return imported
+
+    def _create(self, name):
+        module, cls, port_module, port = DEVICES[name]
+        cls = getattr(self._import(module), cls)
+        args = () if port is None else (getattr(self._import(port_module), port),)
+        start = _clock.time()
+        device = cls(*args)
+        if self.fast_sysfs and name in COLOR_SENSORS:
+            device = FastColorSensor.wrap(device)
+        if name in MOTORS:
+            if self.fast_sysfs:
+                device = FastTachoMotor.wrap(device)
+            if self.coalesce:
+                device = CoalescingMotor(device, self.motor_commands, self.batch)
+            if self.loop_stats is not None:
+                device = TimedMotor(device, self.loop_stats)
+        if name == 'leds' and self.coalesce:
+            device = CoalescingLeds(device, self.led_commands)
+        self.timings.append((name, _clock.time() - start))
+        return device
+
+    # === BACKGROUND SET-UP ===
+    def preload(self, *names):
+        """Create the named devices, on a background thread when on the brick."""
+        if not ON_BRICK:
+            for name in names:
+                getattr(self, name)
+            return
+        self.thread = threading.Thread(target=self._preload, args=names, name='device-preload')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _preload(self, *names):
+        try:
+            for name in names:
+                getattr(self, name)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """Wait for preload() to finish; re-raises what it failed with."""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            logger.info('Devices ready %.2fs after launch', _clock.time() - self._launched())
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    # === STARTUP TIMING ===
+    def _launched(self):
+        started = process_start()
+        return IMPORTED_AT if started is None else started
+
+    def startup_timings(self):
+        """[(phase, seconds)] from launch up to now, interpreter start-up first when known."""
+        started = process_start()
+        timings = list(self.timings)
+        if started is not None:
+            timings.insert(0, ('interpreter', IMPORTED_AT - started))
+        return timings
+
+    def log_startup(self):
+        started = self._launched()
+        logger.info('Startup: %s; ready %.2fs after launch', ', '.join(
+            '%s %.3fs' % timing for timing in self.startup_timings()), _clock.time() - started)
+
+    # === BUTTON ===
+    def watch_button(self, interval=DEFAULT_INTERVAL, thread=True):
+        """A ButtonWatcher on the touch sensor (robot/button.py), started unless the caller polls it."""
+        watcher = ButtonWatcher(self.touch_sensor, interval, sleep=sleep, clock=time)
+        if ON_BRICK:
+            return watcher.start() if thread else watcher
+        # Read the simulated button at every simulator step, without spending simulated time.
+        world = import_module('robot.sim').get_world()
+        world.listeners.append(lambda world: watcher.update(world.is_pressed()))
+        watcher.fed = True
+        return watcher
+
+    # === SHARED HELPERS ===
+    def set_led_status(self, status):
+        """Set both LEDs to the colors of ``status`` (see LED_STATUS)."""
+        left, right = LED_STATUS.get(status, LED_STATUS['default'])
+        leds = self.leds
+        leds.set_color('LEFT', left)
+        leds.set_color('RIGHT', right)
+        if status == 'ready' and not self.reported:
+            self.reported = True
+            self.log_startup()
+
+    def go(self, left, right):
+        """Run the wheels at ``left`` and ``right`` percent, both run commands back to back."""
+        with self.batch:
+            self.left_wheel.on(left)
+            self.right_wheel.on(right)
+
+    def log_summary(self):
+        """Log how many motor and LED commands coalescing saved."""
+        self.motor_commands.log_summary('Motor commands')
+        self.led_commands.log_summary('LED commands')
+
+    def get_color(self, sensor, table=TABLE_V1):
+        """Return color string based on RGB values from a ColorSensor."""
+        r, g, b = sensor.rgb
+        return table.name(r, g, b)
+
+    def stop_motors(self):
+        """Stop the drive and lift motors that have been created, leaving them free to turn."""
+        created = self.__dict__
+        drive = [created[name] for name in ('left_wheel', 'right_wheel') if name in created]
+        for motor in drive:
+            motor.on(0, brake=False, block=False)
+        for motor in drive:
+            motor.stop()
+        if 'lift' in created:
+            created['lift'].on(0, brake=False, block=False)
+            created['lift'].stop()
+
+
+# === SCRIPT SET-UP ===
+class Script():
+    """Set-up and sensor reading shared by the scripts, kept in the script's globals.
+
+    ``config`` is the script's globals() and ``names`` the devices it
+    drives besides the touch sensor and LEDs. Settings such as FAST_SYSFS or
+    FILTER_WINDOW are read from it when a method runs, so a tuning profile
+    applied by main() counts, and what a method creates is stored back
+    under the names the script and the benches use: ``devices``,
+    ``button``, ``color_sensor_l``, ``sampler``, ``left_table``,
+    ``left_filter`` and so on. LEDs are set through the script's own
+    ``set_led_status``. With ``read_errors`` a sensor that cannot be read
+    gives NO_READING and 'UNKNOWN' instead of raising.
+    """
+
+    def __init__(self, config, names, table=TABLE_V1, read_errors=False):
+        self.config = config
+        self.names = names
+        self.read_errors = read_errors
+        config.update(dict.fromkeys(names))
+        config.update(devices=None, touch_sensor=None, button=None, sampler=None, recorder=None, profiler=None,
+                      left_table=table, right_table=table, left_filter=None, right_filter=None)
+
+    # === DEVICES ===
+    def init_devices(self, button_thread=True):
+        """Start watching the touch sensor and load the other devices in the background."""
+        config = self.config
+        devices = config['devices'] = Devices(config['loop_stats'], fast_sysfs=config['FAST_SYSFS'],
+                                              coalesce=config['COALESCE_WRITES'])
+        config['touch_sensor'] = devices.touch_sensor
+        config['button'] = devices.watch_button(thread=button_thread)
+        devices.preload(*self.names)
+
+    def attach_devices(self):
+        """Wait for the background set-up and make the devices globals of the script."""
+        devices = self.config['devices']
+        devices.wait()
+        for name in self.names:
+            self.config[name] = getattr(devices, name)
+
+    def set_led_status(self, status):
+        """Set LED color and pattern based on status string (LED_STATUS)."""
+        self.config['devices'].set_led_status(status)
+
+    def stop_all_motors(self):
+        """Stop all drive and lift motors."""
+        logger.info('Stopping all motors')
+        steering = self.config.get('steering')
+        if steering is not None:
+            steering.cancel()
+        self.config['devices'].stop_motors()
+
+    # === BACKGROUND HELPERS ===
+    def start_sampler(self):
+        """Read the sensors on a background thread; the sensor globals become views of its snapshots."""
+        config = self.config
+        sampler = config['sampler'] = SensorSampler(config['color_sensor_l'], config['color_sensor_r'],
+                                                    config['touch_sensor'], config['SAMPLER_RATE_HZ'])
+        sampler.start()
+        config['color_sensor_l'], config['color_sensor_r'], config['touch_sensor'] = sampler.views()
+
+    def stop_sampler(self):
+        """Stop the sampler thread and log its age and dropped-sample counters."""
+        sampler = self.config['sampler']
+        if sampler is not None:
+            sampler.stop()
+            sampler.log_stats()
+
+    def start_recorder(self):
+        """Record sensors, colors, state and motor commands of every loop iteration, and the button, to TELEMETRY_FILE."""
+        config = self.config
+        config['recorder'] = TelemetryRecorder(config['TELEMETRY_FILE'], button=config['button'])
+
+    def stop_recorder(self):
+        if self.config['recorder'] is not None:
+            self.config['recorder'].close()
+
+    def start_profiling(self):
+        """Profile the loop in the mode of PROFILE, ROBOT_PROFILE or --profile, if any (robot/profiling.py)."""
+        config = self.config
+        mode, seconds = profile_mode(config['PROFILE'])
+        config['profiler'] = start_profiler(mode, config['PROFILE_FILE'],
+                                            config['PROFILE_SECONDS'] if seconds is None else seconds,
+                                            config['PROFILE_INTERVAL'])
+
+    def stop_profiling(self):
+        if self.config['profiler'] is not None:
+            self.config['profiler'].stop()
+
+    # === COLOR DETECTION ===
+    def load_calibration(self):
+        """Use the color tables in CALIBRATION_FILE if there is one (robot/calibration.py)."""
+        config = self.config
+        tables = load_tables(config['CALIBRATION_FILE'])
+        if tables is not None:
+            config['left_table'] = tables.get('color_sensor_l', config['left_table'])
+            config['right_table'] = tables.get('color_sensor_r', config['right_table'])
+
+    def calibrate_colors(self, colors=COLORS):
+        """Calibration mode: sample each surface color under both sensors, then save and use the new tables."""
+        config = self.config
+        sensors = {'color_sensor_l': config['color_sensor_l'], 'color_sensor_r': config['color_sensor_r']}
+        tables = calibrate(config['CALIBRATION_FILE'], sensors, config['button'], config['set_led_status'],
+                           sleep, colors)
+        if tables is not None:
+            config['left_table'], config['right_table'] = tables['color_sensor_l'], tables['color_sensor_r']
+
+    def init_filters(self):
+        """Marker votes and BLACK/WHITE hysteresis per sensor (robot/filter.py), unless both are off."""
+        config = self.config
+        window, vote, hysteresis = config['FILTER_WINDOW'], config['FILTER_VOTE'], config['LINE_HYSTERESIS']
+        if window > 1 or hysteresis > 1:
+            config['left_filter'] = ColorFilter(window, vote, hysteresis)
+            config['right_filter'] = ColorFilter(window, vote, hysteresis)
+
+    def reset_filters(self):
+        """Forget the readings in the filter windows, they are stale after a stop or a station."""
+        if self.config['left_filter'] is not None:
+            self.config['left_filter'].reset()
+            self.config['right_filter'].reset()
+
+    def get_readings(self):
+        """Read both sensors once. Returns (left rgb, right rgb, left color, right color)."""
+        config = self.config
+        sampler = config['sampler']
+        if sampler is not None:
+            snapshot = sampler.latest()
+            lrgb, rrgb = snapshot[LEFT], snapshot[RIGHT]
+        elif self.read_errors:
+            try:
+                lrgb, rrgb = config['color_sensor_l'].rgb, config['color_sensor_r'].rgb
+            except Exception as e:
+                logger.error('Sensor read error: %s', e)
+                config['set_led_status']('error')
+                return NO_READING, NO_READING, 'UNKNOWN', 'UNKNOWN'
+        else:
+            lrgb, rrgb = config['color_sensor_l'].rgb, config['color_sensor_r'].rgb
+        loop_stats = config['loop_stats']
+        loop_stats.mark_read()
+        left_table, right_table = config['left_table'], config['right_table']
+        lcol, rcol = left_table.name(*lrgb), right_table.name(*rrgb)
+        left_filter = config['left_filter']
+        if left_filter is not None:
+            lcol = left_filter.update(lcol, lrgb, left_table)
+            rcol = config['right_filter'].update(rcol, rrgb, right_table)
+        loop_stats.mark_classified()
+        return lrgb, rrgb, lcol, rcol
+
+    # === BUTTON ===
+    def wait_for_button_press(self, prompt='Waiting for button press to start...'):
+        """Block until the touch sensor is pressed and released; True if it was held CALIBRATION_HOLD seconds."""
+        config = self.config
+        button, set_led_status = config['button'], config['set_led_status']
+        logger.info('Awaiting button press: %s', prompt)
+        set_led_status('ready')
+        button.wait_for_press()
+        held = not button.wait_for_release(config['CALIBRATION_HOLD'])
+        if held:
+            logger.info('Button held, calibration mode')
+            button.wait_for_release()
+        button.clear()
+        logger.info('Button pressed')
+        set_led_status('working')
+        return held
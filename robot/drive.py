@@ -0,0 +1,119 @@
+"""Motor and LED commands that skip what the hardware is already doing.
+
+``go(left, right)`` writes speed, stop action and command to both wheels
+on every tick, even while both sensors read WHITE and the speeds have not
+changed, and the right wheel gets its command a whole on() after the left
+one. set_led_status() rewrites both LEDs on every call.
+
+CoalescingMotor remembers the last command sent to a motor and drops an
+on() that repeats it or a stop() of a motor already stopped;
+on_for_degrees() is always sent, and forgets the remembered command since
+the motor stops by itself at the end of the move. Inside a CommandBatch,
+motors whose driver can split a command (robot/sysfs.py's set_speed() and
+run_forever()) get their speeds written when on() is called and their
+run commands only when the batch closes, back to back. CoalescingLeds
+drops colors an LED group already shows. CommandStats counts the commands
+written and saved.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+STOPPED = ('stop',)
+
+
+class CommandStats():
+    """Commands sent to the hardware and redundant ones skipped."""
+
+    def __init__(self):
+        self.written = 0
+        self.saved = 0
+
+    def log_summary(self, name):
+        total = self.written + self.saved
+        if total:
+            logger.info('%s: %d commands written, %d redundant skipped (%.0f%%)',
+                        name, self.written, self.saved, 100.0 * self.saved / total)
+
+
+class CommandBatch():
+    """Context in which split-capable motors defer their run commands to the end."""
+
+    def __init__(self):
+        self.open = False
+        self.pending = []
+
+    def __enter__(self):
+        self.open = True
+        return self
+
+    def __exit__(self, *exc):
+        self.open = False
+        pending = self.pending
+        for motor in pending:
+            motor.run_forever()
+        del pending[:]
+
+
+class CoalescingMotor():
+    """Motor proxy dropping commands that repeat the motor's current one."""
+
+    def __init__(self, motor, stats, batch=None):
+        self.motor = motor
+        self.stats = stats
+        self.batch = batch
+        self.split = batch is not None and hasattr(motor, 'set_speed')
+        self.command = None
+
+    def on(self, speed, brake=True, block=False):
+        command = ('on', speed, brake)
+        if command == self.command and not block:
+            self.stats.saved += 1
+            return
+        self.command = None if block else command
+        self.stats.written += 1
+        if self.split and self.batch.open and not block:
+            self.motor.set_speed(speed, brake)
+            self.batch.pending.append(self.motor)
+            return
+        return self.motor.on(speed, brake=brake, block=block)
+
+    def on_for_degrees(self, speed, degrees, **kwargs):
+        self.command = None
+        self.stats.written += 1
+        return self.motor.on_for_degrees(speed, degrees, **kwargs)
+
+    def stop(self, *args, **kwargs):
+        if self.command == STOPPED:
+            self.stats.saved += 1
+            return
+        self.command = STOPPED
+        self.stats.written += 1
+        return self.motor.stop(*args, **kwargs)
+
+    def forget(self):
+        """Send the next command whatever it is, e.g. after the motor was driven elsewhere."""
+        self.command = None
+
+    def __getattr__(self, name):
+        return getattr(self.motor, name)
+
+
+class CoalescingLeds():
+    """Leds proxy dropping set_color() calls for the color a group already shows."""
+
+    def __init__(self, leds, stats):
+        self.leds = leds
+        self.stats = stats
+        self.colors = {}
+
+    def set_color(self, group, color, *args, **kwargs):
+        if not args and not kwargs and self.colors.get(group) == color:
+            self.stats.saved += 1
+            return
+        self.colors[group] = color if not args and not kwargs else None
+        self.stats.written += 1
+        return self.leds.set_color(group, color, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.leds, name)
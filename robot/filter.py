@@ -0,0 +1,176 @@
+"""Ring-buffer filtering of the classified sensor colors.
+
+A marker color seen for a single reading, usually where the spot straddles
+the line edge, would otherwise start a full station sequence. A
+ColorFilter sits between a sensor's color table and the state machine and
+keeps that sensor's last ``window`` readings in a fixed ring buffer:
+
+- A marker color (anything but WHITE and BLACK) is only passed on once it
+  is confirmed. With ``vote='majority'`` it must hold ``votes`` of the
+  readings in the window, by default more than half. With ``vote='median'``
+  the per-channel median RGB of the window must classify as that marker.
+- Switching between BLACK and WHITE takes ``hysteresis`` consecutive
+  readings of the new color. The default of 1 switches at once.
+
+While a marker is not confirmed, the sensor keeps reporting the line color
+it last settled on, or WHITE if it has not settled on one since the last
+reset, so a marker is never passed on unconfirmed. All state lives in
+lists allocated up front, and an update only overwrites slots in them.
+
+Every raw marker reading that starts a new sighting is followed up. Either
+it is confirmed (counted with its delay in ticks) or its votes drop out of
+the window first (counted as suppressed).
+"""
+import logging
+from bisect import insort
+
+from robot.colors import COLOR_NAMES
+
+logger = logging.getLogger(__name__)
+
+LINE_COLORS = ('WHITE', 'BLACK')
+NONE = -1
+
+
+class ColorFilter():
+    """Majority or median vote on marker colors and hysteresis on BLACK/WHITE for one sensor."""
+
+    def __init__(self, window=3, vote='majority', hysteresis=1, votes=None, colors=COLOR_NAMES):
+        if vote not in ('majority', 'median'):
+            raise ValueError('unknown vote %r' % (vote,))
+        self.window = max(1, window)
+        self.vote = vote
+        self.median = vote == 'median'
+        self.votes = votes or self.window // 2 + 1
+        self.hysteresis = max(1, hysteresis)
+        self.colors = tuple(colors)
+        self.codes = dict((name, code) for code, name in enumerate(self.colors))
+        self.markers = tuple(code for code, name in enumerate(self.colors) if name not in LINE_COLORS)
+        self.is_marker = tuple(name not in LINE_COLORS for name in self.colors)
+        # Reported for an unconfirmed marker before any line color was read.
+        self.background = self.codes[LINE_COLORS[0]]
+        # Ring buffer of color codes and, for the median, of the channels.
+        self._labels = [0] * self.window
+        self._red = [0] * self.window
+        self._green = [0] * self.window
+        self._blue = [0] * self.window
+        # The channels of the readings in the window, each kept sorted.
+        self._sorted = ([], [], [])
+        self._counts = [0] * len(self.colors)
+        self._pending = [NONE] * len(self.colors)
+        # Clean onset of a marker, or of the other line color, to when it is reported.
+        self.latency = (self.window // 2 if self.median else self.votes - 1)
+        self.line_latency = self.hysteresis - 1
+        self.ticks = 0
+        self.confirmed = 0
+        self.suppressed = 0
+        self.delay_sum = 0
+        self.delay_max = 0
+        self.line_switches = 0
+        self.line_held = 0
+        self.reset()
+
+    def reset(self):
+        """Empty the window, e.g. when the robot was moved or a station was handled."""
+        self._next = 0
+        self._filled = 0
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+            self._pending[i] = NONE
+        for channel in self._sorted:
+            del channel[:]
+        self._line = NONE
+        self._streak = 0
+        self._output = NONE
+
+    def update(self, label, rgb=None, table=None):
+        """Take one reading's color (and for the median vote its rgb and table); return the filtered color."""
+        self.ticks += 1
+        code = self.codes[label]
+        counts = self._counts
+        i = self._next
+        if self._filled == self.window:
+            counts[self._labels[i]] -= 1
+            if self.median:
+                red, green, blue = self._sorted
+                red.remove(self._red[i])
+                green.remove(self._green[i])
+                blue.remove(self._blue[i])
+        else:
+            self._filled += 1
+        self._labels[i] = code
+        counts[code] += 1
+        if self.median:
+            r, g, b = rgb
+            self._red[i] = r
+            self._green[i] = g
+            self._blue[i] = b
+            red, green, blue = self._sorted
+            insort(red, r)
+            insort(green, g)
+            insort(blue, b)
+        self._next = i + 1 if i + 1 < self.window else 0
+
+        output = NONE
+        # The median of fewer readings than a vote needs could be a single stray marker.
+        if self.median and self._filled >= self.votes:
+            middle = self._filled // 2
+            voted = self.codes[table.name(red[middle], green[middle], blue[middle])]
+            if self.is_marker[voted]:
+                output = voted
+        elif not self.median:
+            for marker in self.markers:
+                if counts[marker] >= self.votes:
+                    output = marker
+                    break
+        if output == NONE:
+            output = self._settle(code)
+
+        pending = self._pending
+        if self.is_marker[code] and pending[code] == NONE and self._output != code:
+            pending[code] = self.ticks
+        for marker in self.markers:
+            start = pending[marker]
+            if start != NONE:
+                if output == marker:
+                    delay = self.ticks - start
+                    self.confirmed += 1
+                    self.delay_sum += delay
+                    if delay > self.delay_max:
+                        self.delay_max = delay
+                    pending[marker] = NONE
+                elif not counts[marker]:
+                    self.suppressed += 1
+                    pending[marker] = NONE
+        self._output = output
+        return self.colors[output]
+
+    def _settle(self, code):
+        """Line color to report for a reading that confirmed no marker."""
+        line = self._line
+        if self.is_marker[code]:
+            return self.background if line == NONE else line
+        if line == NONE or code == line:
+            self._line = code
+            self._streak = 0
+            return code
+        self._streak += 1
+        if self._streak >= self.hysteresis:
+            self._line = code
+            self._streak = 0
+            self.line_switches += 1
+            return code
+        self.line_held += 1
+        return line
+
+    def log_summary(self, name):
+        if not self.ticks:
+            return
+        sightings = self.confirmed + self.suppressed
+        logger.info('%s color filter: %s of %d, hysteresis %d, adds %d ticks to markers and %d to BLACK/WHITE; '
+                    '%d marker sightings, %d confirmed (delay mean %.1f max %d ticks), %d suppressed (%.0f%%); '
+                    '%d line switches, %d readings held', name, self.vote, self.window, self.hysteresis,
+                    self.latency, self.line_latency, sightings, self.confirmed,
+                    self.delay_sum / self.confirmed if self.confirmed else 0.0, self.delay_max,
+                    self.suppressed, 100.0 * self.suppressed / sightings if sightings else 0.0,
+                    self.line_switches, self.line_held)
@@ -0,0 +1,431 @@
+"""Station reservations for several robots sharing one layout.
+
+Every Transporter drives to the same SOURCE_COLOR and TARGET_COLOR
+stations. Without coordination two of them can turn into a station
+together and collide, or one can sit behind another with no idea how
+long it will take. The Coordinator runs as its own process (``python3
+-m robot.fleet``) and robots talk to it over TCP, one JSON object per
+line, request and reply:
+
+- ``register``: a robot announces itself by name;
+- ``report``: a state transition, which also proves the robot is alive;
+- ``reserve``: ask for a station. It is granted if the station is free
+  and the robot is first in its queue. Otherwise the robot is queued
+  (unless it asked with ``"queue": false``) and told its place; asking
+  again keeps that place;
+- ``release``: leave a station after the pick-up or drop, or its queue;
+- ``leave``: release everything and forget the robot;
+- ``status``: the robots, stations, queues and counters.
+
+A station whose holder has not been heard from for ``lease`` seconds is
+released, and queued robots that stopped asking are dropped, so a robot
+that crashed or lost its link cannot block the others.
+
+FleetClient is the robot side. A coordinator that cannot be reached must
+never stop a robot. A failed request is retried at most every ``retry``
+seconds, and in between the robot carries on uncoordinated: reservations
+are granted locally and counted as such. Reports need no answer, so they
+are queued and sent by a thread of the client's own; only requests made
+while the robot is stopped at a station wait for the coordinator.
+"""
+import json
+import logging
+import socket
+import socketserver
+import sys
+import threading
+from collections import deque
+from time import monotonic, sleep as _sleep
+
+logger = logging.getLogger(__name__)
+
+PORT = 7070
+# Seconds without a request after which a station holder or queued robot is dropped.
+LEASE = 30.0
+# Client socket timeout and the pause between reconnection attempts.
+TIMEOUT = 0.5
+RETRY = 5.0
+# Seconds between reservation requests while waiting for a station.
+POLL = 0.2
+# State reports queued for the sender thread; the oldest are dropped past this.
+REPORTS = 64
+
+
+def parse_address(address):
+    """(host, port) from 'host:port', 'host' or a (host, port) pair."""
+    if isinstance(address, (tuple, list)):
+        return address[0], int(address[1])
+    host, _, port = address.partition(':')
+    return host or 'localhost', int(port or PORT)
+
+
+# === COORDINATOR ===
+class Station():
+    """Holder and waiting queue of one station."""
+
+    def __init__(self, name):
+        self.name = name
+        self.holder = None
+        self.since = 0.0
+        self.queue = []
+        self.waiting_since = {}
+        self.visits = 0
+        self.occupied = 0.0
+
+
+class Coordinator():
+    """Robots, their last states and station reservations; handle() answers one request."""
+
+    def __init__(self, lease=LEASE, clock=monotonic):
+        self.lease = lease
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.robots = {}
+        self.stations = {}
+        self.started = clock()
+        self.requests = 0
+        self.grants = 0
+        self.contended = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.expired = 0
+
+    def handle(self, request):
+        op = request.get('op')
+        handler = getattr(self, 'op_' + str(op), None)
+        if handler is None:
+            return {'error': 'unknown op %r' % (op,)}
+        with self.lock:
+            self.requests += 1
+            now = self.clock()
+            robot = request.get('robot')
+            if robot is not None:
+                self._seen(robot, now)
+            self._expire(now)
+            try:
+                return handler(request, now)
+            except (KeyError, TypeError) as e:
+                return {'error': 'bad %s request: %s' % (op, e)}
+
+    def _seen(self, robot, now):
+        entry = self.robots.get(robot)
+        if entry is None:
+            entry = self.robots[robot] = {'state': None, 'since': now, 'transitions': 0}
+        entry['seen'] = now
+
+    def _station(self, name):
+        station = self.stations.get(name)
+        if station is None:
+            station = self.stations[name] = Station(name)
+        return station
+
+    def _expire(self, now):
+        limit = now - self.lease
+        for station in self.stations.values():
+            holder = station.holder
+            if holder is not None and self.robots.get(holder, {}).get('seen', 0.0) < limit:
+                logger.warning('%s held %s without a word for %.0fs, released', holder, station.name, self.lease)
+                self.expired += 1
+                self._vacate(station, now)
+            for robot in [r for r in station.queue if self.robots.get(r, {}).get('seen', 0.0) < limit]:
+                station.queue.remove(robot)
+                station.waiting_since.pop(robot, None)
+
+    def _vacate(self, station, now):
+        station.visits += 1
+        station.occupied += now - station.since
+        station.holder = None
+
+    def op_register(self, request, now):
+        logger.info('%s registered', request['robot'])
+        return {'ok': True, 'lease': self.lease}
+
+    def op_report(self, request, now):
+        entry = self.robots[request['robot']]
+        entry['state'] = request['state']
+        entry['transitions'] += 1
+        return {'ok': True}
+
+    def op_reserve(self, request, now):
+        robot = request['robot']
+        station = self._station(request['station'])
+        if station.holder == robot:
+            return {'granted': True}
+        if station.holder is None and (not station.queue or station.queue[0] == robot):
+            if station.queue:
+                station.queue.pop(0)
+            waited = now - station.waiting_since.pop(robot, now)
+            self.wait_sum += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.grants += 1
+            station.holder = robot
+            station.since = now
+            return {'granted': True, 'waited': waited}
+        if robot not in station.queue:
+            if not request.get('queue', True):
+                return {'granted': False, 'holder': station.holder}
+            station.queue.append(robot)
+            station.waiting_since[robot] = now
+            self.contended += 1
+        return {'granted': False, 'holder': station.holder, 'position': station.queue.index(robot) + 1}
+
+    def op_release(self, request, now):
+        robot = request['robot']
+        station = self._station(request['station'])
+        if robot in station.queue:
+            station.queue.remove(robot)
+            station.waiting_since.pop(robot, None)
+        if station.holder != robot:
+            return {'ok': False, 'holder': station.holder}
+        self._vacate(station, now)
+        return {'ok': True}
+
+    def op_leave(self, request, now):
+        robot = request['robot']
+        for station in self.stations.values():
+            if station.holder == robot:
+                self._vacate(station, now)
+            if robot in station.queue:
+                station.queue.remove(robot)
+                station.waiting_since.pop(robot, None)
+        self.robots.pop(robot, None)
+        logger.info('%s left', robot)
+        return {'ok': True}
+
+    def op_status(self, request, now):
+        return {
+            'uptime': now - self.started,
+            'robots': dict((name, {'state': entry['state'], 'transitions': entry['transitions'],
+                                   'idle': now - entry['seen']}) for name, entry in self.robots.items()),
+            'stations': dict((name, {'holder': s.holder, 'queue': list(s.queue), 'visits': s.visits,
+                                     'occupied': s.occupied + (now - s.since if s.holder else 0.0)})
+                             for name, s in self.stations.items()),
+            'requests': self.requests,
+            'grants': self.grants,
+            'contended': self.contended,
+            'wait_mean': self.wait_sum / self.grants if self.grants else 0.0,
+            'wait_max': self.wait_max,
+            'expired': self.expired,
+        }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        for line in self.rfile:
+            try:
+                response = coordinator.handle(json.loads(line.decode('utf-8')))
+            except ValueError as e:
+                response = {'error': 'bad request: %s' % e}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    """TCP server answering FleetClient requests with a Coordinator, one thread per robot."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('localhost', PORT), coordinator=None):
+        socketserver.ThreadingTCPServer.__init__(self, parse_address(address), _Handler)
+        self.coordinator = coordinator or Coordinator()
+
+
+# === ROBOT SIDE ===
+class FleetClient():
+    """A robot's connection to the coordinator; carries on uncoordinated while it cannot be reached.
+
+    ``robot`` defaults to the host name. ``clock`` times the retries and waits, the
+    scripts pass robot.devices.time so that they follow the simulator's clock.
+    """
+
+    def __init__(self, address, robot, timeout=TIMEOUT, retry=RETRY, clock=monotonic):
+        self.address = parse_address(address)
+        self.robot = robot or socket.gethostname()
+        self.timeout = timeout
+        self.retry = retry
+        self.clock = clock
+        self.sock = None
+        self.reader = None
+        self.down_since = None
+        self.lock = threading.Lock()
+        self.reports = deque(maxlen=REPORTS)
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.held = set()
+        self.calls = 0
+        self.failures = 0
+        self.uncoordinated = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.address, self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+
+    def close(self):
+        """Send the queued reports, tell the coordinator this robot is gone and close the connection."""
+        if self.thread is not None:
+            self.running = False
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+        self._send_reports()
+        if self.sock is not None:
+            self._call('leave')
+        self.held.clear()
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = self.reader = None
+
+    def _call(self, op, **fields):
+        """The coordinator's reply as a dict, or None if it cannot be reached."""
+        with self.lock:
+            return self._request(op, fields)
+
+    def _request(self, op, fields):
+        now = self.clock()
+        if self.down_since is not None and now - self.down_since < self.retry:
+            return None
+        fields['op'] = op
+        fields['robot'] = self.robot
+        try:
+            if self.sock is None:
+                self._connect()
+                if op != 'register':
+                    self._send({'op': 'register', 'robot': self.robot})
+            response = self._send(fields)
+        except (OSError, ValueError) as e:
+            self.failures += 1
+            if self.down_since is None:
+                logger.warning('Fleet coordinator at %s:%d unreachable (%s), carrying on uncoordinated',
+                               self.address[0], self.address[1], e)
+            self.down_since = now
+            if self.sock is not None:
+                self.reader.close()
+                self.sock.close()
+                self.sock = self.reader = None
+            return None
+        if self.down_since is not None:
+            logger.info('Fleet coordinator at %s:%d reachable again', *self.address)
+            self.down_since = None
+        self.calls += 1
+        if 'error' in response:
+            logger.error('Fleet coordinator: %s', response['error'])
+        return response
+
+    def _send(self, request):
+        self.sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        line = self.reader.readline()
+        if not line:
+            raise OSError('connection closed')
+        return json.loads(line.decode('utf-8'))
+
+    def register(self):
+        return self._call('register') is not None
+
+    def report(self, state):
+        """Queue a state transition for the sender thread; never waits for the coordinator."""
+        self.reports.append(state)
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='fleet-reports')
+            self.thread.daemon = True
+            self.thread.start()
+        self.wakeup.set()
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self._send_reports()
+
+    def _send_reports(self):
+        reports = self.reports
+        while reports:
+            self._call('report', state=reports.popleft())
+
+    def reserve(self, station, queue=True):
+        """True if this robot may enter ``station`` now; with ``queue`` it keeps a place in line if not."""
+        response = self._call('reserve', station=station, queue=queue)
+        if response is None:
+            self.uncoordinated += 1
+            return True
+        if response.get('granted'):
+            self.held.add(station)
+            return True
+        return False
+
+    def wait_for(self, station, sleep=_sleep, cancelled=None, poll=POLL):
+        """Block until ``station`` is reserved; False if ``cancelled()`` turned true first."""
+        waiting = self.waiting(station, cancelled, poll)
+        try:
+            while True:
+                sleep(next(waiting))
+        except StopIteration as done:
+            return done.value
+
+    def waiting(self, station, cancelled=None, poll=POLL):
+        """wait_for as a generator yielding the seconds to sleep between tries, for callers that sleep their own way.
+
+        Closing it before it returns gives up the place in the queue.
+        """
+        if self.reserve(station):
+            return True
+        self.waits += 1
+        start = self.clock()
+        logger.info('Waiting for station %s', station)
+        granted = False
+        try:
+            while not (cancelled is not None and cancelled()):
+                yield poll
+                if self.reserve(station):
+                    granted = True
+                    return True
+            return False
+        finally:
+            if not granted:
+                self.leave_queue(station)
+            self.wait_time += self.clock() - start
+
+    def leave_queue(self, station):
+        """Give up this robot's place in the queue for ``station``."""
+        self._call('release', station=station)
+
+    def release(self, station):
+        if station in self.held:
+            self.held.discard(station)
+            self._call('release', station=station)
+
+    def release_all(self):
+        for station in list(self.held):
+            self.release(station)
+
+    def log_summary(self):
+        logger.info('Fleet client %s: %d requests, %d failed, %d reservations uncoordinated, '
+                    '%d waits for a station (%.1fs)', self.robot, self.calls, self.failures,
+                    self.uncoordinated, self.waits, self.wait_time)
+
+
+def main(argv):
+    """Run a coordinator: python3 -m robot.fleet [--host H] [--port N] [--lease S]."""
+    def option(name, default):
+        return argv[argv.index(name) + 1] if name in argv else default
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    coordinator = Coordinator(lease=float(option('--lease', LEASE)))
+    server = CoordinatorServer((option('--host', 'localhost'), int(option('--port', PORT))), coordinator)
+    logger.info('Fleet coordinator listening on %s:%d', *server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
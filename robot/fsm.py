@@ -0,0 +1,243 @@
+"""Table-driven state machines for the control loops.
+
+The scripts used to pick what to do on each tick with an if/elif chain
+over the state and both sensor colors, evaluated from the top every time.
+Here a script lists its behaviour as rules instead::
+
+    when(STATE_TO_SOURCE, SOURCE_COLOR, ANY, then=STATE_PICKING_UP)
+
+A rule matches a state and a left and a right color (a value, a tuple of
+values or ANY) and names an action to run, called with the reading
+``(lrgb, rrgb, lcol, rcol)``, and the next state (SAME by default). As in
+the chains the first matching rule wins, so a rule listed earlier
+deliberately takes precedence over a later one that overlaps it. The
+rules are compiled once into a table with an entry for every state and
+every pair of colors the classifier can return, so ``step()`` is a single
+dictionary lookup whatever the number of rules. Combinations no rule
+matches do nothing and keep the state.
+
+Where the colors alone do not settle the next state (a marker may be the
+station a route ends at or one to drive past), ``then`` is a tuple of the
+states the rule may lead to and the action returns one of them, or None
+to stay.
+
+Entering and leaving a state runs the hooks given for it in ``on_enter``
+and ``on_exit``, with the reading that caused the transition; that is
+where the turns and lift moves of the stations go. ``validate()`` lists
+what is probably a mistake in a rule set: rules that can never fire,
+combinations where two rules leading to different states compete (only
+the order decides between them), states that cannot be reached from the
+initial one, and colors or states the rules name that do not exist.
+"""
+import logging
+from collections import deque, namedtuple
+
+from robot.colors import COLOR_NAMES
+
+logger = logging.getLogger(__name__)
+
+ANY = None
+SAME = 'same'
+# Compiled next state of a rule whose action chooses it.
+CHOICE = 'choice'
+
+Rule = namedtuple('Rule', 'state left right action then')
+
+
+def when(state, left, right, action=None, then=SAME):
+    """Rule: in ``state`` seeing ``left`` and ``right``, run ``action`` and go to ``then``.
+
+    With a tuple of states as ``then`` the action returns which of them to go to, or None.
+    """
+    return Rule(state, left, right, action, then)
+
+
+def next_states(then):
+    """States a rule's ``then`` can lead to."""
+    if then == SAME:
+        return ()
+    return then if isinstance(then, tuple) else (then,)
+
+
+def expand(spec, universe):
+    """Values a rule's state or color ``spec`` stands for; ANY is all of ``universe``."""
+    if spec is ANY:
+        return tuple(universe)
+    if isinstance(spec, (tuple, list, set, frozenset)):
+        return tuple(spec)
+    return (spec,)
+
+
+class StateMachine():
+    """Rules compiled into a (state, left color, right color) -> (action, next state) table."""
+
+    def __init__(self, name, states, rules, initial, on_enter=None, on_exit=None, colors=COLOR_NAMES):
+        self.name = name
+        self.states = dict(states)
+        self.rules = [Rule(*rule) for rule in rules]
+        self.initial = initial
+        self.on_enter = dict(on_enter or {})
+        self.on_exit = dict(on_exit or {})
+        self.colors = tuple(colors)
+        self.table, self.chosen, self.matched = self._compile()
+        self.transitions = 0
+        self.reset(initial)
+
+    def _compile(self):
+        """Per state, {(lcol, rcol): (action, next state)}; also which rules match each cell."""
+        table = {}
+        chosen = {}
+        matched = {}
+        candidates = [(set(expand(r.state, self.states)), set(expand(r.left, self.colors)),
+                       set(expand(r.right, self.colors))) for r in self.rules]
+        for state in self.states:
+            row = table[state] = {}
+            for lcol in self.colors:
+                for rcol in self.colors:
+                    hits = [i for i, (states, left, right) in enumerate(candidates)
+                            if state in states and lcol in left and rcol in right]
+                    matched[state, lcol, rcol] = hits
+                    if not hits:
+                        row[lcol, rcol] = (None, state)
+                        continue
+                    rule = self.rules[hits[0]]
+                    chosen[state, lcol, rcol] = hits[0]
+                    if isinstance(rule.then, tuple):
+                        row[lcol, rcol] = (rule.action, CHOICE)
+                    else:
+                        row[lcol, rcol] = (rule.action, state if rule.then == SAME else rule.then)
+        return table, chosen, matched
+
+    # === RUNNING ===
+    def reset(self, state):
+        """Make ``state`` current without running hooks, e.g. at the start of a cycle."""
+        self.state = state
+        self.row = self.table[state]
+        self.hold = (None, state)
+
+    def step(self, reading):
+        """Act on one ``(lrgb, rrgb, lcol, rcol)`` reading; returns the state after it."""
+        action, state = self.row.get((reading[2], reading[3]), self.hold)
+        if action is not None:
+            chosen = action(reading)
+            if state is CHOICE:
+                state = self.state if chosen is None else chosen
+        if state != self.state:
+            self.switch(state, reading)
+        return self.state
+
+    def switch(self, state, reading):
+        """Leave the current state for ``state``, running both hooks."""
+        previous = self.state
+        logger.info('%s: %s -> %s on %s/%s', self.name, self.states[previous], self.states[state],
+                    reading[2], reading[3])
+        hook = self.on_exit.get(previous)
+        if hook is not None:
+            hook(reading)
+        self.reset(state)
+        self.transitions += 1
+        hook = self.on_enter.get(state)
+        if hook is not None:
+            hook(reading)
+
+    # === CHECKING ===
+    def _label(self, spec, name=str):
+        return '*' if spec is ANY else '|'.join(name(value) for value in expand(spec, ()))
+
+    def _state_name(self, state):
+        return self.states.get(state, repr(state))
+
+    def describe_rule(self, index):
+        rule = self.rules[index]
+        action = '' if rule.action is None else ', ' + getattr(rule.action, '__name__', repr(rule.action))
+        then = 'same' if rule.then == SAME else self._label(rule.then, self._state_name)
+        return 'rule %d (%s, %s, %s -> %s%s)' % (index, self._label(rule.state, self._state_name),
+                                                 self._label(rule.left), self._label(rule.right), then, action)
+
+    def validate(self):
+        """Problems with the rules, as messages; empty when there are none."""
+        problems = []
+        for i, rule in enumerate(self.rules):
+            unknown = [v for v in expand(rule.state, self.states) if v not in self.states]
+            unknown.extend(v for v in next_states(rule.then) if v not in self.states)
+            if unknown:
+                problems.append('%s: unknown states %s' % (self.describe_rule(i), ', '.join(map(repr, unknown))))
+            if isinstance(rule.then, tuple) and rule.action is None:
+                problems.append('%s: no action to choose the next state' % self.describe_rule(i))
+            unknown = set(v for spec in (rule.left, rule.right) for v in expand(spec, self.colors)
+                          if v not in self.colors)
+            if unknown:
+                problems.append('%s: colors the classifier never returns: %s' % (
+                    self.describe_rule(i), ', '.join(sorted(unknown))))
+        for hooks, label in ((self.on_enter, 'entry'), (self.on_exit, 'exit')):
+            for state in hooks:
+                if state not in self.states:
+                    problems.append('%s hook for unknown state %r' % (label, state))
+        used = set(self.chosen.values())
+        matching = set(i for hits in self.matched.values() for i in hits)
+        for i in range(len(self.rules)):
+            if i not in matching:
+                problems.append('%s never fires: it matches no state and colors' % self.describe_rule(i))
+            elif i not in used:
+                problems.append('%s never fires: earlier rules match everything it does' % self.describe_rule(i))
+        # Rules leading to different states that match the same cell; only their order decides.
+        conflicts = {}
+        order = []
+        for state in self.states:
+            for lcol in self.colors:
+                for rcol in self.colors:
+                    targets = {}
+                    for i in self.matched[state, lcol, rcol]:
+                        then = self.rules[i].then
+                        if then != SAME and then != state:
+                            targets.setdefault(then, i)
+                    if len(targets) > 1:
+                        key = tuple(sorted(targets.values()))
+                        if key not in conflicts:
+                            conflicts[key] = []
+                            order.append(key)
+                        conflicts[key].append('%s %s/%s' % (self.states[state], lcol, rcol))
+        for key in order:
+            problems.append('ambiguous: %s compete on %s' % (
+                ' and '.join(self.describe_rule(i) for i in key), ', '.join(conflicts[key])))
+        reachable = self.reachable()
+        for state in self.states:
+            if state not in reachable:
+                problems.append('state %s is unreachable from %s' % (self.states[state], self.states[self.initial]))
+        return problems
+
+    def reachable(self):
+        """States the table can lead to from the initial one."""
+        seen = {self.initial}
+        queue = deque(seen)
+        while queue:
+            current = queue.popleft()
+            for (lcol, rcol), (_, state) in self.table[current].items():
+                if state is CHOICE:
+                    following = next_states(self.rules[self.chosen[current, lcol, rcol]].then)
+                else:
+                    following = (state,)
+                for state in following:
+                    if state not in seen and state in self.table:
+                        seen.add(state)
+                        queue.append(state)
+        return seen
+
+    def check(self):
+        """Log the problems validate() finds; returns them."""
+        problems = self.validate()
+        for problem in problems:
+            logger.warning('%s state machine: %s', self.name, problem)
+        return problems
+
+    def dump(self):
+        """Lines of the compiled table: state, left and right color and the rule chosen."""
+        lines = []
+        for state in self.states:
+            for lcol in self.colors:
+                for rcol in self.colors:
+                    index = self.chosen.get((state, lcol, rcol))
+                    if index is not None:
+                        lines.append('%-12s %-8s %-8s %s' % (self.states[state], lcol, rcol,
+                                                            self.describe_rule(index)))
+        return lines
@@ -0,0 +1,73 @@
+"""Straight-line speed that rises while no correction is needed.
+
+The bang-bang controllers drive straight at one fixed speed, slow enough
+for the corrections that follow. A SpeedGovernor is given both sensor
+colors every tick. While both see the background (the line runs between
+them) it counts how long that has lasted, and after ``hold_time``
+seconds it raises the speed linearly to ``max_speed`` over ``ramp_time``
+seconds, or at once if ``ramp_time`` is 0. Any other reading (a sensor
+touching BLACK or a marker color) drops the speed straight back to
+``base_speed`` and restarts the count, so the correction and the station
+moves that follow run at the usual speed.
+
+The speed goes up in whole percent, so coalesced motor commands
+(robot/drive.py) are only written when it actually changes.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SpeedGovernor():
+    """Speed for straight driving, from base_speed up to max_speed after a correction-free stretch."""
+
+    def __init__(self, base_speed, max_speed, ramp_time=1.0, hold_time=0.2, background='WHITE'):
+        self.base_speed = base_speed
+        self.max_speed = max(base_speed, max_speed)
+        # Percent per second; None for no ramp (ramp_time 0): straight to max_speed after the hold.
+        self.rate = (self.max_speed - base_speed) / ramp_time if ramp_time > 0 else None
+        self.hold_time = hold_time
+        self.background = background
+        self.speed = base_speed
+        self.since = None
+        self.ticks = 0
+        self.boosted = 0
+        self.brakes = 0
+        self.peak = base_speed
+
+    def update(self, lcol, rcol, now):
+        """Take one reading at time ``now``; returns the speed to drive straight at."""
+        self.ticks += 1
+        background = self.background
+        if lcol != background or rcol != background:
+            if self.speed != self.base_speed:
+                self.brakes += 1
+                self.speed = self.base_speed
+            self.since = None
+            return self.speed
+        if self.since is None:
+            self.since = now
+            return self.speed
+        boost = now - self.since - self.hold_time
+        if boost > 0:
+            if self.rate is None:
+                speed = self.max_speed
+            else:
+                speed = min(self.max_speed, self.base_speed + int(boost * self.rate))
+            if speed != self.base_speed:
+                self.boosted += 1
+                if speed > self.peak:
+                    self.peak = speed
+            self.speed = speed
+        return self.speed
+
+    def reset(self):
+        """Start again from base_speed, e.g. after the robot was stopped."""
+        self.speed = self.base_speed
+        self.since = None
+
+    def log_summary(self):
+        if self.max_speed == self.base_speed or not self.ticks:
+            return
+        logger.info('Speed governor: %d-%d%%, %d of %d ticks boosted, peak %d%%, %d brakes',
+                    self.base_speed, self.max_speed, self.boosted, self.ticks, self.peak, self.brakes)
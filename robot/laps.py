@@ -0,0 +1,262 @@
+"""Straight-line speeds learned lap over lap, by distance since the last marker.
+
+The robot drives the same closed track over and over, but the
+SpeedGovernor (robot/governor.py) only reacts: it speeds up once a
+straight has lasted a while and brakes at the first correction. A
+LapProfile remembers where the corrections were. Each tick it is given
+both sensor colors, the odometer (wheel degrees) and the time:
+
+- Every marker color under either sensor starts a new segment. The
+  colors in the order they are met make up the lap. It is closed when
+  the first marker's color comes round again.
+- Within a segment the distance since its marker is cut into ``bin_size``
+  bins. The script reports trouble there: a correction starting (a sensor
+  turning BLACK), or ``trouble()`` for worse, e.g. searching for a lost
+  line. At the next marker this pass's counts are folded into the
+  segment's per-bin average, ``alpha`` weighting the new lap.
+- Once the lap is closed, ``speed`` follows the profile. In a bin whose
+  next ``lookahead`` bins averaged no trouble it is ``max_speed``. It
+  drops towards ``base_speed`` as that trouble nears ``threshold``, and
+  is ``base_speed`` within ``lookahead`` bins of the next marker.
+
+The profile is checked at every marker. If the color is not the next one
+in the lap, or the segment was more than ``tolerance`` longer or shorter
+than learned, ``speed`` is None and the script falls back to its usual
+straight speed. After ``relearn`` such mismatches in a row the track is
+taken to have changed: the profile is dropped and learned again from
+that marker.
+
+``save`` and ``load`` keep the profile in a JSON file between runs. A
+loaded profile is used from the first marker that matches it. Lap times
+are measured from that marker's color to the next time round.
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MARKERS = ('GREEN', 'RED')
+# Wheel degrees per bin: about 45mm with the 56mm wheels.
+BIN = 90.0
+LOOKAHEAD = 3
+ALPHA = 0.5
+THRESHOLD = 0.5
+TOLERANCE = 0.15
+RELEARN = 2
+
+
+class Segment():
+    """What is known about the stretch from one marker to the next."""
+
+    def __init__(self, color, length=0.0, laps=0, trouble=()):
+        self.color = color
+        self.length = length
+        self.laps = laps
+        self.trouble = list(trouble)
+
+
+class LapProfile():
+    """Per-segment speeds for straight driving, learned from where corrections were needed."""
+
+    def __init__(self, base_speed, max_speed, bin_size=BIN, lookahead=LOOKAHEAD, alpha=ALPHA,
+                 threshold=THRESHOLD, tolerance=TOLERANCE, relearn=RELEARN, markers=MARKERS):
+        self.base_speed = base_speed
+        self.max_speed = max(base_speed, max_speed)
+        self.bin_size = float(bin_size)
+        self.lookahead = lookahead
+        self.alpha = alpha
+        self.threshold = threshold
+        self.tolerance = tolerance
+        self.relearn = relearn
+        self.markers = tuple(markers)
+        self.segments = []
+        self.closed = False
+        self.lap_times = []
+        self.mismatches = 0
+        self.relearned = 0
+        self.ticks = 0
+        self.fast = 0
+        self._in_row = 0
+        self._lap_start = None
+        self.reset()
+
+    def reset(self):
+        """Forget where on the lap the robot is, e.g. after it was stopped and moved."""
+        self.index = None
+        self.speed = None
+        self.start = None
+        self._marker = None
+        self._black = False
+        self._events = []
+        self._lap_start = None
+
+    def forget(self):
+        """Drop the learned profile; the next marker starts learning again."""
+        del self.segments[:]
+        self.closed = False
+        self.reset()
+
+    def update(self, lcol, rcol, odometer, now):
+        """Take one reading; returns the speed to drive straight at, or None if the profile cannot tell."""
+        self.ticks += 1
+        marker = lcol if lcol in self.markers else rcol if rcol in self.markers else None
+        if marker is not None and marker != self._marker and (
+                self.start is None or odometer - self.start >= self.bin_size):
+            self._at_marker(marker, odometer, now)
+        self._marker = marker
+        if self.start is None:
+            return None
+        position = int((odometer - self.start) / self.bin_size)
+        black = lcol == 'BLACK' or rcol == 'BLACK'
+        if black and not self._black:
+            self._add(position, 1.0)
+        self._black = black
+        self.speed = self._speed(position) if self.closed and self.index is not None else None
+        return self.speed
+
+    def trouble(self, odometer, weight=2.0):
+        """Count something worse than a correction at ``odometer``, e.g. a search for the lost line."""
+        if self.start is not None:
+            self._add(int((odometer - self.start) / self.bin_size), weight)
+
+    def _add(self, position, weight):
+        events = self._events
+        while len(events) <= position:
+            events.append(0.0)
+        events[position] += weight
+
+    def _speed(self, position):
+        trouble = self.segments[self.index].trouble
+        end = position + self.lookahead
+        if position < 0 or end >= len(trouble):
+            return self.base_speed
+        worst = max(trouble[position:end + 1])
+        if worst >= self.threshold:
+            return self.base_speed
+        speed = self.max_speed - int((self.max_speed - self.base_speed) * worst / self.threshold)
+        if speed > self.base_speed:
+            self.fast += 1
+        return speed
+
+    def _at_marker(self, color, odometer, now):
+        length = None if self.start is None else odometer - self.start
+        events = self._events
+        self._events = []
+        self.start = odometer
+        if not self.closed:
+            self._learn(color, length, events, now)
+            return
+        if self.index is None:
+            # Placed somewhere on a known lap (or lost it): take up the first segment of this color.
+            self.index = self._find(color)
+            if self.index == 0:
+                self._lap_start = now
+            return
+        segment = self.segments[self.index]
+        following = (self.index + 1) % len(self.segments)
+        if self.segments[following].color != color or abs(length - segment.length) > self.tolerance * segment.length:
+            self._mismatch(color, length, now)
+            return
+        self._in_row = 0
+        self._fold(segment, length, events)
+        self.index = following
+        if following == 0:
+            self._lap_done(now)
+
+    def _learn(self, color, length, events, now):
+        if self.index is not None:
+            self._fold(self.segments[self.index], length, events)
+        if self.segments and color == self.segments[0].color and self.index is not None:
+            self.closed = True
+            self.index = 0
+            logger.info('Lap learned: %s', ', '.join('%s %.0f' % (s.color, s.length) for s in self.segments))
+            self._lap_done(now)
+            return
+        self.segments.append(Segment(color))
+        self.index = len(self.segments) - 1
+        if self.index == 0:
+            self._lap_start = now
+
+    def _fold(self, segment, length, events):
+        bins = int(length / self.bin_size) + 1
+        events = events[:bins] + [0.0] * (bins - len(events))
+        if not segment.laps:
+            segment.trouble = events
+            segment.length = length
+        else:
+            old = segment.trouble + [0.0] * (bins - len(segment.trouble))
+            segment.trouble = [a + self.alpha * (e - a) for a, e in zip(old, events)]
+            segment.length += self.alpha * (length - segment.length)
+        segment.laps += 1
+
+    def _find(self, color):
+        for index, segment in enumerate(self.segments):
+            if segment.color == color:
+                return index
+        return None
+
+    def _mismatch(self, color, length, now):
+        self.mismatches += 1
+        self._in_row += 1
+        self._lap_start = None
+        expected = self.segments[(self.index + 1) % len(self.segments)]
+        logger.warning('Lap profile: %s after %.0f degrees where %s after %.0f was learned', color, length,
+                       expected.color, self.segments[self.index].length)
+        if self._in_row >= self.relearn:
+            logger.warning('Lap profile: the track has changed, learning it again')
+            self.relearned += 1
+            self._in_row = 0
+            start = self.start
+            self.forget()
+            self.start = start
+            self._learn(color, None, [], now)
+            return
+        self.index = self._find(color)
+        if self.index == 0:
+            self._lap_start = now
+
+    def _lap_done(self, now):
+        if self._lap_start is not None:
+            lap = now - self._lap_start
+            self.lap_times.append(lap)
+            first = self.lap_times[0]
+            logger.info('Lap %d: %.2fs (%+.1f%% on the first)', len(self.lap_times), lap,
+                        100.0 * (lap / first - 1) if first else 0.0)
+        self._lap_start = now
+
+    def save(self, path):
+        if not self.closed:
+            return
+        with open(path, 'w') as f:
+            json.dump({'bin': self.bin_size, 'segments': [
+                {'color': s.color, 'length': s.length, 'laps': s.laps, 'trouble': s.trouble}
+                for s in self.segments]}, f)
+
+    def load(self, path):
+        """Take up the profile saved in ``path``; False if there is none or it used another bin size."""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if saved.get('bin') != self.bin_size or not saved.get('segments'):
+            logger.warning('Lap profile in %s does not fit, learning from scratch', path)
+            return False
+        self.segments = [Segment(s['color'], s['length'], s['laps'], s['trouble']) for s in saved['segments']]
+        self.closed = True
+        self.reset()
+        logger.info('Lap profile from %s: %d segments', path, len(self.segments))
+        return True
+
+    def log_summary(self):
+        if not self.ticks:
+            return
+        laps = self.lap_times
+        if laps:
+            last = laps[-3:]
+            logger.info('Lap profile: %d laps, first %.2fs, best %.2fs, last %d mean %.2fs (%+.1f%%); '
+                        '%d of %d ticks faster, %d mismatches, relearned %d times', len(laps), laps[0], min(laps),
+                        len(last), sum(last) / len(last), 100.0 * (sum(last) / len(last) / laps[0] - 1),
+                        self.fast, self.ticks, self.mismatches, self.relearned)
+        else:
+            logger.info('Lap profile: no lap completed, %d mismatches', self.mismatches)
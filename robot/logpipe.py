@@ -0,0 +1,260 @@
+"""Non-blocking logging for the control loop.
+
+``logging.basicConfig(filename=...)`` formats every record and writes it to
+the SD card from the thread that logged it, so a log call in the loop
+costs a write() and occasionally a long stall. A LogPipeline replaces the
+root handlers with one that only appends the record to a bounded deque; a
+background thread wakes up every ``flush_interval`` seconds (or at once
+for errors), formats the batch and writes it with a single write().
+Installed with ``thread=False`` there is no thread and the owner calls
+flush() instead, e.g. from a task of the asyncio runtime (robot/runtime.py).
+
+Records are formatted on the writer thread, so pass values rather than
+objects the loop keeps mutating. When the deque is full new records are
+dropped and counted. Repeats of the same message without arguments
+within ``rate_interval`` seconds are suppressed and counted on the next
+one that gets through, so a message logged every tick costs one line per
+interval. Trailing digits are ignored when matching repeats, which also
+aggregates captured print() output such as ``Lost line counter: 12``.
+Messages with arguments and errors are never suppressed.
+"""
+import atexit
+import logging
+import sys
+import threading
+from collections import deque
+from time import time
+
+DEFAULT_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+STDOUT_LOGGER = 'stdout'
+# Forget rate-limit keys past this many, so varied messages cannot grow it without bound.
+MAX_KEYS = 1000
+_TRAILING = '0123456789.-: '
+
+
+class RateLimiter(logging.Filter):
+    """Let one record per message through every ``interval`` seconds."""
+
+    def __init__(self, interval=1.0):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.seen = {}
+        self.suppressed = 0
+
+    def allow(self, key, now):
+        """Return None to suppress, else how many repeats of ``key`` were suppressed before."""
+        entry = self.seen.get(key)
+        if entry is None:
+            if len(self.seen) >= MAX_KEYS:
+                self.seen.clear()
+            self.seen[key] = [now, 0]
+            return 0
+        if now - entry[0] < self.interval:
+            entry[1] += 1
+            self.suppressed += 1
+            return None
+        suppressed = entry[1]
+        entry[0] = now
+        entry[1] = 0
+        return suppressed
+
+    def filter(self, record):
+        # Messages with arguments are summaries whose arguments carry the information.
+        if record.levelno >= logging.ERROR or record.args or not isinstance(record.msg, str):
+            return True
+        suppressed = self.allow((record.name, record.levelno, record.msg.rstrip(_TRAILING)), record.created)
+        if suppressed is None:
+            return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+    def pending(self):
+        """(message, count) of repeats suppressed since their last logged occurrence."""
+        return [(key[2], entry[1]) for key, entry in self.seen.items() if entry[1]]
+
+
+class QueueingHandler(logging.Handler):
+    """Handler that hands records to a LogPipeline without formatting or locking."""
+
+    def __init__(self, pipeline):
+        logging.Handler.__init__(self)
+        self.pipeline = pipeline
+
+    def handle(self, record):
+        if self.filter(record):
+            self.pipeline.put(record)
+            return True
+        return False
+
+    def emit(self, record):
+        self.pipeline.put(record)
+
+
+class _StdoutToLog():
+    """File-like object turning print() lines into records on the 'stdout' logger.
+
+    Lines are rate limited before a record is built, so a print() in the
+    loop that gets suppressed costs little more than the string split.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.allow = pipeline.limiter.allow
+        self.partial = ''
+
+    def write(self, text):
+        if '\n' not in text:
+            self.partial += text
+            return len(text)
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        now = time()
+        for line in lines:
+            suppressed = self.allow((STDOUT_LOGGER, logging.INFO, line.rstrip(_TRAILING)), now)
+            if suppressed is None:
+                continue
+            record = logging.makeLogRecord({'name': STDOUT_LOGGER, 'msg': line,
+                                            'levelno': logging.INFO, 'levelname': 'INFO'})
+            if suppressed:
+                record.suppressed = suppressed
+            self.pipeline.put(record)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class LogPipeline():
+    """Bounded in-memory log queue drained to a file by a background thread."""
+
+    def __init__(self, filename, fmt=DEFAULT_FORMAT, capacity=1024, flush_interval=0.5, rate_interval=1.0):
+        self.filename = filename
+        self.formatter = logging.Formatter(fmt)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.records = deque()
+        self.limiter = RateLimiter(rate_interval)
+        self.handler = QueueingHandler(self)
+        self.handler.addFilter(self.limiter)
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        self.stream = None
+        self.echo = None
+        self.stdout = None
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.max_batch = 0
+
+    def install(self, level=logging.INFO, capture_stdout=False, thread=True):
+        """Route all logging (and optionally print()) through the pipeline and start the writer."""
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(level)
+        if capture_stdout:
+            # Printed lines are echoed to the real stdout by the writer thread.
+            self.stdout = sys.stdout
+            self.echo = sys.stdout
+            sys.stdout = _StdoutToLog(self)
+        self.start(thread)
+        atexit.register(self.stop)
+        return self
+
+    def start(self, thread=True):
+        self.stream = open(self.filename, 'a')
+        self.running = True
+        if thread:
+            self.thread = threading.Thread(target=self._run, name='log-writer')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def put(self, record):
+        """Queue a record; called on the logging thread, never blocks."""
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+            return
+        self.records.append(record)
+        self.enqueued += 1
+        if record.levelno >= logging.ERROR:
+            self.wakeup.set()
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self._drain()
+
+    def flush(self):
+        """Write the queued records now; for an owner that runs without the writer thread."""
+        if self.running and self.thread is None:
+            self._drain()
+
+    def _drain(self):
+        records = self.records
+        lines = []
+        echoed = []
+        while records:
+            record = records.popleft()
+            try:
+                line = self.formatter.format(record)
+            except Exception:
+                line = 'Unformattable log record: %r %r' % (record.msg, record.args)
+            suppressed = getattr(record, 'suppressed', 0)
+            if suppressed:
+                line += ' (%d similar suppressed)' % suppressed
+            lines.append(line)
+            if self.echo is not None and record.name == STDOUT_LOGGER:
+                echoed.append(record.getMessage())
+        if not lines:
+            return
+        self.stream.write('\n'.join(lines) + '\n')
+        self.stream.flush()
+        if echoed:
+            self.echo.write('\n'.join(echoed) + '\n')
+            self.echo.flush()
+        self.written += len(lines)
+        self.batches += 1
+        if len(lines) > self.max_batch:
+            self.max_batch = len(lines)
+
+    def stop(self):
+        """Flush everything, write the pipeline counters and close the file."""
+        if not self.running:
+            return
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.stdout is not None:
+            sys.stdout = self.stdout
+            self.stdout = None
+        self._drain()
+        for message, count in self.limiter.pending():
+            self._write_line('suppressed %d more times: %s' % (count, message))
+        self._write_line(self.summary())
+        self.stream.close()
+        logging.getLogger().removeHandler(self.handler)
+
+    def _write_line(self, message):
+        record = logging.makeLogRecord({'name': __name__, 'msg': message,
+                                        'levelno': logging.INFO, 'levelname': 'INFO'})
+        self.stream.write(self.formatter.format(record) + '\n')
+
+    def stats(self):
+        return {
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'suppressed': self.limiter.suppressed,
+            'batches': self.batches,
+            'max_batch': self.max_batch,
+        }
+
+    def summary(self):
+        return ('Log pipeline: %(enqueued)d queued, %(written)d written in %(batches)d batches '
+                '(max %(max_batch)d), %(dropped)d dropped, %(suppressed)d suppressed' % self.stats())
@@ -0,0 +1,172 @@
+"""Control-loop latency histograms.
+
+Durations are stored in fixed-size log-linear histograms (8 buckets per
+power of two of microseconds, so roughly 12% resolution), which keeps the
+cost per sample to a few integer operations and no allocation.
+"""
+import logging
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+SUB_BUCKETS = 8
+# Enough buckets for ~1 minute, longer samples land in the last bucket.
+BUCKETS = 24 * SUB_BUCKETS
+
+
+class Histogram():
+    """Log-linear histogram of durations in seconds."""
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        if us < 2 * SUB_BUCKETS:
+            index = us if us > 0 else 0
+        else:
+            shift = us.bit_length() - 4
+            index = SUB_BUCKETS * shift + (us >> shift)
+            if index >= BUCKETS:
+                index = BUCKETS - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def reset(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def percentile(self, fraction):
+        """Upper bound in seconds of the bucket holding the given fraction of samples."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(_bucket_upper_us(index) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        """'p50/p95/p99/max' in milliseconds."""
+        return 'p50=%.2f p95=%.2f p99=%.2f max=%.2f ms' % (
+            self.percentile(0.50) * 1e3, self.percentile(0.95) * 1e3,
+            self.percentile(0.99) * 1e3, self.max * 1e3)
+
+
+def _bucket_upper_us(index):
+    if index < 2 * SUB_BUCKETS:
+        return index + 1
+    shift = index // SUB_BUCKETS - 1
+    return ((index - SUB_BUCKETS * shift) + 1) << shift
+
+
+class LoopStats():
+    """Per-iteration timing of a control loop split into read, classify and act phases.
+
+    Call tick() at the top of every iteration, mark_read() once the sensors
+    have been read and mark_classified() once the colors are known; whatever
+    remains until the next tick() counts as actuation. Blocking motor moves
+    are recorded separately through add_blocking() or TimedMotor.
+    """
+
+    def __init__(self, name='loop'):
+        self.name = name
+        self.iteration = Histogram()
+        self.read = Histogram()
+        self.classify = Histogram()
+        self.act = Histogram()
+        self.blocking = Histogram()
+        self._tick = None
+        self._mark = None
+
+    def start(self):
+        """Forget the previous tick so time spent outside the loop is not counted."""
+        self._tick = None
+
+    def tick(self):
+        now = perf_counter()
+        if self._tick is not None:
+            self.iteration.add(now - self._tick)
+            self.act.add(now - self._mark)
+        self._tick = self._mark = now
+
+    def mark_read(self):
+        now = perf_counter()
+        if self._mark is not None:
+            self.read.add(now - self._mark)
+        self._mark = now
+
+    def mark_classified(self):
+        now = perf_counter()
+        if self._mark is not None:
+            self.classify.add(now - self._mark)
+        self._mark = now
+
+    def add_blocking(self, seconds):
+        self.blocking.add(seconds)
+
+    def rate(self):
+        """Iterations per second of time spent inside the loop."""
+        return self.iteration.count / self.iteration.total if self.iteration.total else 0.0
+
+    def log_summary(self, reset=True):
+        """Write percentiles and loop rate to the log, then start a fresh window."""
+        if not self.iteration.count:
+            return
+        logger.info('%s: %d iterations, %.1f it/s', self.name, self.iteration.count, self.rate())
+        for label in ('iteration', 'read', 'classify', 'act', 'blocking'):
+            hist = getattr(self, label)
+            if hist.count:
+                logger.info('%s %-9s n=%-6d %s', self.name, label, hist.count, hist.summary())
+        if reset:
+            for label in ('iteration', 'read', 'classify', 'act', 'blocking'):
+                getattr(self, label).reset()
+            self._tick = None
+
+
+class TimedMotor():
+    """Motor proxy that records time spent in blocking on_for_degrees calls.
+
+    It also keeps the last commanded speed and sets ``blocked`` after a
+    blocking move, for the telemetry recorder to pick up and clear.
+    """
+
+    def __init__(self, motor, stats):
+        self.motor = motor
+        self.stats = stats
+        self.speed = 0
+        self.blocked = False
+
+    def on(self, speed, *args, **kwargs):
+        self.speed = speed
+        return self.motor.on(speed, *args, **kwargs)
+
+    def stop(self, *args, **kwargs):
+        self.speed = 0
+        return self.motor.stop(*args, **kwargs)
+
+    def on_for_degrees(self, speed, degrees, **kwargs):
+        # Forward only what the caller passed; block defaults to True as in ev3dev2.
+        self.speed = speed if degrees >= 0 else -speed
+        if not kwargs.get('block', True):
+            return self.motor.on_for_degrees(speed, degrees, **kwargs)
+        start = perf_counter()
+        try:
+            return self.motor.on_for_degrees(speed, degrees, **kwargs)
+        finally:
+            self.stats.add_blocking(perf_counter() - start)
+            self.speed = 0
+            self.blocked = True
+
+    def __getattr__(self, name):
+        return getattr(self.motor, name)
@@ -0,0 +1,84 @@
+"""Continuous PID line following on light intensity.
+
+The intensity of each sensor is taken from the same RGB reading used for
+color classification (switching the sensor to COL-REFLECT mode every tick
+would be slow and would lose the marker colors). The error is the
+normalized difference between the two sensors, so it stays in [-1, 1]
+regardless of ambient light.
+"""
+
+
+class PID():
+    """PID controller with conditional-integration anti-windup and a low-pass filtered derivative."""
+
+    def __init__(self, kp, ki=0.0, kd=0.0, output_limit=None, derivative_tau=0.02):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limit = output_limit
+        self.derivative_tau = derivative_tau
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.derivative = 0.0
+        self._last_error = None
+        self._last_time = None
+
+    def update(self, error, now):
+        """Return the control output for ``error`` measured at time ``now`` (seconds)."""
+        dt = 0.0 if self._last_time is None else now - self._last_time
+        if dt > 0:
+            raw = (error - self._last_error) / dt
+            alpha = self.derivative_tau / (self.derivative_tau + dt)
+            self.derivative = alpha * self.derivative + (1 - alpha) * raw
+        self._last_error = error
+        self._last_time = now
+
+        integral = self.integral + self.ki * error * dt
+        output = self.kp * error + integral + self.kd * self.derivative
+        limit = self.output_limit
+        if limit is not None and (output > limit or output < -limit):
+            output = limit if output > 0 else -limit
+            # Only keep integrating if that pulls the output out of saturation.
+            if (error > 0) != (output > 0):
+                self.integral = integral
+        else:
+            self.integral = integral
+        return output
+
+
+def intensity(rgb):
+    """Reflected light intensity of an RGB reading, 0-255."""
+    r, g, b = rgb
+    return (r + g + b) / 3.0
+
+
+class LineFollowerPID():
+    """Turn two sensor readings into wheel speeds with a PID on their intensity difference.
+
+    A positive error means the left sensor is brighter than the right one;
+    like the bang-bang rules, a darker left sensor slows the right wheel.
+    """
+
+    def __init__(self, base_speed, kp, ki=0.0, kd=0.0, max_speed=100, derivative_tau=0.02):
+        self.base_speed = base_speed
+        self.max_speed = max_speed
+        self.pid = PID(kp, ki, kd, output_limit=max_speed, derivative_tau=derivative_tau)
+
+    def reset(self):
+        self.pid.reset()
+
+    def error(self, lrgb, rrgb):
+        left = intensity(lrgb)
+        right = intensity(rrgb)
+        total = left + right
+        return (left - right) / total if total else 0.0
+
+    def update(self, lrgb, rrgb, now):
+        """Return (left speed, right speed) in percent."""
+        turn = self.pid.update(self.error(lrgb, rrgb), now)
+        limit = self.max_speed
+        left = self.base_speed - turn
+        right = self.base_speed + turn
+        return max(-limit, min(limit, left)), max(-limit, min(limit, right))
@@ -0,0 +1,215 @@
+"""Profiling of a script's loop, selected at launch.
+
+``python3 lineFollower.py --profile cprofile`` (or ROBOT_PROFILE=cprofile
+in the environment) profiles the script without editing it. A mode may
+end in ``:SECONDS`` to set how long it profiles, e.g. ``sample:120``.
+
+- cprofile: deterministic cProfile of the thread that started it, from
+  the press that starts the robot for the window's seconds. It slows every
+  Python call, so keep the window short. Written as pstats (``.prof``):
+  ``python3 -m pstats profile.prof`` or snakeviz on a laptop;
+- sample: a daemon thread takes the starting thread's stack every
+  interval (sys._current_frames), which costs the loop little. Written
+  as collapsed stacks (``.folded``, one ``frame;frame;frame count`` line
+  per stack) for flamegraph.pl or speedscope.
+
+When the window ends or the script stops, the profile is written and the
+log gets the share of the window spent in get_colors (or get_readings),
+go, on_for_degrees, logging and sleep, each counted with what it calls.
+cProfile also sees the built-in time.sleep; the sampler sees only Python
+frames, so on the brick a bare time.sleep counts to its caller.
+
+A cProfile window can only be ended from its own thread, so the loop
+calls ``check()`` every iteration.
+"""
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+ENVIRONMENT = 'ROBOT_PROFILE'
+FLAG = '--profile'
+# What time is attributed to in the summary: functions of these names, and the logging package.
+# The loops read through get_readings, which classifies as get_colors does.
+CATEGORIES = ('get_colors', 'go', 'on_for_degrees', 'logging', 'sleep')
+FUNCTIONS = {'get_colors': 'get_colors', 'get_readings': 'get_colors', 'go': 'go',
+             'on_for_degrees': 'on_for_degrees', 'sleep': 'sleep'}
+LOGGING_DIR = os.path.dirname(logging.__file__)
+
+
+def profile_mode(default=None, argv=None, environ=None):
+    """(mode, seconds or None) asked for by ``--profile MODE[:SECONDS]``, else ROBOT_PROFILE, else ``default``."""
+    argv = sys.argv[1:] if argv is None else argv
+    environ = os.environ if environ is None else environ
+    value = environ.get(ENVIRONMENT, default)
+    for i, arg in enumerate(argv):
+        if arg == FLAG and i + 1 < len(argv):
+            value = argv[i + 1]
+        elif arg.startswith(FLAG + '='):
+            value = arg[len(FLAG) + 1:]
+    if not value:
+        return None, None
+    mode, _, seconds = value.partition(':')
+    if mode not in MODES:
+        logger.warning('Unknown profiling mode %r, not profiling (modes: %s)', mode, ', '.join(MODES))
+        return None, None
+    try:
+        return mode, float(seconds) if seconds else None
+    except ValueError:
+        logger.warning('Bad profiling window %r, not profiling', seconds)
+        return None, None
+
+
+def start_profiler(mode, path, seconds, interval):
+    """Start profiling the calling thread for ``seconds`` (0 or None: until stop); None without a mode."""
+    if mode == 'cprofile':
+        return CProfiler(path, seconds).start()
+    if mode == 'sample':
+        return SamplingProfiler(path, seconds, interval).start()
+    return None
+
+
+def _category(name, filename):
+    """The category a function of ``name`` defined in ``filename`` counts to, or None."""
+    if filename.startswith(LOGGING_DIR):
+        return 'logging'
+    # cProfile names built-ins like '<built-in method time.sleep>'.
+    if name.startswith('<'):
+        name = name.rstrip('>').rpartition('.')[2]
+    return FUNCTIONS.get(name)
+
+
+def _summary(shares):
+    return ', '.join('%s %.1f%%' % (category, 100.0 * shares.get(category, 0.0)) for category in CATEGORIES)
+
+
+class CProfiler():
+    """cProfile over a bounded window, written as pstats."""
+
+    suffix = '.prof'
+
+    def __init__(self, path, seconds):
+        self.path = path + self.suffix
+        self.seconds = seconds
+        # Imported here: pstats pulls in typing and dataclasses, which would delay every start-up.
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.running = False
+        self.started = self.elapsed = 0.0
+
+    def start(self):
+        self.started = perf_counter()
+        self.running = True
+        self.profile.enable()
+        return self
+
+    def check(self):
+        """End the window once its seconds are up; call it from the profiled thread."""
+        if self.running and self.seconds and perf_counter() - self.started >= self.seconds:
+            self.stop()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.profile.disable()
+        self.running = False
+        self.elapsed = perf_counter() - self.started
+        self.profile.dump_stats(self.path)
+        logger.info('Profile (cprofile, %.1fs): %s; written to %s', self.elapsed,
+                    _summary(self.shares()), self.path)
+
+    def shares(self):
+        """Share of the window in each category: calls into it from outside it, with what they call."""
+        import pstats
+        stats = pstats.Stats(self.profile).stats
+        totals = {}
+        for (filename, _, name), (_, _, _, _, callers) in stats.items():
+            category = _category(name, filename)
+            if category is None:
+                continue
+            for (caller_file, _, caller_name), edge in callers.items():
+                if _category(caller_name, caller_file) != category:
+                    totals[category] = totals.get(category, 0.0) + edge[3]
+        return dict((category, total / self.elapsed) for category, total in totals.items()) if self.elapsed else {}
+
+
+class SamplingProfiler():
+    """Stacks of one thread sampled from a daemon thread, written as collapsed stacks."""
+
+    suffix = '.folded'
+
+    def __init__(self, path, seconds, interval):
+        self.path = path + self.suffix
+        self.seconds = seconds
+        self.interval = interval
+        self.target = None
+        self.stacks = Counter()
+        self.samples = 0
+        self.cost = 0.0
+        self.started = self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._written = False
+
+    def start(self):
+        self.target = threading.get_ident()
+        self.started = perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def check(self):
+        """Nothing to do: the sampling thread ends the window itself."""
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._write()
+
+    def _run(self):
+        deadline = self.started + self.seconds if self.seconds else None
+        while not self._stop.wait(self.interval):
+            start = perf_counter()
+            if deadline is not None and start >= deadline:
+                break
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+            self.cost += perf_counter() - start
+        self._write()
+
+    def _write(self):
+        if self._written:
+            return
+        self._written = True
+        self.elapsed = perf_counter() - self.started
+        with open(self.path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (';'.join('%s (%s:%d)' % (name, os.path.basename(filename), line)
+                                              for name, filename, line in stack), count))
+        logger.info('Profile (sample, %.1fs, %d samples, %.0fus each): %s; written to %s', self.elapsed,
+                    self.samples, self.cost / self.samples * 1e6 if self.samples else 0.0,
+                    _summary(self.shares()), self.path)
+
+    def shares(self):
+        """Share of the samples whose stack is in each category."""
+        counts = Counter()
+        for stack, count in self.stacks.items():
+            for category in set(_category(name, filename) for name, filename, _ in stack):
+                if category is not None:
+                    counts[category] += count
+        return dict((category, count / float(self.samples)) for category, count in counts.items()) \
+            if self.samples else {}
@@ -0,0 +1,100 @@
+"""Replay a telemetry recording into the unmodified controller scripts.
+
+ReplayWorld is a robot.sim World whose color sensors return recorded
+readings instead of looking at a track: a read at time t gets the last
+record taken at or before t. Sensor reads, motor commands, sleeps and
+blocking moves advance the clock exactly as in the simulator, so a
+controller that reacts differently from the recorded one also sees the
+trace at different moments, as it would have on the mat. Every motor
+command is captured as (time, port, command, speed, degrees).
+
+The clock starts LEAD_IN seconds before the first record with the button
+held down, so the scripts get through wait_for_button_press() and enter
+their loop as the trace starts; the run ends TAIL seconds after the last
+record. That first press came before recording started. Every later
+press and release is in the recording (robot/telemetry.py), and the
+button is held down between them as it was, so stops, restarts and
+calibration holds in the middle of a trace happen again. A press without
+its release held the button until the recording ended. Nothing sleeps in
+real time, so a replay runs as fast as the CPU allows.
+"""
+import os
+from bisect import bisect_right
+from contextlib import redirect_stdout
+
+from robot import sim
+from robot.telemetry import BUTTON_EDGE, PRESSED, read_records
+
+LEAD_IN = 0.3
+PRESS = 0.1
+TAIL = 0.5
+
+# Fields of a telemetry RECORD tuple.
+TIME, LEFT_RGB, RIGHT_RGB, FLAGS = 1, slice(2, 5), slice(5, 8), 11
+
+
+class ReplayWorld(sim.World):
+    """A world driven by recorded sensor readings; the robot does not move."""
+
+    def __init__(self, records):
+        ticks = [r for r in records if not r[FLAGS] & BUTTON_EDGE]
+        self.times = [r[TIME] for r in ticks]
+        # The scripts' "left" sensor is on INPUT_3 and was recorded as left_rgb.
+        self.readings = {
+            sim.INPUT_3: [r[LEFT_RGB] for r in ticks],
+            sim.INPUT_2: [r[RIGHT_RGB] for r in ticks],
+        }
+        start = self.times[0] - LEAD_IN
+        duration = max(self.times[-1], records[-1][TIME]) + TAIL
+        sim.World.__init__(self, track=sim.Track(1, 1), duration=duration,
+                           presses=((start, start + PRESS),) + recorded_presses(records, duration))
+        self.now = start
+        self.commands = []
+
+    def _move(self, dt):
+        pass
+
+    def read_rgb(self, port):
+        index = bisect_right(self.times, self.now) - 1
+        return self.readings[port][index if index > 0 else 0]
+
+
+def recorded_presses(records, end):
+    """(down, up) times of the presses recorded in ``records``; a press not released lasts until ``end``."""
+    presses = []
+    down = None
+    for r in records:
+        if r[FLAGS] & BUTTON_EDGE:
+            if r[FLAGS] & PRESSED:
+                if down is None:
+                    down = r[TIME]
+            elif down is not None:
+                presses.append((down, r[TIME]))
+                down = None
+    if down is not None:
+        presses.append((down, end))
+    return tuple(presses)
+
+
+def replay(script, records):
+    """Run ``script`` (a path) against ``records``; return the motor commands it issued."""
+    world = sim.set_world(ReplayWorld(records))
+    module = sim.load_script(script)
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            module.main()
+    except sim.SimulationEnd:
+        pass
+    return world.commands
+
+
+def replay_file(script, path):
+    """Replay the telemetry file at ``path``; see replay()."""
+    return replay(script, read_records(path))
+
+
+def command_key(command):
+    """The part of a captured command compared between controller versions (not its time)."""
+    when, port, name, speed, degrees = command
+    return port, name, None if speed is None else round(speed, 3), degrees
+
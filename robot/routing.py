@@ -0,0 +1,260 @@
+"""Jobs routed over a graph of the track's stations and junctions.
+
+Without a layout the Transporter shuttles between the first SOURCE_COLOR
+and the first TARGET_COLOR marker it comes across, however far round the
+track that is. A TrackGraph describes the layout instead: every marker
+the robot can drive over is a node (a station's color, or JUNCTION for a
+pad where the line forks), and every stretch of line between two
+markers is a directed edge with its length in millimetres and the branch
+to take at the start of the stretch. A layout file is JSON::
+
+    {"start": "S1",
+     "nodes": {"S1": "GREEN", "J1": "JUNCTION", "D1": "RED", "D2": "RED"},
+     "edges": [["S1", "J1", 900], ["J1", "D1", 600, "left"],
+               ["J1", "D2", 1500], ["D1", "S1", 700], ["D2", "S1", 1200]]}
+
+The edges describe the track as the robot drives it, including the way it
+comes back out of a station. A branch is 'straight' unless given.
+``start`` is the marker the robot is placed just after.
+
+A Navigator works through a queue of jobs, each a (pickup, drop) pair of
+node names or colors; a color means the nearest station of that color.
+When a job starts, its route is planned with Dijkstra over the edges,
+once: the shortest way to a pickup station, then from there to a drop
+station. While driving, every marker is checked against the next node on
+the route. A junction tells the robot which branch to take. Any other
+marker is driven past unless it ends the leg. Readings of one marker
+within ``gap`` of odometer travel count once.
+
+A marker of another color than the route expects (one misread, or missed
+before it) re-localizes the robot: it is taken for the first node of that
+color further along the route, or for the nearest one on the track if the
+route has none or getting there would skip the pickup, and the job is
+replanned from there.
+"""
+import heapq
+import json
+import logging
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+JUNCTION = 'JUNCTION'
+STRAIGHT = 'straight'
+BRANCHES = ('left', STRAIGHT, 'right')
+
+Job = namedtuple('Job', 'pickup drop')
+
+
+class TrackGraph():
+    """Markers as nodes, the line between them as directed edges with lengths and branches."""
+
+    def __init__(self, nodes, edges, start=None):
+        self.nodes = dict(nodes)
+        self.edges = dict((name, []) for name in self.nodes)
+        for edge in edges:
+            a, b, length = edge[:3]
+            branch = edge[3] if len(edge) > 3 else STRAIGHT
+            if a not in self.nodes or b not in self.nodes:
+                raise ValueError('edge %s-%s joins an unknown node' % (a, b))
+            if branch not in BRANCHES:
+                raise ValueError('edge %s-%s: unknown branch %r' % (a, b, branch))
+            self.edges[a].append((b, float(length), branch))
+        self.start = start if start is not None else next(iter(sorted(self.nodes)), None)
+        if self.start not in self.nodes:
+            raise ValueError('start %r is not a node' % (self.start,))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            layout = json.load(f)
+        return cls(layout['nodes'], layout['edges'], layout.get('start'))
+
+    def colors(self):
+        return set(self.nodes.values())
+
+    def branch(self, a, b):
+        """Branch to take at ``a`` for the edge to ``b``."""
+        for node, _, branch in self.edges[a]:
+            if node == b:
+                return branch
+        raise ValueError('no edge %s-%s' % (a, b))
+
+    def candidates(self, target):
+        """Nodes ``target`` names: itself if it is a node, else every node of that color."""
+        if target in self.nodes:
+            return [target]
+        found = [name for name, color in self.nodes.items() if color == target]
+        if not found:
+            raise ValueError('no station %r on the track' % (target,))
+        return found
+
+    def distances(self, source):
+        """({node: length}, {node: previous node}) of the shortest ways out of ``source``.
+
+        The way back to ``source`` itself is the shortest loop through it, never 0:
+        the robot has to drive over a marker to stop at it again.
+        """
+        dist = {}
+        previous = {}
+        heap = [(length, b, source) for b, length, _ in self.edges[source]]
+        heapq.heapify(heap)
+        while heap:
+            length, node, before = heapq.heappop(heap)
+            if node in dist:
+                continue
+            dist[node] = length
+            previous[node] = before
+            for following, edge, _ in self.edges[node]:
+                if following not in dist:
+                    heapq.heappush(heap, (length + edge, following, node))
+        return dist, previous
+
+    def nearest(self, source, target):
+        """(length, [source, ..., node]) to the nearest node ``target`` names."""
+        dist, previous = self.distances(source)
+        reachable = [(dist[node], node) for node in self.candidates(target) if node in dist]
+        if not reachable:
+            raise ValueError('%r cannot be reached from %s' % (target, source))
+        length, node = min(reachable)
+        path = [node]
+        while True:
+            node = previous[node]
+            path.append(node)
+            if node == source:
+                break
+        path.reverse()
+        return length, path
+
+
+class Navigator():
+    """Works through (pickup, drop) jobs, telling the robot what each marker it meets means."""
+
+    def __init__(self, graph, jobs, start=None, gap=0.0, repeat=True):
+        self.graph = graph
+        self.jobs = [Job(*job) for job in jobs]
+        self.queue = deque(self.jobs)
+        self.repeat = repeat
+        self.node = start if start is not None else graph.start
+        self.gap = gap
+        self.last_seen = None
+        self.job = None
+        self.path = deque()
+        self.pickup = self.drop = None
+        self.loaded = False
+        self.done = 0
+        self.empty = 0.0
+        self.full = 0.0
+        self.markers = 0
+        self.branches = 0
+        self.unexpected = 0
+        self.relocated = 0
+
+    def start_job(self):
+        """Plan the next job from the current node; False when there is none left."""
+        if not self.queue and self.repeat:
+            self.queue.extend(self.jobs)
+        if not self.queue:
+            self.job = None
+            self.path.clear()
+            return False
+        self.job = self.queue.popleft()
+        empty, to_pickup = self.graph.nearest(self.node, self.job.pickup)
+        full, to_drop = self.graph.nearest(to_pickup[-1], self.job.drop)
+        self.pickup, self.drop = to_pickup[-1], to_drop[-1]
+        self.path = deque(to_pickup[1:] + to_drop[1:])
+        self.loaded = False
+        self.empty += empty
+        self.full += full
+        logger.info('Job %s->%s: %s, %.0fmm empty and %.0fmm loaded', self.job.pickup, self.job.drop,
+                    ' '.join([self.node] + list(self.path)), empty, full)
+        return True
+
+    def arrive(self, color, odometer):
+        """A marker of ``color`` read at ``odometer``: (what, node, branch), or None if it was counted already.
+
+        ``what`` is 'pickup' or 'drop' at the job's stations, 'branch' at a
+        junction (``branch`` is the one to take), 'pass' at any other marker
+        on the route and 'unexpected' for a color no node of the track has.
+        A color the route does not have next re-localizes (see the module).
+        """
+        seen, self.last_seen = self.last_seen, odometer
+        if seen is not None and abs(odometer - seen) < self.gap:
+            return None
+        self.markers += 1
+        if not self.path and not self.start_job():
+            return 'unexpected', None, None
+        expected = self.path[0]
+        if self.graph.nodes[expected] != color:
+            self.unexpected += 1
+            node = self.locate(color)
+            if node is None:
+                logger.warning('Marker %s where the route expects %s (%s), the track has none',
+                               color, expected, self.graph.nodes[expected])
+                return 'unexpected', None, None
+            logger.warning('Marker %s where the route expects %s (%s), taking it for %s', color,
+                           expected, self.graph.nodes[expected], node)
+            self.relocated += 1
+            path = list(self.path)
+            skipped = path[:path.index(node)] if node in path else None
+            if skipped is None or (not self.loaded and self.pickup in skipped):
+                self.replan(node)
+            else:
+                for _ in skipped:
+                    self.path.popleft()
+            expected = node
+        self.path.popleft()
+        self.node = expected
+        if expected == self.pickup and not self.loaded:
+            self.loaded = True
+            return 'pickup', expected, None
+        if expected == self.drop and self.loaded and not self.path:
+            self.done += 1
+            self.start_job()
+            return 'drop', expected, None
+        if color == JUNCTION and self.path:
+            self.branches += 1
+            return 'branch', expected, self.graph.branch(expected, self.path[0])
+        return 'pass', expected, None
+
+    def locate(self, color):
+        """The node a marker of ``color`` most likely is: the first on the route, else the nearest; None if none."""
+        for node in self.path:
+            if self.graph.nodes[node] == color:
+                return node
+        found = sorted(name for name, c in self.graph.nodes.items() if c == color)
+        if not found:
+            return None
+        dist, _ = self.graph.distances(self.node)
+        return min(found, key=lambda node: (dist.get(node, float('inf')), node))
+
+    def replan(self, node):
+        """Route the rest of the job from ``node``, which the robot is at; the path starts with it."""
+        self.node = node
+        if not self.loaded:
+            if node in self.graph.candidates(self.job.pickup):
+                to_pickup = [node]
+                empty = 0.0
+            else:
+                empty, to_pickup = self.graph.nearest(node, self.job.pickup)
+            self.pickup = to_pickup[-1]
+            full, to_drop = self.graph.nearest(self.pickup, self.job.drop)
+            self.path = deque(to_pickup + to_drop[1:])
+            self.empty += empty
+        elif node in self.graph.candidates(self.job.drop):
+            full, to_drop = 0.0, [node]
+            self.path = deque(to_drop)
+        else:
+            full, to_drop = self.graph.nearest(node, self.job.drop)
+            self.path = deque(to_drop)
+        self.drop = to_drop[-1]
+        self.full += full
+        logger.info('Replanned job %s->%s from %s: %s', self.job.pickup, self.job.drop, node,
+                    ' '.join(self.path))
+
+    def log_summary(self):
+        if not self.markers:
+            return
+        logger.info('Navigator: %d jobs done, %d markers, %d branches taken, %d unexpected '
+                    '(%d re-localized); %.0fmm planned empty, %.0fmm loaded', self.done, self.markers,
+                    self.branches, self.unexpected, self.relocated, self.empty, self.full)
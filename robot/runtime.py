@@ -0,0 +1,229 @@
+"""Optional asyncio runtime for the scripts' control loop.
+
+The scripts run one sequential loop: read the sensors, step the state
+machine, and at a station block in on_for_degrees() and sleep() until the
+move is done. Nothing else happens meanwhile: no sensor is read, and a
+button press waits until the move is over. A Runtime runs the loop's jobs
+as asyncio tasks on one thread instead:
+
+- ``every(name, period, step)`` calls ``step()`` every ``period`` seconds.
+  Each period is counted from the previous due time, so a slow step does
+  not shift the ones after it. Periods missed entirely are skipped and
+  counted. The interval between steps and how late each started are kept
+  in histograms (robot/loopstats.py);
+- ``start(coroutine)`` runs a one-off job such as a station's moves, which
+  ``await runtime.motion(motor, ...)`` for motors given a move with
+  ``block=False`` and ``await runtime.sleep(seconds)`` for pauses. Other
+  tasks keep their periods while it waits;
+- ``run()`` runs the tasks until ``stop()`` is called or one of them
+  raises, which cancels the rest and re-raises the error.
+
+Only what Python 3.5 (ev3dev stretch) has is used: async/await,
+``loop.create_task`` and ``loop.create_future``, no ``asyncio.run``.
+
+``make_loop()`` gives a plain event loop on the brick. In the simulator it
+gives one in simulated time: the loop's clock is robot.sim's, and waiting
+for the next timer advances the simulator instead of sleeping, so runs
+stay deterministic and as fast as the host allows.
+"""
+import asyncio
+import logging
+import selectors
+
+from robot.loopstats import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of a motion in flight.
+MOTION_POLL = 0.01
+# ev3dev2 reports a motor 'running' a moment after the command; wait this long for it.
+RUNNING_TIMEOUT = 0.1
+
+
+# === SIMULATED TIME ===
+class _SimulatedSelector(selectors.BaseSelector):
+    """Selector with nothing to select: waiting for a timer moves the simulated clock on instead."""
+
+    def __init__(self, time, sleep):
+        self.time = time
+        self.sleep = sleep
+        self.keys = {}
+
+    def register(self, fileobj, events, data=None):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        key = self.keys[fd] = selectors.SelectorKey(fileobj, fd, events, data)
+        return key
+
+    def unregister(self, fileobj):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        return self.keys.pop(fd)
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError('nothing scheduled, the simulated event loop would wait forever')
+        if timeout > 0:
+            before = self.time()
+            self.sleep(timeout)
+            if self.time() == before:
+                raise RuntimeError('the simulated clock has stopped')
+        return []
+
+    def get_map(self):
+        return self.keys
+
+    def close(self):
+        self.keys.clear()
+
+
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+    """Event loop running on robot.sim's clock."""
+
+    def __init__(self, time, sleep):
+        self.simulated_time = time
+        asyncio.SelectorEventLoop.__init__(self, _SimulatedSelector(time, sleep))
+
+    def time(self):
+        return self.simulated_time()
+
+
+def make_loop(on_brick=None):
+    """A new event loop: in simulated time off the brick, a plain one on it.
+
+    ``on_brick`` is the ON_BRICK of the script's robot.devices, which differs
+    from the imported one for a script loaded with robot.sim.load_script;
+    None takes robot.devices'.
+    """
+    if on_brick is None:
+        from robot import devices
+        on_brick = devices.ON_BRICK
+    if on_brick:
+        return asyncio.new_event_loop()
+    from robot import sim
+    return SimulatedEventLoop(sim.time, sim.sleep)
+
+
+# === TASKS ===
+class Periodic():
+    """A step function called every ``period`` seconds, with its timing."""
+
+    def __init__(self, name, period, step):
+        self.name = name
+        self.period = period
+        self.step = step
+        self.ticks = 0
+        self.skipped = 0
+        self.busy_max = 0.0
+        self.interval = Histogram()
+        self.late = Histogram()
+
+    async def run(self, loop):
+        due = loop.time()
+        last = None
+        while True:
+            now = loop.time()
+            self.late.add(now - due if now > due else 0.0)
+            if last is not None:
+                self.interval.add(now - last)
+            last = now
+            self.step()
+            self.ticks += 1
+            done = loop.time()
+            if done - now > self.busy_max:
+                self.busy_max = done - now
+            due += self.period
+            if done > due:
+                missed = int((done - due) / self.period) + 1
+                self.skipped += missed
+                due += missed * self.period
+            await asyncio.sleep(due - done)
+
+    def log_summary(self):
+        if not self.ticks:
+            return
+        logger.info('Task %s: %d steps every %.0fms, interval %s, late %s, %d periods skipped, '
+                    'longest step %.1fms', self.name, self.ticks, self.period * 1000, self.interval.summary(),
+                    self.late.summary(), self.skipped, self.busy_max * 1000)
+
+
+class Runtime():
+    """Periodic tasks and awaitable motions on one asyncio event loop."""
+
+    def __init__(self, loop=None, on_brick=None):
+        self.loop = loop or make_loop(on_brick)
+        self.periodic = []
+        self.tasks = []
+        self.stopped = None
+        self.running = False
+        self.motions = 0
+        self.motion_time = 0.0
+
+    def every(self, name, period, step):
+        """Call ``step()`` every ``period`` seconds while the runtime runs; returns its Periodic."""
+        periodic = Periodic(name, period, step)
+        self.periodic.append(periodic)
+        self.start(periodic.run(self.loop))
+        return periodic
+
+    def start(self, coroutine):
+        """Run ``coroutine`` as a task; a failure in it stops the runtime."""
+        task = self.loop.create_task(self._guard(coroutine))
+        self.tasks.append(task)
+        return task
+
+    async def _guard(self, coroutine):
+        try:
+            return await coroutine
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            self.stop(e)
+            raise
+
+    def sleep(self, seconds):
+        return asyncio.sleep(seconds)
+
+    async def motion(self, *motors, poll=MOTION_POLL):
+        """Wait until ``motors``, just given moves with block=False, have finished them."""
+        started = self.loop.time()
+        while not any(motor.is_running for motor in motors) and self.loop.time() - started < RUNNING_TIMEOUT:
+            await asyncio.sleep(poll)
+        while any(motor.is_running for motor in motors):
+            await asyncio.sleep(poll)
+        self.motions += 1
+        self.motion_time += self.loop.time() - started
+
+    def stop(self, error=None):
+        """End run(); with ``error`` it is raised from there."""
+        if self.stopped is None or self.stopped.done():
+            return
+        if error is None:
+            self.stopped.set_result(None)
+        else:
+            self.stopped.set_exception(error)
+
+    def run(self):
+        """Run the tasks started so far until stop(); the tasks are cancelled before it returns."""
+        asyncio.set_event_loop(self.loop)
+        self.stopped = self.loop.create_future()
+        self.running = True
+        try:
+            self.loop.run_until_complete(self.stopped)
+        finally:
+            self.running = False
+            tasks, self.tasks = self.tasks, []
+            for task in tasks:
+                task.cancel()
+            try:
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            except BaseException:
+                # The simulator may have ended under the loop; the tasks are gone either way.
+                pass
+
+    def close(self):
+        self.loop.close()
+
+    def log_summary(self):
+        for periodic in self.periodic:
+            periodic.log_summary()
+        if self.motions:
+            logger.info('Runtime: %d motions awaited, %.1fs in flight', self.motions, self.motion_time)
@@ -0,0 +1,171 @@
+"""Background sampling of the color and touch sensors.
+
+A daemon thread reads both ColorSensors and the TouchSensor at a fixed rate
+and publishes each reading into one of two preallocated slots, flipping the
+front index once the slot is complete. The control loop copies the front
+slot without taking a lock and retries only if the writer rewrote that slot
+while it was being copied.
+"""
+import logging
+import threading
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+# Slot layout: [seq, timestamp, left rgb, right rgb, touch pressed]. seq 0 marks
+# a slot that is empty or being written.
+SEQ, STAMP, LEFT, RIGHT, PRESSED = range(5)
+
+
+class SensorSampler():
+    """Read two color sensors and a touch sensor on a dedicated thread."""
+
+    def __init__(self, color_sensor_l, color_sensor_r, touch_sensor, rate_hz=100):
+        self.color_sensor_l = color_sensor_l
+        self.color_sensor_r = color_sensor_r
+        self.touch_sensor = touch_sensor
+        self.period = 1.0 / rate_hz
+        self._slots = ([0, 0.0, None, None, False], [0, 0.0, None, None, False])
+        self._front = 0
+        self._stop = threading.Event()
+        self._thread = None
+        # Writer side counters.
+        self.published = 0
+        self.overruns = 0
+        self.errors = 0
+        # Reader side counters.
+        self.consumed = 0
+        self.dropped = 0
+        self.stale_reads = 0
+        self.age_sum = 0.0
+        self.age_max = 0.0
+        self._last_seq = 0
+
+    # === WRITER ===
+    def start(self, timeout=1.0):
+        """Start the sampling thread and wait for the first snapshot."""
+        self._thread = threading.Thread(target=self._run, name='sensor-sampler', daemon=True)
+        self._thread.start()
+        deadline = monotonic() + timeout
+        while self._slots[self._front][SEQ] == 0:
+            if monotonic() > deadline:
+                raise RuntimeError('Sensor sampler produced no reading within %.1fs' % timeout)
+            self._stop.wait(0.001)
+
+    def stop(self):
+        """Stop the sampling thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        seq = 0
+        next_due = monotonic()
+        while not self._stop.is_set():
+            try:
+                left = self.color_sensor_l.rgb
+                right = self.color_sensor_r.rgb
+                pressed = self.touch_sensor.is_pressed
+            except Exception:
+                self.errors += 1
+                logger.exception('Sensor sampler read error')
+                self._stop.wait(self.period)
+                continue
+            seq += 1
+            back = self._slots[self._front ^ 1]
+            back[SEQ] = 0
+            back[STAMP] = monotonic()
+            back[LEFT] = left
+            back[RIGHT] = right
+            back[PRESSED] = pressed
+            back[SEQ] = seq
+            self._front ^= 1
+            self.published = seq
+
+            next_due += self.period
+            delay = next_due - monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                self.overruns += 1
+                next_due = monotonic()
+
+    # === READER ===
+    def peek(self):
+        """Return the freshest (seq, timestamp, left rgb, right rgb, pressed) without blocking."""
+        slots = self._slots
+        while True:
+            slot = slots[self._front]
+            seq = slot[SEQ]
+            snapshot = (seq, slot[STAMP], slot[LEFT], slot[RIGHT], slot[PRESSED])
+            if seq and slot[SEQ] == seq:
+                return snapshot
+
+    def latest(self):
+        """Like peek(), but counts the read as the control loop consuming a sample."""
+        snapshot = self.peek()
+        seq = snapshot[SEQ]
+        gap = seq - self._last_seq
+        if gap == 0:
+            self.stale_reads += 1
+        else:
+            self.consumed += 1
+            self.dropped += gap - 1
+            self._last_seq = seq
+        age = monotonic() - snapshot[STAMP]
+        self.age_sum += age
+        if age > self.age_max:
+            self.age_max = age
+        return snapshot
+
+    def age(self):
+        """Seconds since the freshest snapshot was taken."""
+        return monotonic() - self._slots[self._front][STAMP]
+
+    def stats(self):
+        """Counters showing whether the control loop waits on sensor I/O."""
+        reads = self.consumed + self.stale_reads
+        return {
+            'published': self.published,
+            'consumed': self.consumed,
+            'dropped': self.dropped,
+            'stale_reads': self.stale_reads,
+            'overruns': self.overruns,
+            'errors': self.errors,
+            'age_mean_ms': self.age_sum / reads * 1000 if reads else 0.0,
+            'age_max_ms': self.age_max * 1000,
+        }
+
+    def log_stats(self):
+        """Write the sampler counters to the log."""
+        stats = self.stats()
+        logger.info('Sensor sampler: %s', ', '.join('%s=%s' % (k, round(stats[k], 2)) for k in sorted(stats)))
+
+    def views(self):
+        """Return stand-ins for (color_sensor_l, color_sensor_r, touch_sensor) backed by this sampler."""
+        return SampledColorSensor(self, LEFT), SampledColorSensor(self, RIGHT), SampledTouchSensor(self)
+
+
+# === DEVICE VIEWS ===
+class SampledColorSensor():
+    """ColorSensor replacement whose ``rgb`` is the sampler's latest reading."""
+
+    def __init__(self, sampler, side):
+        self.sampler = sampler
+        self.side = side
+
+    @property
+    def rgb(self):
+        return self.sampler.peek()[self.side]
+
+
+class SampledTouchSensor():
+    """TouchSensor replacement whose ``is_pressed`` is the sampler's latest reading."""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    @property
+    def is_pressed(self):
+        return self.sampler.peek()[PRESSED]
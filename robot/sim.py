@@ -0,0 +1,541 @@
+"""Deterministic 2-D track simulator standing in for ev3dev2.
+
+The module mirrors the small part of the ev3dev2 API the scripts use
+(LargeMotor, MediumMotor, ColorSensor, TouchSensor, Sound, Leds and the port
+names), so the scripts import it when ev3dev2 is missing. It also provides
+``time()`` and ``sleep()``, which read and advance simulated time.
+
+A World holds a differential-drive robot on a rasterized track. Motor
+commands are integrated in simulated time; sensor reads, motor commands and
+sleeps advance the clock by what they cost on the brick, so a controller
+loop runs at a realistic rate but as fast as the host CPU allows. Sensor
+noise comes from a seeded generator, so a run is fully reproducible.
+
+When the world's duration is used up, the next clock advance raises
+SimulationEnd. It subclasses KeyboardInterrupt so the scripts' main() shuts
+down exactly as it would after Ctrl-C.
+"""
+import importlib.util
+import logging
+import math
+import os
+import random
+import sys
+
+logger = logging.getLogger(__name__)
+
+# === PORTS ===
+INPUT_1, INPUT_2, INPUT_3, INPUT_4 = 'in1', 'in2', 'in3', 'in4'
+OUTPUT_A, OUTPUT_B, OUTPUT_C, OUTPUT_D = 'outA', 'outB', 'outC', 'outD'
+
+# === ROBOT GEOMETRY (mm) ===
+WHEEL_DIAMETER = 56.0
+# The scripts turn on the spot by 2 wheel degrees per degree (turn(90) is 180
+# each way), which is a quarter turn at this track.
+AXLE_TRACK = 112.0
+SENSOR_FORWARD = 70.0
+SENSOR_SPACING = 30.0
+SENSOR_SPOT_RADIUS = 4.0
+# The scripts call the sensor on INPUT_3 "left", but it sits on the right
+# ("!!!! reersed color sensors !!!"); the simulator mirrors the real wiring.
+SENSOR_OFFSETS = {
+    INPUT_2: (SENSOR_FORWARD, SENSOR_SPACING / 2),
+    INPUT_3: (SENSOR_FORWARD, -SENSOR_SPACING / 2),
+}
+WHEEL_PORTS = {'left': OUTPUT_A, 'right': OUTPUT_B}
+MM_PER_DEGREE = math.pi * WHEEL_DIAMETER / 360.0
+# Branch from a station spur back to the line (Track.draw_station): it leaves the
+# spur at BRANCH_ANGLE to the line, bends round at BRANCH_RADIUS to meet the line
+# at BRANCH_APPROACH and stops BRANCH_GAP from the centreline, outside the sensors.
+BRANCH_ANGLE = math.radians(50.0)
+BRANCH_RADIUS = 60.0
+BRANCH_APPROACH = math.radians(12.0)
+BRANCH_GAP = 28.0
+BRANCH_WIDTH = 14.0
+
+# === DEVICE TIMING (simulated seconds per call, measured on the brick) ===
+RGB_READ_TIME = 0.003
+TOUCH_READ_TIME = 0.0015
+COMMAND_TIME = 0.0015
+LED_TIME = 0.001
+STEP = 0.005
+
+# === SURFACES ===
+WHITE, BLACK, GREEN, RED = range(4)
+SURFACE_NAMES = ('WHITE', 'BLACK', 'GREEN', 'RED')
+# Hand-measured readings noted at the bottom of Transporter.py.
+SURFACE_RGB = (
+    (130, 130, 180),
+    (30, 30, 35),
+    (20, 75, 50),
+    (120, 20, 15),
+)
+
+
+class SimulationEnd(KeyboardInterrupt):
+    """Raised when the simulated duration is used up."""
+
+
+# === TRACK ===
+class Track():
+    """Raster of surface codes, optionally with the centreline it was drawn from."""
+
+    def __init__(self, width_mm, height_mm, mm_per_px=2.0):
+        self.mm_per_px = mm_per_px
+        self.width = int(math.ceil(width_mm / mm_per_px))
+        self.height = int(math.ceil(height_mm / mm_per_px))
+        self.pixels = bytearray(self.width * self.height)
+        self.centreline = []
+        self.start = (width_mm / 2, height_mm / 2, 0.0)
+
+    def surface(self, x, y):
+        """Surface code under the point (x, y) in mm; off the mat is WHITE."""
+        px = int(x / self.mm_per_px)
+        py = int(y / self.mm_per_px)
+        if 0 <= px < self.width and 0 <= py < self.height:
+            return self.pixels[py * self.width + px]
+        return WHITE
+
+    def stamp(self, x, y, radius, surface):
+        """Paint a disc of ``radius`` mm centred on (x, y)."""
+        scale = self.mm_per_px
+        r_px = radius / scale
+        cx, cy = x / scale, y / scale
+        for py in range(max(0, int(cy - r_px)), min(self.height, int(cy + r_px) + 1)):
+            dy = py + 0.5 - cy
+            half = r_px * r_px - dy * dy
+            if half < 0:
+                continue
+            half = math.sqrt(half)
+            start = max(0, int(cx - half))
+            stop = min(self.width, int(cx + half) + 1)
+            row = py * self.width
+            self.pixels[row + start:row + stop] = bytes((surface,)) * (stop - start)
+
+    def draw_line(self, points, line_width, closed=True, centreline=True):
+        """Rasterize a polyline as a black line, by default remembering it as the centreline."""
+        if centreline:
+            self.centreline = list(points)
+        step = self.mm_per_px / 2
+        pairs = list(zip(points, points[1:] + points[:1] if closed else points[1:]))
+        for (x0, y0), (x1, y1) in pairs:
+            n = max(1, int(math.hypot(x1 - x0, y1 - y0) / step))
+            for i in range(n + 1):
+                t = i / n
+                self.stamp(x0 + (x1 - x0) * t, y0 + (y1 - y0) * t, line_width / 2, BLACK)
+
+    def draw_patch(self, x, y, heading, surface, length, width, skew=0.0):
+        """Paint a ``length`` x ``width`` mm rectangle centred on (x, y), long side along ``heading``.
+
+        With ``skew`` the near end is set back ``skew`` mm per mm to the left,
+        so the patch is met first on its right.
+        """
+        scale = self.mm_per_px
+        c, s = math.cos(heading), math.sin(heading)
+        reach = math.hypot(length + abs(skew) * width, width) / 2
+        for py in range(max(0, int((y - reach) / scale)), min(self.height, int((y + reach) / scale) + 1)):
+            for px in range(max(0, int((x - reach) / scale)), min(self.width, int((x + reach) / scale) + 1)):
+                dx = (px + 0.5) * scale - x
+                dy = (py + 0.5) * scale - y
+                along, lateral = dx * c + dy * s, -dx * s + dy * c
+                if skew * lateral - length / 2 <= along <= length / 2 and abs(lateral) <= width / 2:
+                    self.pixels[py * self.width + px] = surface
+
+    def centreline_pose(self, fraction):
+        """(x, y, heading) of the centreline at ``fraction`` of its length."""
+        index = int(fraction * len(self.centreline)) % len(self.centreline)
+        x, y = self.centreline[index]
+        nx, ny = self.centreline[(index + 1) % len(self.centreline)]
+        return x, y, math.atan2(ny - y, nx - x)
+
+    def draw_marker(self, fraction, surface, length=40.0, width=50.0, offset=0.0, lateral=0.0, skew=0.0):
+        """Paint a colored patch ``offset`` mm after ``fraction`` of the centreline, ``lateral`` mm to its left."""
+        x, y, heading = self.centreline_pose(fraction)
+        c, s = math.cos(heading), math.sin(heading)
+        self.draw_patch(x + offset * c - lateral * s, y + offset * s + lateral * c, heading, surface, length, width,
+                        skew)
+
+    def draw_station(self, fraction, surface, line_width, fork=120.0, depth=430.0, pad=60.0):
+        """A pad to the right of travel with a spur to it and a branch back, announced by a marker of the same color.
+
+        The marker lies under the right sensor only (the one the scripts call
+        "left", which is the one Transporter checks for markers), so the axle
+        is over ``fraction`` when it is first seen. Transporter then turns a
+        quarter turn right and drives in blind for a second, which takes the
+        sensors past ``fork``: it never sees the branch, and the spur from
+        ``fork`` to the pad straightens it before the pad. Turned round at the
+        pad, it follows the spur back; the spur ends at ``fork`` and the branch
+        bends away past the marker into the line at a shallow angle, which a
+        follower merges onto where it stalls on a square junction. ``depth``
+        leaves room for the 100 mm driven blind after turning round.
+        """
+        x, y, heading = self.centreline_pose(fraction)
+        c, s = math.cos(heading), math.sin(heading)
+
+        def at(along, out):
+            return x + along * c + out * s, y + along * s - out * c
+
+        self.draw_line([at(0.0, depth), at(0.0, fork)], line_width, closed=False, centreline=False)
+        self.draw_patch(*at(0.0, depth), heading=heading, surface=surface, length=pad, width=pad)
+        angle = BRANCH_ANGLE
+        along, out = 20.0 * math.cos(angle), fork - 20.0 * math.sin(angle)
+        points = [at(0.0, fork), at(along, out)]
+        centre_along, centre_out = along + BRANCH_RADIUS * math.sin(angle), out + BRANCH_RADIUS * math.cos(angle)
+        while angle > BRANCH_APPROACH:
+            angle = max(BRANCH_APPROACH, angle - 0.05)
+            along, out = centre_along - BRANCH_RADIUS * math.sin(angle), centre_out - BRANCH_RADIUS * math.cos(angle)
+            points.append(at(along, out))
+        points.append(at(along + (out - BRANCH_GAP) / math.tan(angle), BRANCH_GAP))
+        self.draw_line(points, BRANCH_WIDTH, closed=False, centreline=False)
+        # The near end slants away from the line: a sensor drifted outwards meets it a little earlier.
+        self.draw_marker(fraction, surface, length=45.0, width=24.0, offset=SENSOR_FORWARD + 17.5,
+                         lateral=-(SENSOR_SPACING / 2 + 5.0), skew=1.0)
+
+    @classmethod
+    def from_ppm(cls, path, mm_per_px=2.0):
+        """Load a binary PPM (P6) image, snapping each pixel to the nearest surface color."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        fields = []
+        pos = 0
+        while len(fields) < 4:
+            while data[pos:pos + 1].isspace():
+                pos += 1
+            if data[pos:pos + 1] == b'#':
+                pos = data.index(b'\n', pos)
+                continue
+            end = pos
+            while not data[end:end + 1].isspace():
+                end += 1
+            fields.append(data[pos:end])
+            pos = end
+        if fields[0] != b'P6' or int(fields[3]) != 255:
+            raise ValueError('%s is not an 8-bit binary PPM image' % path)
+        width, height = int(fields[1]), int(fields[2])
+        pixels = data[pos + 1:pos + 1 + width * height * 3]
+        track = cls(width * mm_per_px, height * mm_per_px, mm_per_px)
+        cache = {}
+        for i in range(width * height):
+            rgb = pixels[3 * i:3 * i + 3]
+            surface = cache.get(rgb)
+            if surface is None:
+                surface = min(range(len(SURFACE_RGB)), key=lambda s: sum(
+                    (a - b) ** 2 for a, b in zip(rgb, SURFACE_RGB[s])))
+                cache[rgb] = surface
+            # PPM rows run top to bottom; the track's y axis points up.
+            track.pixels[(height - 1 - i // width) * width + i % width] = surface
+        return track
+
+
+def oval_track(straight=800.0, radius=300.0, line_width=20.0, markers=(),
+               stations=((0.08, GREEN), (0.58, RED)), mm_per_px=2.0):
+    """Stadium-shaped closed line driven counter-clockwise.
+
+    ``markers`` are (fraction, surface) patches across the line,
+    ``stations`` are (fraction, surface) stations with a spur on the outside.
+    """
+    # Room around the line for station spurs and pads, which lie outside it.
+    margin = 500.0 if stations else 150.0
+    track = Track(straight + 2 * radius + 2 * margin, 2 * radius + 2 * margin, mm_per_px)
+    left, right = margin + radius, margin + radius + straight
+    bottom, top = margin, margin + 2 * radius
+    cy = margin + radius
+    step = 5.0
+    points = []
+    for i in range(int(straight / step)):
+        points.append((left + i * step, bottom))
+    for i in range(int(math.pi * radius / step)):
+        a = -math.pi / 2 + i * step / radius
+        points.append((right + radius * math.cos(a), cy + radius * math.sin(a)))
+    for i in range(int(straight / step)):
+        points.append((right - i * step, top))
+    for i in range(int(math.pi * radius / step)):
+        a = math.pi / 2 + i * step / radius
+        points.append((left + radius * math.cos(a), cy + radius * math.sin(a)))
+    track.draw_line(points, line_width)
+    for fraction, surface in markers:
+        track.draw_marker(fraction, surface)
+    for fraction, surface in stations:
+        track.draw_station(fraction, surface, line_width)
+    track.start = (left + 100.0, bottom, 0.0)
+    return track
+
+
+# === WORLD ===
+class World():
+    """Simulated clock, robot pose and devices on one track."""
+
+    def __init__(self, track=None, seed=0, duration=60.0, presses=((0.0, 0.2),), noise=3.0, brightness=1.0):
+        self.track = track if track is not None else oval_track()
+        self.random = random.Random(seed)
+        self.duration = duration
+        self.presses = tuple(presses)
+        self.noise = noise
+        self.brightness = brightness
+        self.now = 0.0
+        self.ended = False
+        self.x, self.y, self.heading = self.track.start
+        self.odometer = 0.0
+        self.motors = {}
+        self.leds = {}
+        self.listeners = []
+        # Set to a list to capture (time, port, command, speed, degrees) of every motor command.
+        self.commands = None
+        # Motor commands and LED color changes sent to the "hardware".
+        self.writes = 0
+
+    # --- clock ---
+    def advance(self, seconds):
+        """Move simulated time forward, integrating the drive train."""
+        if self.ended:
+            return
+        end = self.now + seconds
+        while self.now < end:
+            dt = min(STEP, end - self.now)
+            for motor in self.motors.values():
+                motor._integrate(dt)
+            self._move(dt)
+            self.now += dt
+            for listener in self.listeners:
+                listener(self)
+        if self.now >= self.duration:
+            self.ended = True
+            logger.info('Simulation ended at t=%.2fs', self.now)
+            raise SimulationEnd()
+
+    def _move(self, dt):
+        left = self.motors.get(WHEEL_PORTS['left'])
+        right = self.motors.get(WHEEL_PORTS['right'])
+        vl = left.velocity * MM_PER_DEGREE if left else 0.0
+        vr = right.velocity * MM_PER_DEGREE if right else 0.0
+        v = (vl + vr) / 2
+        omega = (vr - vl) / AXLE_TRACK
+        heading = self.heading + omega * dt / 2
+        self.x += v * math.cos(heading) * dt
+        self.y += v * math.sin(heading) * dt
+        self.heading += omega * dt
+        self.odometer += abs(v) * dt
+
+    # --- sensing ---
+    def sensor_position(self, port):
+        forward, side = SENSOR_OFFSETS[port]
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        return self.x + forward * c - side * s, self.y + forward * s + side * c
+
+    def read_rgb(self, port):
+        """Average surface color under the sensor spot, with noise."""
+        x, y = self.sensor_position(port)
+        r_sum = g_sum = b_sum = 0
+        samples = 0
+        d = SENSOR_SPOT_RADIUS / 2
+        for dx in (-d, 0.0, d):
+            for dy in (-d, 0.0, d):
+                r, g, b = SURFACE_RGB[self.track.surface(x + dx, y + dy)]
+                r_sum += r
+                g_sum += g
+                b_sum += b
+                samples += 1
+        gauss = self.random.gauss
+        k = self.brightness / samples
+        return tuple(max(0, min(255, int(c * k + gauss(0, self.noise)))) for c in (r_sum, g_sum, b_sum))
+
+    def is_pressed(self):
+        for start, stop in self.presses:
+            if start <= self.now < stop:
+                return True
+        return False
+
+
+_world = None
+
+
+def get_world():
+    """The world devices attach to, created on first use from ROBOT_SIM_* variables."""
+    global _world
+    if _world is None:
+        _world = World(seed=int(os.environ.get('ROBOT_SIM_SEED', '0')),
+                       duration=float(os.environ.get('ROBOT_SIM_DURATION', '60')))
+    return _world
+
+
+def set_world(world):
+    """Make ``world`` the one new devices and time()/sleep() use."""
+    global _world
+    _world = world
+    return world
+
+
+# Modules made unimportable so a script takes its simulator fallback.
+EV3DEV2_MODULES = ('ev3dev2', 'ev3dev2.motor', 'ev3dev2.sensor', 'ev3dev2.sensor.lego',
+                   'ev3dev2.sound', 'ev3dev2.led')
+
+
+def load_script(path, name=None):
+    """Import a fresh copy of a controller script with ev3dev2 unavailable, even on the brick.
+
+    The copy gets its own robot.devices, imported while ev3dev2 is blocked,
+    so its ON_BRICK is False and its devices, time() and sleep() are the
+    simulator's. The script passes that ON_BRICK on, e.g. to its Runtime.
+    sys.modules and the robot package keep the robot.devices they had. The
+    script's devices attach to the current world once its main() runs.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    saved = {module: sys.modules.get(module) for module in EV3DEV2_MODULES + ('robot.devices',)}
+    package = sys.modules['robot']
+    saved_devices = package.__dict__.get('devices')
+    for module in EV3DEV2_MODULES:
+        sys.modules[module] = None
+    # A fresh robot.devices, so it picks the simulator and times this start-up.
+    sys.modules.pop('robot.devices', None)
+    try:
+        devices = importlib.import_module('robot.devices')
+        if devices.ON_BRICK:
+            raise RuntimeError('robot.devices found ev3dev2 although it is blocked')
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        for module, previous in saved.items():
+            if previous is None:
+                sys.modules.pop(module, None)
+            else:
+                sys.modules[module] = previous
+        if saved_devices is None:
+            package.__dict__.pop('devices', None)
+        else:
+            package.devices = saved_devices
+
+
+def time():
+    """Simulated seconds since the world started."""
+    return get_world().now
+
+
+def sleep(seconds):
+    get_world().advance(seconds)
+
+
+# === DEVICES ===
+class _Motor():
+    MAX_SPEED = 1050
+
+    def __init__(self, address=None):
+        self.world = get_world()
+        self.address = address
+        self.max_speed = self.MAX_SPEED
+        self.count_per_rot = 360
+        self.position = 0.0
+        self.velocity = 0.0
+        self._target = None
+        self.world.motors[address] = self
+
+    def _native_speed(self, speed):
+        if not -100 <= speed <= 100:
+            raise ValueError('%s is an invalid speed percentage, must be between -100 and 100' % speed)
+        return speed * self.max_speed / 100.0
+
+    def _integrate(self, dt):
+        if self._target is None:
+            self.position += self.velocity * dt
+            return
+        remaining = self._target - self.position
+        step = self.velocity * dt
+        if abs(step) >= abs(remaining):
+            self.position = self._target
+            self.velocity = 0.0
+            self._target = None
+        else:
+            self.position += step
+
+    @property
+    def is_running(self):
+        return self.velocity != 0.0
+
+    def _log(self, command, speed=None, degrees=None):
+        self.world.writes += 1
+        commands = self.world.commands
+        if commands is not None:
+            commands.append((self.world.now, self.address, command, speed, degrees))
+
+    def on(self, speed, brake=True, block=False):
+        self._log('on', speed)
+        self.velocity = self._native_speed(speed)
+        self._target = None
+        self.world.advance(COMMAND_TIME)
+        if block:
+            self.wait_until_not_moving()
+
+    def on_for_degrees(self, speed, degrees, brake=True, block=True):
+        self._log('on_for_degrees', speed, degrees)
+        speed = self._native_speed(speed)
+        if speed < 0:
+            degrees = -degrees
+        self._target = self.position + degrees
+        self.velocity = math.copysign(abs(speed), degrees) if degrees else 0.0
+        if not degrees:
+            self._target = None
+        self.world.advance(COMMAND_TIME)
+        if block:
+            self.wait_until_not_moving()
+
+    def stop(self):
+        self._log('stop')
+        self.velocity = 0.0
+        self._target = None
+        self.world.advance(COMMAND_TIME)
+
+    def wait_until_not_moving(self, timeout=None):
+        while self._target is not None:
+            self.world.advance(STEP)
+            if self.world.ended:
+                break
+        return True
+
+
+class LargeMotor(_Motor):
+    MAX_SPEED = 1050
+
+
+class MediumMotor(_Motor):
+    MAX_SPEED = 1560
+
+
+class ColorSensor():
+    def __init__(self, address=None):
+        self.world = get_world()
+        self.address = address
+
+    @property
+    def rgb(self):
+        self.world.advance(RGB_READ_TIME)
+        return self.world.read_rgb(self.address)
+
+
+class TouchSensor():
+    def __init__(self, address=None):
+        self.world = get_world()
+
+    @property
+    def is_pressed(self):
+        self.world.advance(TOUCH_READ_TIME)
+        return self.world.is_pressed()
+
+
+class Sound():
+    def __init__(self, *args, **kwargs):
+        self.world = get_world()
+
+    def play_tone(self, frequency, duration, *args, **kwargs):
+        self.world.advance(duration)
+
+
+class Leds():
+    def __init__(self, *args, **kwargs):
+        self.world = get_world()
+
+    def set_color(self, group, color, *args, **kwargs):
+        self.world.leds[group] = color
+        self.world.writes += 1
+        self.world.advance(LED_TIME)
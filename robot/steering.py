@@ -0,0 +1,95 @@
+"""Course corrections that do not blind the control loop.
+
+The original controllers correct with ``on_for_degrees(..., block=True)`` and
+cannot look at the sensors until the move finishes. In non-blocking mode a
+correction is started as a relative position target and the loop keeps
+sampling: repeating the same correction while it is in flight is a no-op,
+switching to another correction amends it, and seeing the line again
+cancels it by issuing the next speed command.
+"""
+import logging
+from time import monotonic
+
+from robot.loopstats import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Degrees per second at 100% for an EV3 large motor, used when the motor
+# does not report max_speed.
+DEFAULT_MAX_SPEED = 1050
+# Allowance for acceleration on top of the ideal move duration.
+MOVE_MARGIN = 0.05
+
+
+class Steering():
+    """Issue wheel corrections blocking (original behaviour) or non-blocking."""
+
+    def __init__(self, left_wheel, right_wheel, blocking=True, clock=monotonic):
+        self.left_wheel = left_wheel
+        self.right_wheel = right_wheel
+        self.blocking = blocking
+        self.clock = clock
+        self.active = None
+        self.started = 0.0
+        self.deadline = 0.0
+        self.reaction = Histogram()
+        self.issued = 0
+        self.amended = 0
+        self.cut_short = 0
+
+    def correct(self, key, speed, left_degrees=0, right_degrees=0):
+        """Turn one or both wheels by a relative angle.
+
+        ``key`` names the correction; calling again with the same key while
+        the move is still in flight does nothing.
+        """
+        now = self.clock()
+        if key == self.active and now < self.deadline:
+            return
+        if self.active is not None and key != self.active and now < self.deadline:
+            self.amended += 1
+            # A wheel driven by the old correction but not the new one stops
+            # where it is, as it would have after a completed blocking move.
+            if not left_degrees:
+                self.left_wheel.stop()
+            if not right_degrees:
+                self.right_wheel.stop()
+        self.active = key
+        self.started = now
+        self.issued += 1
+        max_speed = getattr(self.right_wheel, 'max_speed', DEFAULT_MAX_SPEED)
+        self.deadline = now + max(abs(left_degrees), abs(right_degrees)) / (abs(speed) / 100.0 * max_speed) + MOVE_MARGIN
+        if left_degrees and right_degrees:
+            self.right_wheel.on_for_degrees(speed, right_degrees, block=False)
+            self.left_wheel.on_for_degrees(speed, left_degrees, block=self.blocking)
+        elif right_degrees:
+            self.right_wheel.on_for_degrees(speed, right_degrees, block=self.blocking)
+        else:
+            self.left_wheel.on_for_degrees(speed, left_degrees, block=self.blocking)
+        if self.blocking:
+            # The move has finished; nothing is left in flight.
+            self.deadline = self.clock()
+
+    def clear(self):
+        """The sensors see the line again: record how long the reaction took."""
+        if self.active is None:
+            return
+        now = self.clock()
+        self.reaction.add(now - self.started)
+        if now < self.deadline:
+            self.cut_short += 1
+        self.active = None
+
+    def cancel(self):
+        """Forget the current correction without recording a reaction."""
+        self.active = None
+
+    def log_summary(self):
+        """Write reaction-time percentiles and correction counters to the log."""
+        if not self.issued:
+            return
+        logger.info('Steering (%s): %d corrections, %d amended, %d cut short; reaction %s',
+                    'blocking' if self.blocking else 'non-blocking',
+                    self.issued, self.amended, self.cut_short, self.reaction.summary())
+        self.reaction.reset()
+        self.issued = self.amended = self.cut_short = 0
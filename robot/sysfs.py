@@ -0,0 +1,179 @@
+"""Raw sysfs fast path for the color sensors and tacho motors.
+
+ev3dev2 opens, seeks and parses attribute files through its generic property
+plumbing on every access. These drop-in wrappers open the few attributes
+used in the control loop once and read or write them with ``os.pread`` and
+``os.pwrite``. Everything else is delegated to the wrapped ev3dev2 device.
+
+Both classes take the device's sysfs directory, so they also work against
+a fake directory tree (see bench/sysfs.py).
+"""
+import os
+from time import monotonic, sleep
+
+# ev3dev2 waits this long for a motor to report 'running' after a command.
+WAIT_RUNNING_TIMEOUT = 0.1
+STATE_POLL_INTERVAL = 0.005
+
+_COMMANDS = {
+    'run-forever': b'run-forever',
+    'run-to-rel-pos': b'run-to-rel-pos',
+    'stop': b'stop',
+}
+_STOP_ACTIONS = {
+    True: b'hold',
+    False: b'coast',
+}
+
+
+def _open(path, name, flags):
+    return os.open(os.path.join(path, name), flags)
+
+
+class _FastDevice():
+    """Common plumbing: open file descriptors and fall back to the ev3dev2 device."""
+
+    def __init__(self, path, device=None):
+        self.path = path
+        self.device = device
+        self._fds = []
+
+    def _open(self, name, flags=os.O_RDONLY):
+        fd = _open(self.path, name, flags)
+        self._fds.append(fd)
+        return fd
+
+    def close(self):
+        """Close all attribute file descriptors."""
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper itself.
+        device = self.__dict__.get('device')
+        if device is None:
+            raise AttributeError(name)
+        return getattr(device, name)
+
+
+# === COLOR SENSOR ===
+class FastColorSensor(_FastDevice):
+    """ColorSensor replacement reading value0..2 in RGB-RAW mode."""
+
+    MODE_RGB_RAW = b'RGB-RAW'
+
+    def __init__(self, path, red_max=300, green_max=300, blue_max=300, device=None):
+        super().__init__(path, device)
+        mode_fd = _open(path, 'mode', os.O_RDWR)
+        try:
+            if os.pread(mode_fd, 32, 0).strip() != self.MODE_RGB_RAW:
+                os.pwrite(mode_fd, self.MODE_RGB_RAW, 0)
+        finally:
+            os.close(mode_fd)
+        self._value_fds = tuple(self._open('value%d' % i) for i in range(3))
+        self._scale = (255.0 / red_max, 255.0 / green_max, 255.0 / blue_max)
+
+    @classmethod
+    def wrap(cls, sensor):
+        """Wrap an ev3dev2 ColorSensor, keeping its white calibration."""
+        return cls(sensor._path, sensor.red_max, sensor.green_max, sensor.blue_max, sensor)
+
+    @property
+    def raw(self):
+        """Unscaled (red, green, blue) reflected light components."""
+        r_fd, g_fd, b_fd = self._value_fds
+        return int(os.pread(r_fd, 16, 0)), int(os.pread(g_fd, 16, 0)), int(os.pread(b_fd, 16, 0))
+
+    @property
+    def rgb(self):
+        """(red, green, blue) scaled to 0-255 like ev3dev2's ColorSensor.rgb."""
+        r_fd, g_fd, b_fd = self._value_fds
+        r_scale, g_scale, b_scale = self._scale
+        return (min(int(int(os.pread(r_fd, 16, 0)) * r_scale), 255),
+                min(int(int(os.pread(g_fd, 16, 0)) * g_scale), 255),
+                min(int(int(os.pread(b_fd, 16, 0)) * b_scale), 255))
+
+
+# === TACHO MOTOR ===
+class FastTachoMotor(_FastDevice):
+    """LargeMotor/MediumMotor replacement for on, on_for_degrees and stop."""
+
+    def __init__(self, path, max_speed, count_per_rot, device=None):
+        super().__init__(path, device)
+        self.max_speed = max_speed
+        self.count_per_rot = count_per_rot
+        self._command_fd = self._open('command', os.O_WRONLY)
+        self._speed_sp_fd = self._open('speed_sp', os.O_WRONLY)
+        self._position_sp_fd = self._open('position_sp', os.O_WRONLY)
+        self._stop_action_fd = self._open('stop_action', os.O_WRONLY)
+        self._state_fd = self._open('state')
+        self._stop_action = None
+
+    @classmethod
+    def wrap(cls, motor):
+        """Wrap an ev3dev2 tacho motor."""
+        return cls(motor._path, motor.max_speed, motor.count_per_rot, motor)
+
+    def _native_speed(self, speed):
+        if not -100 <= speed <= 100:
+            raise ValueError('%s is an invalid speed percentage, must be between -100 and 100' % speed)
+        return speed * self.max_speed / 100
+
+    def _set_brake(self, brake):
+        # Unlike speed_sp, stop_action only changes when brake does.
+        if brake != self._stop_action:
+            os.pwrite(self._stop_action_fd, _STOP_ACTIONS[bool(brake)], 0)
+            self._stop_action = brake
+
+    def on(self, speed, brake=True, block=False):
+        """Run at ``speed`` percent until told otherwise."""
+        self.set_speed(speed, brake)
+        self.run_forever()
+        if block:
+            self.wait_until_not_moving()
+
+    def set_speed(self, speed, brake=True):
+        """First half of on(): write the speed and stop action without starting the motor."""
+        os.pwrite(self._speed_sp_fd, b'%d' % int(round(self._native_speed(speed))), 0)
+        self._set_brake(brake)
+
+    def run_forever(self):
+        """Second half of on(): a single write of the run-forever command."""
+        os.pwrite(self._command_fd, _COMMANDS['run-forever'], 0)
+
+    def on_for_degrees(self, speed, degrees, brake=True, block=True):
+        """Rotate ``degrees`` at ``speed`` percent; a negative speed reverses direction."""
+        speed = self._native_speed(speed)
+        if speed < 0:
+            degrees = -degrees
+        os.pwrite(self._position_sp_fd, b'%d' % int(round(degrees * self.count_per_rot / 360)), 0)
+        os.pwrite(self._speed_sp_fd, b'%d' % int(round(abs(speed))), 0)
+        self._set_brake(brake)
+        os.pwrite(self._command_fd, _COMMANDS['run-to-rel-pos'], 0)
+        if block:
+            self.wait_until_not_moving()
+
+    def stop(self):
+        """Stop using the last stop action."""
+        os.pwrite(self._command_fd, _COMMANDS['stop'], 0)
+
+    @property
+    def state(self):
+        return os.pread(self._state_fd, 64, 0).decode().split()
+
+    def wait_until_not_moving(self, timeout=None):
+        """Block until the motor leaves the 'running' state or stalls."""
+        deadline = monotonic() + WAIT_RUNNING_TIMEOUT
+        while b'running' not in os.pread(self._state_fd, 64, 0):
+            if monotonic() > deadline:
+                break
+            sleep(STATE_POLL_INTERVAL)
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            state = os.pread(self._state_fd, 64, 0)
+            if b'running' not in state or b'stalled' in state:
+                return True
+            if deadline is not None and monotonic() > deadline:
+                return False
+            sleep(STATE_POLL_INTERVAL)
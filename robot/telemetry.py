@@ -0,0 +1,158 @@
+"""Per-tick binary telemetry in a memory-mapped ring file.
+
+Every iteration of run_transport_cycle packs one fixed-size record
+straight into a preallocated, memory-mapped file: no text formatting, no
+growing buffers and no write() system call per tick. When the ring is
+full the oldest records are overwritten.
+
+File layout: a 32-byte header (magic, version, record size, capacity)
+followed by ``capacity`` records of RECORD. A record is written with its
+sequence number set to 0 and the sequence number is stored last, so a
+slot that was being written when the program died reads as empty and
+every record the reader accepts is complete. The data lives in the page
+cache as soon as it is written, so it survives the program crashing;
+close() (or flush()) also pushes it to the SD card.
+
+Given the script's ButtonWatcher, the recorder also keeps the touch
+sensor: PRESSED is set in a tick's flags while the button is down. Each
+press and release, including those while the script waits for the
+button and records no ticks, gets a record of its own with BUTTON_EDGE
+set, PRESSED for a press, its own time and nothing else. Version 1 files
+have neither.
+
+load() reads a recording into NumPy arrays, oldest record first::
+
+    from robot.telemetry import load
+    t = load('telemetry.bin')
+    t['time'], t['left_rgb'][:, 0], t['left_color'], t['left_speed'] ...
+"""
+import mmap
+import struct
+
+from robot.colors import COLOR_CODES
+
+MAGIC = b'EV3TLM01'
+VERSION = 2
+# Versions read: 1 lacks the button bits.
+VERSIONS = (1, 2)
+HEADER = struct.Struct('<8sIII12x')
+# seq, time, left r/g/b, right r/g/b, left color, right color, state, flags,
+# commanded left/right speed.
+RECORD = struct.Struct('<Id6H4B2f')
+SEQ = struct.Struct('<I')
+
+# Bits of the flags field: a blocking move ran on that motor since the previous record.
+BLOCKED_LEFT = 1
+BLOCKED_RIGHT = 2
+BLOCKED_LIFT = 4
+# The touch sensor is pressed; the record is a button press or release, not a tick.
+PRESSED = 8
+BUTTON_EDGE = 16
+
+DEFAULT_CAPACITY = 65536
+
+
+class TelemetryRecorder():
+    """Append one RECORD per tick to a ring file of ``capacity`` records."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, button=None):
+        self.path = path
+        self.capacity = capacity
+        self.button = button
+        if button is not None:
+            button.record_edges()
+        size = HEADER.size + capacity * RECORD.size
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, capacity)
+        self.seq = 0
+        self.offset = HEADER.size
+        self.end = size
+
+    def record(self, now, lrgb, rrgb, lcol, rcol, state, left_wheel, right_wheel, lift=None):
+        """Store one tick. ``left_wheel``, ``right_wheel`` and ``lift`` are TimedMotor proxies."""
+        flags = 0
+        if left_wheel.blocked:
+            flags |= BLOCKED_LEFT
+            left_wheel.blocked = False
+        if right_wheel.blocked:
+            flags |= BLOCKED_RIGHT
+            right_wheel.blocked = False
+        if lift is not None and lift.blocked:
+            flags |= BLOCKED_LIFT
+            lift.blocked = False
+        button = self.button
+        if button is not None:
+            if button.edges:
+                self._record_edges()
+            if button.pressed:
+                flags |= PRESSED
+        offset = self.offset
+        RECORD.pack_into(self.map, offset, 0, now, lrgb[0], lrgb[1], lrgb[2], rrgb[0], rrgb[1], rrgb[2],
+                         COLOR_CODES[lcol], COLOR_CODES[rcol], state, flags,
+                         left_wheel.speed, right_wheel.speed)
+        self.seq += 1
+        SEQ.pack_into(self.map, offset, self.seq)
+        offset += RECORD.size
+        self.offset = offset if offset < self.end else HEADER.size
+
+    def _record_edges(self):
+        for when, pressed in self.button.take_edges():
+            self._put(when, 0, 0, 0, 0, 0, 0, 0, 0, 0, BUTTON_EDGE | (PRESSED if pressed else 0), 0.0, 0.0)
+
+    def _put(self, *fields):
+        offset = self.offset
+        RECORD.pack_into(self.map, offset, 0, *fields)
+        self.seq += 1
+        SEQ.pack_into(self.map, offset, self.seq)
+        offset += RECORD.size
+        self.offset = offset if offset < self.end else HEADER.size
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        if self.map is None:
+            return
+        if self.button is not None and self.button.edges:
+            self._record_edges()
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+        self.map = None
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, record_size, capacity = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in VERSIONS or record_size != RECORD.size:
+        raise ValueError('%s is not a version %s telemetry file' % (path, ' or '.join(map(str, VERSIONS))))
+    return data, capacity
+
+
+def read_records(path):
+    """Read a recording as a list of RECORD tuples ordered by sequence number, without NumPy."""
+    data, capacity = _read(path)
+    end = HEADER.size + capacity * RECORD.size
+    records = [r for r in RECORD.iter_unpack(data[HEADER.size:end]) if r[0]]
+    records.sort()
+    return records
+
+
+def load(path):
+    """Read a recording into a dict of NumPy arrays ordered by sequence number."""
+    import numpy as np
+
+    data, capacity = _read(path)
+    dtype = np.dtype([
+        ('seq', '<u4'), ('time', '<f8'), ('left_rgb', '<u2', 3), ('right_rgb', '<u2', 3),
+        ('left_color', 'u1'), ('right_color', 'u1'), ('state', 'u1'), ('flags', 'u1'),
+        ('left_speed', '<f4'), ('right_speed', '<f4'),
+    ])
+    records = np.frombuffer(data, dtype, count=capacity, offset=HEADER.size)
+    records = records[records['seq'] != 0]
+    records = records[np.argsort(records['seq'], kind='stable')]
+    return {name: records[name] for name in dtype.names}
+
@@ -0,0 +1,47 @@
+"""Configuration profiles found by the auto-tuner (bench/tune.py).
+
+A script's speeds, correction angles and thresholds are globals in its
+CONFIGURATION section, set by hand on the mat. The tuner writes the best
+ones it found for a script to a JSON profile::
+
+    {"script": "lineFollower",
+     "settings": {"BASE_SPEED": 14, "CORRECTION_DEGREES": 19, "CROSSING_TICKS": 4},
+     "score": 61.2, "default_score": 48.7, "tracks": ["plain", "oval"], "seeds": [0, 1], ...}
+
+With TUNING_FILE set, the script's main() calls ``load_tuning`` before
+anything is set up, which overwrites those globals. Only names the script
+already has are set, and a profile written for another script is refused.
+Everything but ``script`` and ``settings`` is the tuner's record of how
+the profile was found, kept for reading.
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def save_tuning(path, script, settings, **details):
+    profile = dict(details, script=script, settings=dict(settings))
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+
+
+def load_tuning(path, config, script):
+    """Set the globals in ``config`` named in the profile at ``path``; returns the settings applied."""
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        logger.warning('No tuning profile from %s: %s', path, e)
+        return {}
+    if profile.get('script') != script:
+        logger.warning('Tuning profile %s is for %s, not %s; not used', path, profile.get('script'), script)
+        return {}
+    applied = {}
+    for name, value in sorted(profile.get('settings', {}).items()):
+        if not name.isupper() or name not in config:
+            logger.warning('Tuning profile %s: %s is not a setting of %s', path, name, script)
+            continue
+        config[name] = applied[name] = value
+    logger.info('Tuning profile %s: %s', path, ', '.join('%s=%r' % item for item in sorted(applied.items())))
+    return applied
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-from ev3dev2.motor import LargeMotor, MediumMotor, OUTPUT_A, OUTPUT_B, OUTPUT_C, OUTPUT_D
+from robot.devices import Devices
 
-left_wheel = LargeMotor(OUTPUT_A)
-right_wheel = LargeMotor(OUTPUT_B)
+devices = Devices()
+left_wheel = devices.left_wheel
+right_wheel = devices.right_wheel
 
 left_wheel.stop()
 right_wheel.stop()
@@ -1,74 +1,12 @@
 #!/usr/bin/env python3
-from time import time
-try:
-    from ev3dev2.motor import LargeMotor, MediumMotor, OUTPUT_A, OUTPUT_B, OUTPUT_C
-    from ev3dev2.sensor import INPUT_1, INPUT_2, INPUT_3
-    from ev3dev2.sensor.lego import TouchSensor, ColorSensor
-    from ev3dev2.sound import Sound
-    from ev3dev2.led import Leds
-except Exception:
-    class MockMotor():
-        def __init__(self, *args, **kwargs):
-            pass
-        def on(self, speed, brake=False, block=False):
-            print(f"[MOTOR] on: {speed}")
-
-        def stop(self):
-            print("[MOTOR] stop")
-
-        def on_for_degrees(self, speed, degrees):
-            print(f"[MOTOR] on_for_degrees: {speed}, {degrees}")
-
-    class MockColorSensor():
-        def __init__(self, *args, **kwargs):
-            pass
-        @property
-        def rgb(self):
-            # Simulate RGB values that randomly match BLACK, WHITE, GREEN, etc.
-            return [
-                (30, 30, 30),  # BLACK
-                (120, 120, 120),  # WHITE
-                (40, 110, 30),  # GREEN
-                (130, 50, 50),  # RED
-                (200, 200, 200)  # BRIGHT WHITE
-            ][int(time() * 1000) % 5]
-
-    class MockTouchSensor():
-        checked = 0
-        def __init__(self, *args, **kwargs):
-            pass
-        @property
-        def is_pressed(self):
-            if self.checked  >= 2:
-                return False
-            self.checked +=1
-            return True
-
-    class MockSound():
-        def __init__(self, *args, **kwargs):
-            pass
-        def play_tone(self, freq, duration):
-            print(f"[SOUND] Playing tone: {freq}Hz for {duration}s")
-
-    class MockLeds():
-        def __init__(self, *args, **kwargs):
-            pass
-        def set_color(self, side, color):
-            print(f"[LED] {side}: {color}")
-
-    # Replace hardware classes with mocks
-    TouchSensor = MockTouchSensor
-    ColorSensor = MockColorSensor
-    LargeMotor = MediumMotor = MockMotor
-    Sound = MockSound
-    Leds = MockLeds
-
-    # Constants to avoid hardware errors
-    INPUT_1 = INPUT_2 = INPUT_3 = None
-    OUTPUT_A = OUTPUT_B = OUTPUT_C = None
+from robot.devices import Script, time, sleep
 
 import logging
-from time import sleep
+from robot.colors import TABLE_V2
+from robot.fsm import ANY, StateMachine, when
+from robot.logpipe import LogPipeline
+from robot.loopstats import LoopStats
+from robot.tuning import load_tuning
 # === CONFIGURATION ===
 # Hardcoded parameters for maximum speed and minimal dependencies
 SOURCE_COLOR = 'RED'
@@ -85,6 +23,22 @@ RECOVERY_OSCILLATIONS = 3
 RECOVERY_OSCILLATE_DURATION = 0.2
 RECOVERY_BACKUP_DURATION = 0.1
 RECOVERY_ITERATIONS= 20 #LOST_LINE_THRESHOLD
+USE_SAMPLER = False  # read sensors on a background thread (robot/sampler.py)
+SAMPLER_RATE_HZ = 100
+FAST_SYSFS = False  # raw sysfs driver for color sensors and motors (robot/sysfs.py)
+ASYNC_LOGGING = False  # queue log records and print() lines, write them on a background thread (robot/logpipe.py)
+TELEMETRY_FILE = None  # e.g. 'telemetry.bin': binary record of every loop iteration (robot/telemetry.py)
+CALIBRATION_FILE = 'calibration.json'  # color tables from calibration mode, used when present (robot/calibration.py)
+CALIBRATION_HOLD = 2.0  # seconds to hold the button at "ready" to start calibration mode
+TUNING_FILE = None  # e.g. 'tuning.json': settings found by bench/tune.py, applied when main() starts (robot/tuning.py)
+PROFILE = None  # 'cprofile' or 'sample': where the loop's time goes; ROBOT_PROFILE or --profile MODE[:SECONDS] at launch (robot/profiling.py)
+PROFILE_FILE = 'profile'  # written as profile.prof (cprofile) or profile.folded (sample) when profiling stops
+PROFILE_SECONDS = 60.0  # seconds profiled once the robot is started, 0 for until the script stops
+PROFILE_INTERVAL = 0.005  # seconds between stacks taken in sample mode
+FILTER_WINDOW = 3  # last readings per sensor a marker color is voted over, 1 turns filtering off (robot/filter.py)
+FILTER_VOTE = 'majority'  # or 'median': the median rgb of the window must classify as the marker
+LINE_HYSTERESIS = 1  # consecutive readings needed to switch between BLACK and WHITE
+COALESCE_WRITES = True  # skip motor and LED commands that repeat what the hardware is doing (robot/drive.py)
 
 # === STATE MACHINE DEFINITIONS ===
 STATE_IDLE = 0
@@ -92,68 +46,40 @@ STATE_TO_SOURCE = 1
 STATE_TO_TARGET = 2
 STATE_DELIVERED = 3
 
+# States the transport table runs in, with their names for the log.
+TRANSPORT_STATES = {STATE_TO_SOURCE: 'TO_SOURCE', STATE_TO_TARGET: 'TO_TARGET'}
+
 # === LOGGING SETUP ===
 LOG_FILE = 'robot.log'
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(message)s')
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+if ASYNC_LOGGING:
+    LogPipeline(LOG_FILE, LOG_FORMAT).install(logging.INFO, capture_stdout=True)
+else:
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
+loop_stats = LoopStats('run_transport_cycle')
 
 # logger.basicConfig(level=logging.DEBUG)
 
 # === DEVICE INITIALIZATION ===
-def init_devices():
-    """Initialize all motors, sensors, sound, and LEDs as global variables."""
-    global touch_sensor, color_sensor1, color_sensor2, left_wheel, right_wheel, lift, sound, leds
-    touch_sensor = TouchSensor(INPUT_1)
-    color_sensor2 = ColorSensor(INPUT_2)
-    color_sensor1 = ColorSensor(INPUT_3)
-    left_wheel = LargeMotor(OUTPUT_A)
-    right_wheel = LargeMotor(OUTPUT_B)
-    lift = MediumMotor(OUTPUT_C)
-    sound = Sound()
-    leds = Leds()
-
-# === LED FEEDBACK ===
-def set_led_status(status):
-    """Set LED color and pattern based on status string. Uses more distinct colors and patterns for clarity."""
-    # Color map: (left_color, right_color)
-    color_map = {
-        'ready':    ('GREEN', 'GREEN'),         # Ready to start
-        'lost':     ('ORANGE', 'ORANGE'),       # Lost line
-        'error':    ('RED', 'RED'),             # Error state
-        'working':  ('GREEN', 'AMBER'),         # Following line/working
-        'pickup':   ('AMBER', 'AMBER'),          # Picking up object
-        'drop':     ('AMBER', 'AMBER'),          # Dropping object
-        'pause':    ('YELLOW', 'RED'),          # Paused
-        'stopped':  ('RED', 'BLACK'),           # Stopped by user
-        'default':  ('BLACK', 'BLACK'),         # All off
-    }
-    left, right = color_map.get(status, color_map['default'])
-    leds.set_color('LEFT', left)
-    leds.set_color('RIGHT', right)
+# devices, button, the sensors and motors, sampler, recorder, profiler, the
+# color tables and filters are globals that script sets (robot/devices.py).
+# A sensor that cannot be read gives 'UNKNOWN' and the error LEDs.
+script = Script(globals(), ('color_sensor_l', 'color_sensor_r', 'left_wheel', 'right_wheel', 'lift'),
+                TABLE_V2, read_errors=True)
+init_devices, attach_devices = script.init_devices, script.attach_devices
+init_filters, reset_filters, get_readings = script.init_filters, script.reset_filters, script.get_readings
+set_led_status, stop_all_motors = script.set_led_status, script.stop_all_motors
 
 # === COLOR DETECTION ===
-def get_color(sensor):
+def get_color(sensor, table=TABLE_V2):
     """Return color string based on RGB values from a ColorSensor."""
     try:
-        r, g, b = sensor.rgb
+        return devices.get_color(sensor, table)
     except Exception as e:
         logger.error('Sensor read error: ', e)
         set_led_status('error')
         return 'UNKNOWN'
-    if r > 100 and g > 100 and b > 100:
-        return 'WHITE'
-    # if r < 70 and g < 120 and b > 100:
-    #     return 'BLUE'
-    if r < 50 and g > 100 and b < 40:
-        return 'GREEN'
-    if r < 100 and g < 100 and b < 100:
-        return 'BLACK'
-    if r > 120 and g < 60 and b < 60:
-        return 'RED'
-    # if r > 120 and g > 100 and b < 60:
-    #     return 'YELLOW'
-    return 'WHITE'
 
 # === ACTIONS ===
 def pick_up():
@@ -181,36 +107,11 @@ def turn_around(base_speed=BASE_SPEED, duration=TURN_DURATION):
     # sleep(0.2)
     set_led_status('ready')
 
-# === MOTOR SAFETY ===
-def stop_all_motors():
-    """Stop all drive and lift motors."""
-    logger.info('Stopping all motors')
-    left_wheel.on(0, brake=False, block=False)
-    right_wheel.on(0, brake=False, block=False)
-    left_wheel.stop()
-    right_wheel.stop()
-    lift.on(0, brake=False, block=False)
-    lift.stop()
-
-# === LINE FOLLOWING ===
-def get_colors() -> (str, str):
-    """Perform one step of proportional line following. Returns detected colors."""
-    lcol = get_color(color_sensor1)
-    rcol = get_color(color_sensor2)
-    return lcol, rcol
-
 # === BUTTON HANDLING ===
 def wait_for_button_press(prompt='Waiting for button press to start...'):
-    """Block until the touch sensor is pressed and released."""
+    """Print ``prompt`` and wait for the button (robot.devices.Script.wait_for_button_press)."""
     print(prompt)
-    logger.info('Awaiting button press: %s', prompt)
-    set_led_status('ready')
-    while not touch_sensor.is_pressed:
-        sleep(0.05)
-    while touch_sensor.is_pressed:
-        sleep(0.05)
-    logger.info('Button pressed')
-    set_led_status('working')
+    return script.wait_for_button_press(prompt)
 
 # === LOST LINE RECOVERY ===
 def lost_line_recovery(base_speed=BASE_SPEED):
@@ -222,8 +123,8 @@ def lost_line_recovery(base_speed=BASE_SPEED):
         left_wheel.on(-base_speed)
         right_wheel.on(-base_speed)
         sleep(RECOVERY_BACKUP_DURATION)
-        lcol = get_color(color_sensor1)
-        rcol = get_color(color_sensor2)
+        lcol = get_color(color_sensor_l, left_table)
+        rcol = get_color(color_sensor_r, right_table)
         if lcol == 'BLACK' or rcol == 'BLACK':
             print('Line recovered, continuing previous action...')
             return True
@@ -232,85 +133,147 @@ def lost_line_recovery(base_speed=BASE_SPEED):
 
 
 def go(left, right):
-    left_wheel.on(left)
-    right_wheel.on(right)
+    devices.go(left, right)
+
+# === TRANSPORT TABLE ===
+# Reset at the start of every cycle.
+lost_counter = 0
+turn_reduction = 0
+last_state = 1
+
+def limit_turn_reduction():
+    global turn_reduction
+    turn_reduction=min(turn_reduction, BASE_SPEED/2)
+    turn_reduction=max(0,turn_reduction)
+
+# Actions and hooks take the reading (lrgb, rrgb, lcol, rcol) (robot/fsm.py).
+def drive_straight(reading):
+    global lost_counter
+    limit_turn_reduction()
+    go(BASE_SPEED, BASE_SPEED)
+    lost_counter += 1
+    if lost_counter > LOST_LINE_THRESHOLD:
+        lost_line_recovery()
+        lost_counter = 0
+
+def steer_right(reading):
+    global turn_reduction, last_state, lost_counter
+    limit_turn_reduction()
+    go(-BASE_SPEED,-BASE_SPEED*0.7)
+    sleep(0.05)
+    go(BASE_SPEED-turn_reduction, -BASE_SPEED+turn_reduction)
+    turn_reduction -= last_state
+    last_state = 1
+    lost_counter = 0
+
+def steer_left(reading):
+    global turn_reduction, last_state, lost_counter
+    limit_turn_reduction()
+    go(-BASE_SPEED*0.7,-BASE_SPEED)
+    sleep(0.05)
+    go(-BASE_SPEED+turn_reduction, BASE_SPEED-turn_reduction)
+    turn_reduction += last_state
+    last_state = -1
+    lost_counter = 0
+
+def hold_course(reading):
+    limit_turn_reduction()
+
+def search_line(reading):
+    go(BASE_SPEED*last_state,-BASE_SPEED*last_state)
+
+def load_at_source(reading):
+    stop_all_motors()
+    pick_up()
+    turn_around()
+
+def unload_at_target(reading):
+    stop_all_motors()
+    drop()
+    turn_around()
+
+def transport_rules():
+    """(state, left color, right color, action, next state) rules, the first match wins."""
+    return [
+        when(ANY, 'WHITE', 'WHITE', drive_straight),
+        when(ANY, 'BLACK', 'WHITE', steer_right),
+        when(ANY, 'WHITE', 'BLACK', steer_left),
+        when(ANY, 'WHITE', ANY, hold_course),
+        when(ANY, ANY, 'WHITE', hold_course),
+        when(STATE_TO_SOURCE, SOURCE_COLOR, ANY, then=STATE_TO_TARGET),
+        when(STATE_TO_SOURCE, ANY, SOURCE_COLOR, then=STATE_TO_TARGET),
+        when(STATE_TO_TARGET, TARGET_COLOR, ANY, then=STATE_TO_SOURCE),
+        when(STATE_TO_TARGET, ANY, TARGET_COLOR, then=STATE_TO_SOURCE),
+        when(ANY, 'BLACK', 'BLACK', search_line),
+    ]
+
+machine = None
+
+def init_machine():
+    """Compile the transport table and log what validation finds in it (robot/fsm.py)."""
+    global machine
+    machine = StateMachine('transport', TRANSPORT_STATES, transport_rules(), STATE_TO_SOURCE, on_enter={
+        STATE_TO_TARGET: load_at_source,
+        STATE_TO_SOURCE: unload_at_target,
+    })
+    machine.check()
 
 # === MAIN TRANSPORT ROUTINE WITH STATE MACHINE ===
 def run_transport_cycle(state):
-    """Run a single transport cycle using a state machine."""
+    """Run a single transport cycle using a state machine; it ends at a station."""
+    global lost_counter, turn_reduction, last_state
     lost_counter = 0
     turn_reduction=0
     last_state=1
+    loop_stats.start()
+    reset_filters()
+    machine.reset(state)
     while True:
+        loop_stats.tick()
+        if profiler is not None:
+            profiler.check()
         print("Lost line counter: ", lost_counter)
-        lcol, rcol = get_colors()
-        
-        if 'WHITE' in (rcol, lcol):
-            turn_reduction=min(turn_reduction, BASE_SPEED/2)
-            turn_reduction=max(0,turn_reduction)
-            if lcol == 'WHITE' and rcol == 'WHITE':
-                go(BASE_SPEED, BASE_SPEED)
-                lost_counter += 1
-                if lost_counter > LOST_LINE_THRESHOLD:
-                    recovered = lost_line_recovery()
-                    lost_counter = 0
-                    if not recovered:
-                        continue
-            elif(lcol == 'BLACK'):
-                go(-BASE_SPEED,-BASE_SPEED*0.7)
-                sleep(0.05)
-                go(BASE_SPEED-turn_reduction, -BASE_SPEED+turn_reduction)
-                turn_reduction -= last_state
-                last_state = 1
-                lost_counter = 0
-            elif(rcol == 'BLACK'):
-                go(-BASE_SPEED*0.7,-BASE_SPEED)
-                sleep(0.05)
-                go(-BASE_SPEED+turn_reduction, BASE_SPEED-turn_reduction)
-                turn_reduction += last_state
-                last_state = -1
-                lost_counter = 0
-            continue
-            
-        if state == STATE_TO_SOURCE and (lcol == SOURCE_COLOR or rcol == SOURCE_COLOR):
-            stop_all_motors()
-            pick_up()
-            state = STATE_TO_TARGET
-            turn_around()
-            break
-        elif state == STATE_TO_TARGET and (lcol == TARGET_COLOR or rcol == TARGET_COLOR):
-            stop_all_motors()
-            drop()
-            state = STATE_TO_SOURCE
-            turn_around()
-            break
-        if touch_sensor.is_pressed:
+        reading = get_readings()
+        if recorder is not None:
+            lrgb, rrgb, lcol, rcol = reading
+            recorder.record(time(), lrgb, rrgb, lcol, rcol, state, left_wheel, right_wheel, lift)
+        if button.stop_requested:
             stop_all_motors()
+            loop_stats.log_summary()
             logger.info('Button pressed, stopping')
             return STATE_IDLE
-        if lcol == 'BLUE' and rcol == 'BLUE':
-            stop_all_motors()
-            sleep(1)
-        elif lcol == 'BLACK' and rcol == 'BLACK':
-            go(BASE_SPEED*last_state,-BASE_SPEED*last_state)
-            # left_wheel.on(BASE_SPEED)
-            # right_wheel.on(BASE_SPEED)
-            # sleep(0.25)
-    return state
+        if machine.step(reading) != state:
+            return machine.state
 
 # === MAIN ENTRY POINT ===
 def main():
     """Main program loop handling repeated transport cycles and safe shutdown."""
+    if TUNING_FILE:
+        load_tuning(TUNING_FILE, globals(), 'test')
+    init_machine()
+    init_filters()
     init_devices()
-    # sound.play_tone(220, 0.4)
     state = STATE_TO_SOURCE
     try:
+        # The motors and color sensors finish loading while waiting for the first press.
+        calibrating = wait_for_button_press()
+        attach_devices()
+        script.load_calibration()
+        while calibrating:
+            script.calibrate_colors()
+            calibrating = wait_for_button_press()
+        if USE_SAMPLER:
+            script.start_sampler()
+        if TELEMETRY_FILE:
+            script.start_recorder()
+        script.start_profiling()
         while True:
-            wait_for_button_press()
             while state in (STATE_TO_SOURCE, STATE_TO_TARGET):
                 state = run_transport_cycle(state)
             # After button stop, go back to IDLE (wait for next press)
             state = STATE_TO_SOURCE
+            while wait_for_button_press():
+                script.calibrate_colors()
     except KeyboardInterrupt:
         stop_all_motors()
         print('KeyboardInterrupt, motors stopped')
@@ -327,6 +290,15 @@ def main():
     finally:
         stop_all_motors()
         set_led_status('error')
+        script.stop_sampler()
+        script.stop_recorder()
+        script.stop_profiling()
+        button.log_stats()
+        devices.log_summary()
+        loop_stats.log_summary()
+        if left_filter is not None:
+            left_filter.log_summary('Left')
+            right_filter.log_summary('Right')
 
 if __name__ == '__main__':
     main()